@@ -0,0 +1,205 @@
+# asgi.py
+# Entry point asyncio: uvicorn asgi:app
+# Stessi handler, storage e sessioni di bot.py; le chiamate a Telegram passano da un unico
+# client httpx sull'event loop, gli handler (sync) girano in un pool di thread con una coda per chat.
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import bot
+from dispatcher import chat_key
+from ratelimit import RateLimitedClient
+from telegram_api import AsyncTelegramClient, LoopBridgeClient
+
+# quanti handler possono essere in esecuzione contemporaneamente (chat diverse)
+ASGI_HANDLER_THREADS = int(os.environ.get("ASGI_HANDLER_THREADS", 200))
+ASGI_MAX_CONNECTIONS = int(os.environ.get("ASGI_MAX_CONNECTIONS", 100))
+
+
+class AsyncBot:
+    """
+    Scheduler asyncio degli update: una catena di task per chat (ordine garantito nella chat),
+    chat diverse in parallelo, limite sugli update in sospeso come il webhook sync.
+    """
+
+    def __init__(self, handler_threads=ASGI_HANDLER_THREADS, maxsize=bot.WEBHOOK_QUEUE_SIZE):
+        self.handler_threads = handler_threads
+        self.maxsize = maxsize
+        self.loop = None
+        self.client = None
+        self.executor = None
+        self._tails = {}       # chat -> ultimo task della catena
+        self._outstanding = 0
+        self.counters = {"submitted": 0, "rejected": 0, "processed": 0, "errors": 0}
+
+    async def startup(self):
+        self.loop = asyncio.get_running_loop()
+        self.client = AsyncTelegramClient(bot.BOT_TOKEN, base_url=bot.TELEGRAM_API_URL,
+                                          max_connections=ASGI_MAX_CONNECTIONS)
+        self.executor = ThreadPoolExecutor(max_workers=self.handler_threads, thread_name_prefix="asgi-handler")
+        # gli helper di bot.py (send_message, download_file, ...) usano il client async
+        bot.tg = RateLimitedClient(LoopBridgeClient(self.client, self.loop), bot.send_scheduler,
+                                   on_call=bot.observe_telegram_call)
+        bot.start_publishing()
+
+    async def shutdown(self):
+        pending = [t for t in self._tails.values() if not t.done()]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        bot.deduplicator.flush()
+        bot.session_store.flush()
+        await self.loop.run_in_executor(self.executor, bot.deleter.flush)
+        self.executor.shutdown(wait=True)
+        await self.client.aclose()
+
+    def submit(self, update):
+        if self._outstanding >= self.maxsize:
+            self.counters["rejected"] += 1
+            return False
+        if bot.deduplicator.seen(update.get("update_id")):
+            return True
+        self._outstanding += 1
+        self.counters["submitted"] += 1
+        key = chat_key(update)
+        prev = self._tails.get(key)
+        task = self.loop.create_task(self._run(key, update, prev))
+        self._tails[key] = task
+        return True
+
+    async def _run(self, key, update, prev):
+        if prev is not None:
+            await asyncio.gather(prev, return_exceptions=True)
+        try:
+            await self.loop.run_in_executor(self.executor, bot.process_update, update)
+            self.counters["processed"] += 1
+        except Exception as e:
+            self.counters["errors"] += 1
+            await self.loop.run_in_executor(self.executor, bot.report_update_error, update, e)
+        finally:
+            self._outstanding -= 1
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    def stats(self):
+        return dict(self.counters, queue_depth=self._outstanding, queue_max=self.maxsize,
+                    active_chats=len(self._tails), handler_threads=self.handler_threads)
+
+
+async_bot = AsyncBot()
+# le metriche della coda (/metrics) leggono lo scheduler asyncio, non il dispatcher sync inattivo
+bot.queue_stats = async_bot.stats
+
+
+# -----------------------------
+# APP ASGI
+# -----------------------------
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/webhook" and method == "POST":
+        body = await read_body(receive)
+        try:
+            update = json.loads(body or b"{}")
+        except ValueError:
+            return await send_json(send, {"ok": False, "error": "bad json"}, status=400)
+        if not async_bot.submit(update):
+            return await send_json(send, {"ok": False, "error": "queue full"}, status=503)
+        return await send_json(send, {"ok": True})
+    if path == "/stats":
+        return await send_json(send, {"queue": async_bot.stats(), "dedup": bot.deduplicator.stats(),
+                                      "telegram": bot.tg.stats(), "rate_limit": bot.send_scheduler.stats(),
+                                      "deletes": bot.deleter.stats()})
+
+    # tutto il resto (/, /media, ...) lo serve l'app Flask in un thread
+    await run_wsgi(bot.app, scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await async_bot.startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_bot.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def run_wsgi(wsgi_app, scope, receive, send):
+    """Ponte minimale ASGI -> WSGI: la risposta viene inviata a pezzi, senza bufferizzarla tutta."""
+    loop = asyncio.get_running_loop()
+    body = await read_body(receive)
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_TYPE": headers.get("content-type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for k, v in headers.items():
+        if k not in ("content-type", "content-length"):
+            environ["HTTP_" + k.upper().replace("-", "_")] = v
+
+    started = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response_headers]
+        return lambda data: None
+
+    executor = async_bot.executor
+    result = await loop.run_in_executor(executor, wsgi_app, environ, start_response)
+    iterator = iter(result)
+    try:
+        first = await loop.run_in_executor(executor, next, iterator, None)
+        await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        chunk = first
+        while chunk is not None:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await loop.run_in_executor(executor, next, iterator, None)
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,268 @@
+# bench.py
+# Benchmark del percorso webhook -> worker -> Telegram contro il finto server (fake_telegram.py).
+# Uso: python bench.py [scenario ...] [--updates 2000] [--chats 200] [--rate 0] [--latency 0.02] [--rate-429 0.0]
+#                      [--backend json|sqlite] [--telegram-limits] [--output bench_output.txt] [--json]
+# Scenari: start, chat, admin, media (default: tutti). Dati e media finiscono in una cartella temporanea.
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+SCENARIOS = ("start", "chat", "admin", "media")
+# chat "pubbliche" usate dagli scenari start/chat (l'admin è bot.ADMIN_ID)
+FIRST_CHAT_ID = 10_000
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class UpdateFactory:
+    """Update sintetici come li manda Telegram (update_id e message_id progressivi)."""
+
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def message(self, chat_id, text=None, **fields):
+        self.update_id += 1
+        self.message_id += 1
+        message = {"message_id": self.message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False}}
+        if text is not None:
+            message["text"] = text
+        message.update(fields)
+        return {"update_id": self.update_id, "message": message}
+
+    def callback(self, chat_id, data):
+        self.update_id += 1
+        return {"update_id": self.update_id, "callback_query": {
+            "id": str(self.update_id), "data": data, "from": {"id": chat_id},
+            "message": {"message_id": self.message_id, "chat": {"id": chat_id, "type": "private"}}}}
+
+    def photo(self, chat_id, file_id, unique_id):
+        return self.message(chat_id, photo=[{"file_id": file_id, "file_unique_id": unique_id, "file_size": None}])
+
+
+# ---- scenari: liste di update ----
+def scenario_start(f, n, chats, admin_id):
+    """/start da molte chat (messaggio fissato, cronologia, cancellazioni)."""
+    return [f.message(FIRST_CHAT_ID + i % chats, "/start") for i in range(n)]
+
+
+def scenario_chat(f, n, chats, admin_id):
+    """Utenti senza sessione che scrivono testo libero, con qualche /start."""
+    return [f.message(FIRST_CHAT_ID + i % chats, "/start" if i % 10 == 0 else "ciao") for i in range(n)]
+
+
+def scenario_admin(f, n, chats, admin_id):
+    """Flow admin completi: aggiunta, ricerca con tastiera a pagine, modifica prezzo, rimozione."""
+    updates = []
+    i = 0
+    while len(updates) < n:
+        name = f"Prodotto bench {i}"
+        updates += [f.message(admin_id, t) for t in
+                    ("/aggiungi", "Prodotto", name, f"{i % 50 + 1}.90", f"Categoria {i % 8}", "nessuno")]
+        updates += [f.message(admin_id, t) for t in ("/modifica", "Prodotto", "bench")]
+        updates.append(f.callback(admin_id, "page:1"))
+        updates += [f.message(admin_id, t) for t in (name, "prezzo", f"{i % 50 + 2}.50")]
+        if i % 2:
+            updates += [f.message(admin_id, t) for t in ("/rimuovi", "Prodotto", name)]
+        i += 1
+    return updates[:n]
+
+
+def scenario_media(f, n, chats, admin_id):
+    """Aggiunta di prodotti con foto/video; un media su quattro è già stato caricato (stesso file_unique_id)."""
+    updates = []
+    i = 0
+    while len(updates) < n:
+        updates += [f.message(admin_id, t) for t in
+                    ("/aggiungi", "Prodotto", f"Media bench {i}", "9.90", "Media")]
+        # ogni quarto prodotto riusa il media di tre prodotti prima (stesso file_unique_id, file_id nuovo)
+        base = i - 3 if i % 4 == 3 else i
+        kind = "video" if base % 5 == 0 else "photo"
+        if kind == "video":
+            updates.append(f.message(admin_id, video={"file_id": f"video-{i}", "file_unique_id": f"u{base}"}))
+        else:
+            updates.append(f.photo(admin_id, f"photo-{i}", f"u{base}"))
+        i += 1
+    return updates[:n]
+
+
+SCENARIO_BUILDERS = {"start": scenario_start, "chat": scenario_chat, "admin": scenario_admin, "media": scenario_media}
+
+
+# ---- esecuzione ----
+def run_scenario(bot, fake, client, name, updates, rate=0.0, timeout=300):
+    """
+    Invia gli update a /webhook (tutti insieme, o `rate` al secondo) e misura: risposta del
+    webhook, latenza fino a fine handler (coda compresa), chiamate a Telegram per update.
+    """
+    done = {}
+    finished = threading.Event()
+    lock = threading.Lock()
+    handler = bot.dispatcher.handler
+
+    def timed(update):
+        try:
+            handler(update)
+        finally:
+            with lock:
+                done[update["update_id"]] = time.perf_counter()
+                if len(done) == len(updates):
+                    finished.set()
+
+    fake.reset()
+    errors_before = bot.dispatcher.stats()["errors"]
+    bot.dispatcher.handler = timed
+    sent, acks, rejected = {}, [], 0
+    start = time.perf_counter()
+    try:
+        for i, update in enumerate(updates):
+            if rate > 0:
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            t0 = time.perf_counter()
+            while True:
+                r = client.post("/webhook", json=update)
+                if r.status_code != 503:
+                    break
+                # coda piena: come Telegram, si riprova poco dopo
+                rejected += 1
+                time.sleep(0.01)
+            sent[update["update_id"]] = t0
+            acks.append(time.perf_counter() - t0)
+        finished.wait(timeout)
+    finally:
+        bot.dispatcher.handler = handler
+    end = max(done.values()) if done else time.perf_counter()
+    # download in background e cancellazioni differite fanno parte del costo dell'update
+    while bot.media_ingestor.stats().get("in_flight"):
+        time.sleep(0.01)
+    bot.deleter.flush()
+    tail = time.perf_counter()
+
+    latencies = [done[uid] - t0 for uid, t0 in sent.items() if uid in done]
+    calls = fake.stats()
+    n = len(updates)
+    return {
+        "scenario": name,
+        "updates": n,
+        "completed": len(done),
+        "errors": bot.dispatcher.stats()["errors"] - errors_before,
+        "rejected_503": rejected,
+        "elapsed_s": round(end - start, 3),
+        "drain_s": round(tail - end, 3),
+        "throughput_ups": round(len(done) / (end - start), 1) if end > start else 0.0,
+        "ack_ms": {"p50": round(percentile(acks, 50) * 1000, 2), "p99": round(percentile(acks, 99) * 1000, 2)},
+        "latency_ms": {"p50": round(percentile(latencies, 50) * 1000, 2),
+                       "p99": round(percentile(latencies, 99) * 1000, 2),
+                       "max": round(max(latencies) * 1000, 2) if latencies else 0.0},
+        "calls_per_update": round(calls["total_calls"] / n, 2) if n else 0.0,
+        "calls": {m: round(c / n, 3) for m, c in sorted(calls["calls"].items())},
+        "throttled_429": calls["throttled"],
+        "bytes_downloaded": calls["bytes_served"],
+    }
+
+
+def format_result(r):
+    lines = [
+        f"== {r['scenario']}: {r['completed']}/{r['updates']} update in {r['elapsed_s']} s "
+        f"({r['throughput_ups']} update/s, coda svuotata dopo altri {r['drain_s']} s)",
+        f"   webhook   p50 {r['ack_ms']['p50']} ms   p99 {r['ack_ms']['p99']} ms",
+        f"   latenza   p50 {r['latency_ms']['p50']} ms   p99 {r['latency_ms']['p99']} ms   max {r['latency_ms']['max']} ms",
+        f"   chiamate Telegram per update: {r['calls_per_update']}  "
+        + ", ".join(f"{m}={c}" for m, c in r["calls"].items()),
+        f"   429 simulati: {r['throttled_429']}   503 del webhook: {r['rejected_503']}   "
+        f"errori: {r['errors']}   byte scaricati: {r['bytes_downloaded']}",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del bot contro un finto server Telegram")
+    parser.add_argument("scenarios", nargs="*", help=f"scenari da eseguire ({', '.join(SCENARIOS)})")
+    parser.add_argument("--updates", type=int, default=2000, help="update per scenario")
+    parser.add_argument("--chats", type=int, default=200, help="chat diverse negli scenari start/chat")
+    parser.add_argument("--rate", type=float, default=0.0, help="update/s inviati (0 = tutti subito)")
+    parser.add_argument("--latency", type=float, default=0.02, help="latenza di ogni chiamata (secondi)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probabilità di risposta 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--file-size", type=int, default=256 * 1024, help="byte dei media generati")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--workers", type=int, default=None, help="WEBHOOK_WORKERS")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="mantiene i limiti di invio reali (1 msg/s per chat): misura il rate limiter")
+    parser.add_argument("--output", help="aggiunge i risultati a questo file (es. bench_output.txt)")
+    parser.add_argument("--json", action="store_true", help="stampa i risultati come JSON")
+    args = parser.parse_args(argv)
+    scenarios = args.scenarios or list(SCENARIOS)
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"scenari sconosciuti: {', '.join(unknown)}")
+
+    from fake_telegram import FakeTelegram
+    fake = FakeTelegram(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                        retry_after=args.retry_after, file_size=args.file_size, seed=1)
+    fake.start()
+
+    # la configurazione di bot.py si legge all'import: va impostata prima
+    data_dir = tempfile.mkdtemp(prefix="vetrina-bench-")
+    os.environ["TELEGRAM_API_URL"] = fake.url
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["STORAGE_BACKEND"] = args.backend
+    if args.workers:
+        os.environ["WEBHOOK_WORKERS"] = str(args.workers)
+    if not args.telegram_limits:
+        for key in ("TG_GLOBAL_RATE", "TG_CHAT_RATE", "TG_GROUP_RATE"):
+            os.environ.setdefault(key, "100000")
+    import bot
+    client = bot.app.test_client()
+
+    factory = UpdateFactory()
+    results = []
+    for name in scenarios:
+        updates = SCENARIO_BUILDERS[name](factory, args.updates, args.chats, bot.ADMIN_ID)
+        result = run_scenario(bot, fake, client, name, updates, rate=args.rate)
+        results.append(result)
+        if not args.json:
+            print(format_result(result), flush=True)
+
+    header = (f"# {time.strftime('%Y-%m-%d %H:%M:%S')} backend={args.backend} workers={bot.WEBHOOK_WORKERS} "
+              f"latency={args.latency}s jitter={args.jitter}s rate_429={args.rate_429} updates={args.updates} "
+              f"rate={args.rate or 'burst'}")
+    if args.json:
+        print(json.dumps({"config": header[2:], "results": results}, indent=2))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(header + "\n" + "\n".join(format_result(r) for r in results) + "\n\n")
+    shutdown(bot)
+    fake.stop()
+    return results
+
+
+def shutdown(bot):
+    """
+    Svuota il bot finché il finto Telegram è ancora in ascolto: altrimenti gli handler atexit
+    (cancellazioni in sospeso, pubblicazione...) chiamerebbero un server già fermo e l'uscita si bloccherebbe.
+    """
+    bot.dispatcher.join()
+    bot.dispatcher.shutdown()
+    bot.deleter.flush()
+    bot.deduplicator.flush()
+    bot.session_store.flush()
+    if bot.catalog_publisher is not None:
+        bot.catalog_publisher.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,38 @@
 # bot.py
 import os
+import sys
+import atexit
+import gzip
+import hashlib
 import json
-import time
+import logging
+import mimetypes
+import tempfile
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory
-import requests
+from urllib.parse import quote
+from flask import Flask, Response, abort, request, jsonify
+from werkzeug.utils import safe_join, send_file
+
+import bulk
+from catalog import Catalog
+from catalog_api import MAX_PAGE_SIZE, PAGE_SIZE, SORTS, CatalogFeed, decode_cursor
+from cleanup import DeleteBatcher
+from conversation import Conversation
+from dispatcher import UpdateDeduplicator, UpdateDispatcher
+from media import MediaIngestor, MediaStore, is_immutable_name
+from metrics import Registry, TimedProxy, Tracer
+from prerender import VetrinaRenderer
+from publish import (MANIFEST_CACHE_CONTROL, MANIFEST_NAME, SNAPSHOT_CACHE_CONTROL, CatalogPublisher,
+                     DirectorySink, is_snapshot_name)
+from ratelimit import RateLimitedClient, SendScheduler
+from search import SearchIndex
+from sessions import SessionStore
+from storage import make_storage
+from telegram_api import TelegramClient
+from tracking import MessageTracker
+from variants import derive_variants
 
 # -----------------------------
 # CONFIGURAZIONE
@@ -15,26 +42,170 @@ ADMIN_ID = 696973528
 MINI_APP_URL = "https://vetrina-rho.vercel.app"  # link tua miniapp
 HOSTNAME = "telegram-vetrina-bot.onrender.com"   # dominio render
 
-BASE_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
-FILE_API = f"https://api.telegram.org/file/bot{BOT_TOKEN}"
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+BASE_API = f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}"
+FILE_API = f"{TELEGRAM_API_URL}/file/bot{BOT_TOKEN}"
+
+# worker che processano gli update ricevuti dal webhook e dimensione massima della coda
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000))
+
+# tipi di update da ricevere (webhook e long polling): i pulsanti inline del picker arrivano come callback_query
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+# finestra di update_id recenti per scartare le riconsegne di Telegram (file opzionale,
+# condivisibile tra worker: i salvataggi si uniscono sotto lock e ogni worker rilegge quelli degli altri)
+DEDUP_WINDOW = int(os.environ.get("DEDUP_WINDOW", 10000))
+DEDUP_FILE = os.environ.get("DEDUP_FILE")
+
+# diagnostica: metriche Prometheus su /metrics e span per update nel log (logger "vetrina.trace"):
+# sempre per errori e update più lenti di TRACE_SLOW_MS, in più una quota TRACE_SAMPLE degli altri
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger("vetrina")
+TRACE_SAMPLE = float(os.environ.get("TRACE_SAMPLE", 0))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 1000))
+# errori anche in DM all'admin (comportamento precedente): ogni DM è un'altra chiamata a Telegram
+ADMIN_ERROR_DM = os.environ.get("ADMIN_ERROR_DM", "") == "1"
+registry = Registry(prefix="vetrina_")
+tracer = Tracer(sample=TRACE_SAMPLE, slow_ms=TRACE_SLOW_MS)
+updates_total = registry.counter("updates_total", "Update gestiti per flow e passo", ("mode", "step"))
+update_seconds = registry.histogram("update_seconds", "Durata della gestione di un update", ("mode", "step"))
+errors_total = registry.counter("errors_total", "Errori per punto di origine", ("where",))
+update_errors_total = registry.counter("update_errors_total", "Update finiti con un errore per flow e passo",
+                                       ("mode", "step"))
+telegram_seconds = registry.histogram("telegram_call_seconds", "Durata delle chiamate alla Bot API (retry compresi)",
+                                      ("method",))
+telegram_failures = registry.counter("telegram_call_failures_total", "Chiamate alla Bot API non riuscite", ("method",))
+telegram_wait = registry.histogram("telegram_ratelimit_wait_seconds", "Attesa nel limitatore di invio", ("method",))
+storage_seconds = registry.histogram("storage_seconds", "Durata delle operazioni di storage", ("op",))
+
+def observe_update(mode, step, seconds, error):
+    updates_total.inc(mode=mode, step=step)
+    update_seconds.observe(seconds, mode=mode, step=step)
+    if error:
+        update_errors_total.inc(mode=mode, step=step)
+    tracer.annotate(mode=mode, step=step)
+
+def observe_telegram_call(method, waited, seconds, ok):
+    telegram_seconds.observe(seconds, method=method)
+    telegram_wait.observe(waited, method=method)
+    if not ok:
+        telegram_failures.inc(method=method)
+    tracer.event("telegram", method, seconds, wait_ms=round(waited * 1000, 2), ok=ok)
+
+def observe_storage(op, seconds):
+    storage_seconds.observe(seconds, op=op)
+    tracer.event("storage", op, seconds)
+
+# client Telegram condiviso (pool keep-alive dimensionato sui thread che fanno chiamate)
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", WEBHOOK_WORKERS + 2))
+
+# limiti di invio di Telegram: ~30 msg/s in totale, ~1 msg/s per chat privata, 20/min per gruppo
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", 30))
+TG_CHAT_RATE = float(os.environ.get("TG_CHAT_RATE", 1))
+TG_GROUP_RATE = float(os.environ.get("TG_GROUP_RATE", 20 / 60))
+send_scheduler = SendScheduler(global_rate=TG_GLOBAL_RATE, global_burst=TG_GLOBAL_RATE,
+                               chat_rate=TG_CHAT_RATE, group_rate=TG_GROUP_RATE)
+tg = RateLimitedClient(TelegramClient(BOT_TOKEN, base_url=TELEGRAM_API_URL, pool_size=TELEGRAM_POOL_SIZE),
+                       send_scheduler, on_call=observe_telegram_call)
+
+# cancellazioni raccolte per chat e inviate in blocco dopo DELETE_BATCH_DELAY secondi
+DELETE_BATCH_DELAY = float(os.environ.get("DELETE_BATCH_DELAY", 0.5))
+deleter = DeleteBatcher(lambda: tg, delay=DELETE_BATCH_DELAY)
+atexit.register(deleter.flush)
 
 # Paths
 ROOT = Path(__file__).parent
-PRODUCTS_JSON = ROOT / "products.json"
-SESSIONS_JSON = ROOT / "sessions.json"
-MEDIA_DIR = ROOT / "media"
-MEDIA_DIR.mkdir(exist_ok=True)
-CATEGORIES_JSON = ROOT / "categories.json"
-# assicurati che il file esista (lo creeremo vuoto solo se necessario)
-if not CATEGORIES_JSON.exists():
-    CATEGORIES_JSON.write_text("[]", encoding="utf-8")
-
-# Thread lock
+# cartella dei dati (catalogo, sessioni, media): di default accanto al codice
+DATA_DIR = Path(os.environ.get("DATA_DIR", ROOT))
+PRODUCTS_JSON = DATA_DIR / "products.json"
+SESSIONS_JSON = DATA_DIR / "sessions.json"
+MEDIA_DIR = DATA_DIR / "media"
+MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+CATEGORIES_JSON = DATA_DIR / "categories.json"
+SQLITE_DB = Path(os.environ.get("SQLITE_DB", DATA_DIR / "vetrina.db"))
+
+# backend di persistenza: "json" (file come prima) oppure "sqlite" (WAL, migra i JSON al primo avvio)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+storage = TimedProxy(make_storage(STORAGE_BACKEND, PRODUCTS_JSON, CATEGORIES_JSON, SESSIONS_JSON, SQLITE_DB),
+                     observe_storage)
+
+# download dei media in background (dimensione massima, thread dedicati)
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", 20 * 1024 * 1024))
+MEDIA_WORKERS = int(os.environ.get("MEDIA_WORKERS", 2))
+# archivio content-addressed (media/<sha256>.<ext>) + indice file_unique_id -> file già scaricato
+MEDIA_INDEX_JSON = DATA_DIR / "media_index.json"
+media_store = MediaStore(MEDIA_DIR, index_path=MEDIA_INDEX_JSON)
+media_ingestor = MediaIngestor(lambda: tg, MEDIA_DIR, workers=MEDIA_WORKERS, max_bytes=MEDIA_MAX_BYTES,
+                               store=media_store)
+
+# servizio di /media: i nomi content-addressed sono immutabili (cache di un anno), gli altri
+# vengono rivalidati dopo MEDIA_MAX_AGE secondi. MEDIA_OFFLOAD = "x-accel" (nginx, con
+# location interna MEDIA_ACCEL_PREFIX) o "x-sendfile" (apache/lighttpd) lascia i byte al web server
+MEDIA_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", 300))
+MEDIA_OFFLOAD = os.environ.get("MEDIA_OFFLOAD", "").lower()
+MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "/_media/")
+
+# sessioni admin: scadono dopo SESSION_TTL secondi di inattività (flow abbandonati)
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 3600))
+session_store = SessionStore(storage, ttl=SESSION_TTL)
+atexit.register(session_store.flush)
+
+# Thread lock (tra processi le scritture sono serializzate dallo storage)
 lock = threading.Lock()
 
-# per tracciare i messaggi attivi di ogni chat
-messages_history = {}
-pinned_start = {}
+# catalogo residente (indici per id / nome / tipologia)
+catalog = Catalog(storage, lock=lock)
+# i media non più usati da nessun prodotto vengono eliminati
+catalog.on_media_released = media_store.release
+
+# ricerca per nome (parole, prefissi, trigrammi), aggiornata ad ogni modifica del catalogo
+search_index = SearchIndex(catalog)
+# prodotti per pagina nella tastiera inline di scelta prodotto (flow admin)
+PICKER_PAGE_SIZE = int(os.environ.get("PICKER_PAGE_SIZE", 8))
+
+# import/export massivo (/importa, /esporta): un job alla volta, fuori dai worker degli update
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", 20 * 1024 * 1024))
+BULK_MEDIA_WORKERS = int(os.environ.get("BULK_MEDIA_WORKERS", 8))
+bulk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk")
+
+# catalogo serializzato + gzip per /api/catalog, rigenerato solo quando i dati cambiano
+catalog_feed = CatalogFeed(catalog, lambda: all_categories(), storage)
+
+# pubblicazione statica per la Mini App (servita da /catalog/ o copiata altrove): dopo PUBLISH_DELAY
+# secondi senza modifiche (al più PUBLISH_MAX_DELAY) snapshot immutabile + manifest in PUBLISH_DIR.
+# PUBLISH_DIR vuoto disattiva la pubblicazione
+PUBLISH_DIR = os.environ.get("PUBLISH_DIR", str(DATA_DIR / "public"))
+PUBLISH_DELAY = float(os.environ.get("PUBLISH_DELAY", 2.0))
+PUBLISH_MAX_DELAY = float(os.environ.get("PUBLISH_MAX_DELAY", 30.0))
+PUBLISH_KEEP = int(os.environ.get("PUBLISH_KEEP", 5))
+catalog_publisher = None
+if PUBLISH_DIR:
+    catalog_publisher = CatalogPublisher(catalog_feed.snapshot, DirectorySink(PUBLISH_DIR), delay=PUBLISH_DELAY,
+                                         max_delay=PUBLISH_MAX_DELAY, keep=PUBLISH_KEEP)
+    catalog.subscribe(catalog_publisher.schedule)
+    atexit.register(catalog_publisher.flush)
+_publish_started = False
+
+def start_publishing():
+    # prima pubblicazione del processo: il manifest esiste anche se il catalogo non cambia.
+    # Non all'import: con gunicorn --preload il thread del publisher nascerebbe nel master, prima del fork
+    global _publish_started
+    if catalog_publisher is None or _publish_started:
+        return
+    _publish_started = True
+    catalog_publisher.schedule()
+
+# vetrina.html servita dal bot (/vetrina/) con la prima pagina del catalogo già nell'HTML,
+# rigenerata solo quando cambia lo snapshot del catalogo
+WEB_APP_DIR = ROOT / "web_app"
+vetrina_renderer = VetrinaRenderer(WEB_APP_DIR / "vetrina.html", catalog_feed.snapshot, page_size=PAGE_SIZE)
+
+# per tracciare i messaggi attivi di ogni chat (cronologia da ripulire + /start fissato),
+# limitato in memoria e condiviso tra i worker tramite lo storage
+TRACKING_MAX_CHATS = int(os.environ.get("TRACKING_MAX_CHATS", 10000))
+TRACKING_TTL = float(os.environ.get("TRACKING_TTL", 48 * 3600))
+tracker = MessageTracker(storage, max_chats=TRACKING_MAX_CHATS, ttl=TRACKING_TTL)
 
 
 
@@ -42,24 +213,10 @@ pinned_start = {}
 # FILE HELPERS
 # -----------------------------
 def load_products():
-    with lock:
-        if not PRODUCTS_JSON.exists():
-            return []
-        return json.loads(PRODUCTS_JSON.read_text(encoding="utf-8"))
+    return catalog.all()
 
 def save_products(products):
-    with lock:
-        PRODUCTS_JSON.write_text(json.dumps(products, ensure_ascii=False, indent=2), encoding="utf-8")
-
-def load_sessions():
-    with lock:
-        if not SESSIONS_JSON.exists():
-            return {}
-        return json.loads(SESSIONS_JSON.read_text(encoding="utf-8"))
-
-def save_sessions(sessions):
-    with lock:
-        SESSIONS_JSON.write_text(json.dumps(sessions, ensure_ascii=False, indent=2), encoding="utf-8")
+    catalog.replace_all(products)
 
 # -----------------------------
 # TELEGRAM HELPERS
@@ -76,16 +233,15 @@ def send_message(chat_id, text, reply_markup=None, parse_mode=None, is_start=Fal
     try:
         
         if not protect:
-            prev = messages_history.get(chat_id, [])
+            prev = tracker.history(chat_id)
             for mid in prev:
                 try:
                     delete_message(chat_id, mid)
                 except Exception:
                     pass
-            messages_history[chat_id] = []
         else:
             
-            prev_start = pinned_start.get(chat_id)
+            prev_start = tracker.pinned(chat_id)
             if prev_start:
                 try:
                     delete_message(chat_id, prev_start)
@@ -101,29 +257,35 @@ def send_message(chat_id, text, reply_markup=None, parse_mode=None, is_start=Fal
         if parse_mode:
             data["parse_mode"] = parse_mode
 
-        r = requests.post(f"{BASE_API}/sendMessage", data=data, timeout=10)
-        res = r.json()
+        res = tg.call("sendMessage", data=data)
         if res.get("ok"):
             mid = res["result"]["message_id"]
             if protect:
                 # salva come pinned start
-                pinned_start[chat_id] = mid
+                tracker.set_pinned(chat_id, mid)
             else:
                 # salva come unico messaggio "non-start"
-                messages_history[chat_id] = [mid]
+                tracker.set_history(chat_id, [mid])
             return mid
+        if not protect and prev:
+            # i precedenti sono già in cancellazione
+            tracker.set_history(chat_id, [])
     except Exception as e:
-        # non crashare: logga all'admin e continua
-        try:
-            requests.post(f"{BASE_API}/sendMessage", data={"chat_id": ADMIN_ID, "text": f"Errore send_message: {e}"})
-        except Exception:
-            pass
+        # non crashare: conta, logga e continua
+        errors_total.inc(where="send_message")
+        logger.exception("send_message verso %s fallito", chat_id)
+        if ADMIN_ERROR_DM:
+            try:
+                tg.call("sendMessage", data={"chat_id": ADMIN_ID, "text": f"Errore send_message: {e}"})
+            except Exception:
+                pass
     return None
 
 
 
 def delete_message(chat_id, message_id):
-    requests.post(f"{BASE_API}/deleteMessage", data={"chat_id": chat_id, "message_id": message_id})
+    # differita: le cancellazioni partono in blocco (deleteMessages) da un thread in background
+    deleter.schedule(chat_id, message_id)
 
 
 def send_photo(chat_id, photo_url, caption="", reply_markup=None):
@@ -133,116 +295,184 @@ def send_photo(chat_id, photo_url, caption="", reply_markup=None):
         data["parse_mode"] = "Markdown"
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup)
-    requests.post(f"{BASE_API}/sendPhoto", data=data)
+    tg.call("sendPhoto", data=data)
 
 
 def answer_with_keyboard(chat_id, text, options):
     keyboard = {"keyboard": [[o] for o in options], "one_time_keyboard": True, "resize_keyboard": True}
     send_message(chat_id, text, reply_markup=keyboard)
 
+def product_picker_markup(query, page=0):
+    """Tastiera inline con i migliori risultati di ricerca per query, a pagine; ritorna (markup, totale)."""
+    items, total = search_index.search(query, limit=PICKER_PAGE_SIZE, offset=page * PICKER_PAGE_SIZE)
+    rows = [[{"text": f"{p['nome']} — €{p.get('prezzo', '')}", "callback_data": f"pick:{p['id']}"}] for p in items]
+    nav = []
+    if page > 0:
+        nav.append({"text": "◀️", "callback_data": f"page:{page - 1}"})
+    if (page + 1) * PICKER_PAGE_SIZE < total:
+        nav.append({"text": "▶️", "callback_data": f"page:{page + 1}"})
+    if nav:
+        rows.append(nav)
+    return {"inline_keyboard": rows}, total
+
+def send_product_picker(turn, query, prompt):
+    """Mostra i prodotti che corrispondono a query (tutti se vuota); l'admin può scrivere per filtrare."""
+    markup, total = product_picker_markup(query)
+    turn.buffer["query"] = query
+    turn.save()
+    if not total:
+        turn.reply(f"Nessun prodotto trovato per '{query}'. Riprova con un altro nome.")
+        return
+    header = f"{prompt}\nRisultati per '{query}': {total}" if query else f"{prompt}\nScrivi parte del nome per cercare."
+    turn.reply(header, reply_markup=markup)
+
 
 def get_file_path(file_id):
-    r = requests.get(f"{BASE_API}/getFile", params={"file_id": file_id})
-    data = r.json()
+    data = tg.call("getFile", params={"file_id": file_id})
     if not data.get("ok"):
         return None
     return data["result"]["file_path"]
 
 def download_file(file_path, dest_path: Path):
-    url = f"{FILE_API}/{file_path}"
-    r = requests.get(url, stream=True)
-    if r.status_code == 200:
-        with open(dest_path, "wb") as f:
-            for chunk in r.iter_content(4096):
-                f.write(chunk)
-        return True
-    return False
+    return tg.download(file_path, dest_path)
+
+def media_from_message(message):
+    """(file_id, file_size, file_unique_id) del video o della foto più grande del messaggio, altrimenti None."""
+    if "video" in message:
+        video = message["video"]
+        return video["file_id"], video.get("file_size"), video.get("file_unique_id")
+    if "photo" in message:
+        photo = message["photo"][-1]
+        return photo["file_id"], photo.get("file_size"), photo.get("file_unique_id")
+    return None
+
+def ingest_media(chat_id, media, on_saved, prefix=""):
+    """
+    Avvia il download in background e avvisa l'admin: subito un messaggio di attesa,
+    poi on_saved(rel_path) a download completato oppure il messaggio d'errore.
+    """
+    file_id, size, unique_id = media
+    send_message(chat_id, f"{prefix}⏳ Caricamento media in corso...")
+
+    def failed(e):
+        send_message(chat_id, f"{prefix}❌ Media non salvato: {e}")
+
+    media_ingestor.submit(file_id, on_saved, failed, expected_size=size, unique_id=unique_id)
+
+def media_variants(rel_path):
+    """Miniature/poster per la vetrina (None se Pillow/ffmpeg non sono installati)."""
+    try:
+        return derive_variants(rel_path, MEDIA_DIR)
+    except Exception:
+        return None
+
+def release_if_unused(rel_path):
+    """Elimina un media appena scaricato che nessun prodotto ha poi usato."""
+    if not catalog.media_refs(rel_path):
+        media_store.release(rel_path)
 
 # -----------------------------
 # SESSION HELPERS
 # -----------------------------
-def start_adding_choice(chat_id, sessions):
+def start_adding_choice(turn):
     """
     Chiedi se l'admin vuole aggiungere un Prodotto o una Categoria.
     """
-    sessions[str(chat_id)] = {"mode": "adding_choice", "step": "choice", "buffer": {}}
-    save_sessions(sessions)
+    turn.start("adding_choice", "choice")
     # tastiera semplice
-    answer_with_keyboard(chat_id, "Cosa vuoi aggiungere? scegli:", ["Prodotto", "Categoria"])
+    turn.then(answer_with_keyboard, turn.chat_id, "Cosa vuoi aggiungere? scegli:", ["Prodotto", "Categoria"])
 
 
-def start_removing(chat_id, sessions):
-    sessions[str(chat_id)] = {"mode": "removing", "step": "choice", "buffer": {}}
-    save_sessions(sessions)
-    answer_with_keyboard(chat_id, "Cosa vuoi rimuovere? scegli:", ["Prodotto", "Categoria"])
+def start_removing(turn):
+    turn.start("removing", "choice")
+    turn.then(answer_with_keyboard, turn.chat_id, "Cosa vuoi rimuovere? scegli:", ["Prodotto", "Categoria"])
 
-def start_modifying(chat_id, sessions):
-    sessions[str(chat_id)] = {"mode": "modifying", "step": "choice", "buffer": {}}
-    save_sessions(sessions)
-    answer_with_keyboard(chat_id, "Vuoi modificare un *Prodotto* o una *Categoria*?", ["Prodotto", "Categoria"])
+def start_modifying(turn):
+    turn.start("modifying", "choice")
+    turn.then(answer_with_keyboard, turn.chat_id, "Vuoi modificare un *Prodotto* o una *Categoria*?", ["Prodotto", "Categoria"])
 
 def load_categories():
-    try:
-        return json.loads(CATEGORIES_JSON.read_text(encoding="utf-8"))
-    except Exception:
-        return []
+    return storage.load_categories()
 
 def save_categories(categories):
-    try:
-        CATEGORIES_JSON.write_text(json.dumps(categories, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception:
-        pass
-
-def list_products_by_category():
-    products = load_products()
-    # parte dai prodotti
-    by_cat = {}
-    for p in products:
-        cat = p.get("tipologia", "Senza categoria")
-        by_cat.setdefault(cat, []).append(p)
-    # aggiungi categorie vuote definite dall'admin (se non ci sono prodotti)
-    cats = load_categories()
-    for c in cats:
-        if c not in by_cat:
-            by_cat[c] = []
-    return by_cat
+    storage.save_categories(categories)
+    categories_changed()
+
+def update_categories(fn):
+    cats = storage.update_categories(fn)
+    if cats is not None:
+        categories_changed()
+    return cats
+
+def categories_changed():
+    # le categorie non passano dal catalogo: feed e pubblicazione vanno avvisati qui
+    catalog_feed.invalidate()
+    if catalog_publisher is not None:
+        catalog_publisher.schedule()
+
+def all_categories():
+    """Tipologie dei prodotti (in ordine) seguite dalle categorie vuote definite dall'admin."""
+    cats = catalog.categories()
+    return cats + [c for c in load_categories() if c not in cats]
 
 
 def find_product_by_name(name):
-    products = load_products()
-    for p in products:
-        if p.get("nome", "").strip().lower() == name.strip().lower():
-            return p
-    return None
+    return catalog.find_by_name(name)
 
 def remove_product_by_name(name):
-    products = load_products()
-    new = [p for p in products if p.get("nome","").strip().lower() != name.strip().lower()]
-    if len(new) == len(products):
-        return False
-    save_products(new)
-    return True
+    return catalog.remove_by_name(name)
+
+def remove_product(prod_id):
+    return catalog.remove(prod_id)
 
 def remove_category(cat_name):
-    products = load_products()
-    new = [p for p in products if p.get("tipologia","") != cat_name]
-    removed = len(products) - len(new)
-    save_products(new)
-    return removed
+    return catalog.remove_category(cat_name)
+
+def update_product(prod_id, **fields):
+    return catalog.update(prod_id, **fields)
+
+def run_import(chat_id, file_id, file_name, fmt):
+    """Scarica il documento inviato dall'admin e lo importa (gira in bulk_executor)."""
+    try:
+        file_path = get_file_path(file_id)
+        if not file_path:
+            send_message(chat_id, "❌ Impossibile scaricare il file da Telegram.")
+            return
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dest = Path(tmp_dir) / "import"
+            if not tg.download(file_path, dest, max_bytes=BULK_MAX_BYTES):
+                send_message(chat_id, "❌ Download del file fallito (o file troppo grande).")
+                return
+            with open(dest, "rb") as f:
+                report = bulk.import_catalog(f, fmt, catalog, media_ingestor, known_categories=all_categories(),
+                                             media_workers=BULK_MEDIA_WORKERS)
+        send_message(chat_id, f"✅ Import di {file_name} completato.\n{report.summary()}")
+    except Exception as e:
+        send_message(chat_id, f"❌ Import fallito: {e}")
+
+def run_export(chat_id, fmt):
+    """Scrive il catalogo in un file temporaneo riga per riga e lo invia come documento."""
+    try:
+        with tempfile.TemporaryFile() as f:
+            for chunk in bulk.iter_export(catalog.all(), fmt):
+                f.write(chunk)
+            f.seek(0)
+            res = tg.call("sendDocument", data={"chat_id": chat_id, "caption": f"Catalogo ({catalog.count()} prodotti)"},
+                          files={"document": (f"catalogo.{fmt}", f)})
+        if not res.get("ok"):
+            send_message(chat_id, f"❌ Invio del file fallito: {res.get('description', '')}")
+    except Exception as e:
+        send_message(chat_id, f"❌ Export fallito: {e}")
 
 def create_product_entry(buffer):
-    products = load_products()
-    new_id = int(time.time() * 1000)
     entry = {
-        "id": new_id,
+        "id": None,
         "nome": buffer.get("nome"),
         "prezzo": buffer.get("prezzo"),
         "tipologia": buffer.get("tipologia"),
         "immagine": buffer.get("immagine", "")
     }
-    products.append(entry)
-    save_products(products)
-    return entry
+    return catalog.add(entry)
 
 # -----------------------------
 # FLASK APP
@@ -253,486 +483,590 @@ app = Flask(__name__)
 def index():
     return "Bot Telegram vetrina attivo."
 
+def process_update(update):
+    with tracer.span("update", update_id=update.get("update_id")):
+        if "message" in update:
+            conversation.handle_message(update["message"])
+        elif "callback_query" in update:
+            conversation.handle_callback(update["callback_query"])
+
+def report_update_error(update, e):
+    errors_total.inc(where="update")
+    logger.error("Errore nell'update %s: %s", update.get("update_id"), e, exc_info=e)
+    if ADMIN_ERROR_DM:
+        send_message(ADMIN_ID, f"Errore nel webhook: {e}")
+
+# coda + pool di worker: il webhook risponde subito, gli update girano in background
+deduplicator = UpdateDeduplicator(window=DEDUP_WINDOW, path=DEDUP_FILE)
+dispatcher = UpdateDispatcher(process_update, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE,
+                              on_error=report_update_error, dedup=deduplicator)
+atexit.register(deduplicator.flush)
+
+@app.before_request
+def start_background():
+    start_publishing()
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
     update = request.get_json(force=True)
-    try:
-        if "message" in update:
-            handle_message(update["message"])
-    except Exception as e:
-        send_message(ADMIN_ID, f"Errore nel webhook: {e}")
+    if not dispatcher.submit(update):
+        # coda piena: un codice non-2xx fa ritentare Telegram più tardi
+        return jsonify({"ok": False, "error": "queue full"}), 503
     return jsonify({"ok": True})
 
+@app.route("/stats")
+def stats():
+    return jsonify({"queue": dispatcher.stats(), "dedup": deduplicator.stats(), "telegram": tg.stats(),
+                    "rate_limit": send_scheduler.stats(), "deletes": deleter.stats(),
+                    "tracking": tracker.stats(), "sessions": session_store.stats(),
+                    "media": media_ingestor.stats(), "catalog": catalog_feed.stats(),
+                    "search": search_index.stats(), "conversation": conversation.stats(),
+                    "tracing": tracer.stats(),
+                    "publish": catalog_publisher.stats() if catalog_publisher is not None else None,
+                    "vetrina": vetrina_renderer.stats()})
+
+# valori letti dalle statistiche dei componenti al momento dello scrape
+# (queue_stats: la coda degli update in uso, asgi.py la sostituisce con quella del suo scheduler)
+queue_stats = dispatcher.stats
+registry.sampled("webhook_queue_depth", "Update in coda o in esecuzione", lambda: queue_stats()["queue_depth"])
+registry.sampled("webhook_rejected_total", "Update rifiutati con 503 (coda piena)",
+                 lambda: queue_stats()["rejected"], kind="counter")
+registry.sampled("media_downloaded_bytes_total", "Byte di media scaricati e salvati",
+                 lambda: media_ingestor.stats()["bytes"], kind="counter")
+registry.sampled("media_in_flight", "Download di media in corso", lambda: media_ingestor.stats()["in_flight"])
+registry.sampled("deletes_pending", "Cancellazioni in attesa di deleteMessages", lambda: deleter.stats()["pending"])
+registry.sampled("sessions_writes_total", "Scritture delle sessioni admin",
+                 lambda: {k: v for k, v in session_store.stats().items() if k in ("sets", "deletes")},
+                 kind="counter", label="op")
+registry.sampled("catalog_products", "Prodotti nel catalogo", lambda: catalog.count())
+
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/traces")
+def traces():
+    """Ultimi span registrati (errori, update lenti e campione), i più recenti in fondo."""
+    return jsonify(tracer.recent())
+
+def catalog_response(body, gz, etag):
+    """Risposta JSON precompressa con ETag forte (la Mini App rivalida ad ogni apertura)."""
+    if "gzip" in request.accept_encodings:
+        resp = Response(gz, mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    return resp
+
+def not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    return resp
+
+@app.route("/api/search")
+def api_search():
+    """Ricerca per nome per la Mini App: ?q=&limit=&offset=&tipologia="""
+    try:
+        limit = min(MAX_PAGE_SIZE, max(1, int(request.args.get("limit", PAGE_SIZE))))
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit/offset non validi"}), 400
+    q = request.args.get("q", "")
+    items, total = search_index.search(q, limit=limit, offset=offset, tipologia=request.args.get("tipologia") or None)
+    resp = jsonify({"q": q, "total": total, "items": items})
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    return resp
+
+@app.route("/api/catalog")
+def api_catalog():
+    snap = catalog_feed.snapshot()
+    if any(k in request.args for k in ("tipologia", "sort", "cursor", "limit")):
+        return api_catalog_page(snap)
+    since = request.args.get("since")
+    if since == snap.version or snap.version in request.if_none_match:
+        catalog_feed.record("not_modified")
+        return not_modified(snap.version)
+    if since:
+        delta = catalog_feed.delta(since)
+        if delta is not None:
+            catalog_feed.record("deltas")
+            return catalog_response(delta[0], delta[1], f"{snap.version}.{since}")
+    # versione sconosciuta (troppo vecchia o di un altro deploy): catalogo completo
+    catalog_feed.record("full")
+    return catalog_response(snap.body, snap.gzip, snap.version)
+
+def api_catalog_page(snap):
+    """Una pagina del catalogo: ?tipologia=&sort=prezzo|-prezzo|nome|-nome&limit=&cursor="""
+    tipologia = request.args.get("tipologia") or None
+    sort = request.args.get("sort", "default")
+    if sort not in SORTS:
+        return jsonify({"ok": False, "error": f"sort deve essere uno di {', '.join(SORTS)}"}), 400
+    try:
+        limit = min(MAX_PAGE_SIZE, max(1, int(request.args.get("limit", PAGE_SIZE))))
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit non valido"}), 400
+    try:
+        cursor = request.args.get("cursor")
+        items, next_cursor, total = snap.page(tipologia, sort, decode_cursor(cursor) if cursor else None, limit)
+    except ValueError:
+        return jsonify({"ok": False, "error": "cursore non valido"}), 400
+    etag = f"{snap.version}." + hashlib.sha256(request.query_string).hexdigest()[:12]
+    if etag in request.if_none_match:
+        catalog_feed.record("not_modified")
+        return not_modified(etag)
+    catalog_feed.record("pages")
+    body = json.dumps({"version": snap.version, "categorie": snap.categories, "total": total,
+                       "items": items, "next": next_cursor}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return catalog_response(body, gzip.compress(body, compresslevel=6), etag)
+
+@app.route("/vetrina/")
+def vetrina():
+    """Mini App con griglia e tipologie già disegnate: il primo contenuto arriva con una sola richiesta."""
+    etag, body, gz = vetrina_renderer.render()
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    if "gzip" in request.accept_encodings:
+        resp = Response(gz, mimetype="text/html")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(body, mimetype="text/html")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+@app.route("/vetrina/<name>")
+def vetrina_asset(name):
+    # solo i file della Mini App (script.js); vetrina.html passa sempre dal prerender
+    if name == "vetrina.html" or name.startswith("."):
+        abort(404)
+    path = safe_join(str(WEB_APP_DIR), name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    resp = send_file(path, request.environ, conditional=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@app.route("/catalog/<name>")
+def catalog_static(name):
+    """
+    Catalogo pubblicato (PUBLISH_DIR): il manifest va rivalidato, gli snapshot catalog.<versione>.json
+    sono immutabili e vengono serviti già compressi (brotli o gzip) se il client li accetta.
+    """
+    if not PUBLISH_DIR or not (name == MANIFEST_NAME or (is_snapshot_name(name) and name.endswith(".json"))):
+        abort(404)
+    path = safe_join(PUBLISH_DIR, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    encoding = None
+    if name != MANIFEST_NAME:
+        for enc, ext in (("br", ".br"), ("gzip", ".gz")):
+            if enc in request.accept_encodings and os.path.isfile(path + ext):
+                encoding, path = enc, path + ext
+                break
+    resp = send_file(path, request.environ, mimetype="application/json", conditional=True)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = MANIFEST_CACHE_CONTROL if name == MANIFEST_NAME else SNAPSHOT_CACHE_CONTROL
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    return resp
+
 @app.route("/media/<path:filename>")
 def media_serve(filename):
-    return send_from_directory(str(MEDIA_DIR), filename)
+    path = safe_join(str(MEDIA_DIR), filename)
+    if path is None or not os.path.isfile(path) or os.path.basename(path).startswith("."):
+        abort(404)
+    etag = media_store.etag(path)
+    if is_immutable_name(os.path.basename(path)):
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = f"public, max-age={MEDIA_MAX_AGE}"
+
+    if MEDIA_OFFLOAD in ("x-accel", "x-sendfile"):
+        # il web server invia il file (Range compreso); qui solo la risposta condizionale
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+        else:
+            resp = Response(mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream")
+            if MEDIA_OFFLOAD == "x-accel":
+                # nginx decodifica l'URI interno: spazi, %, ? e caratteri non ASCII vanno codificati
+                resp.headers["X-Accel-Redirect"] = MEDIA_ACCEL_PREFIX + quote(filename)
+            else:
+                resp.headers["X-Sendfile"] = path
+        resp.set_etag(etag)
+    else:
+        # risposte 304 / 206 (Range per lo scorrimento dei video) gestite da werkzeug
+        resp = send_file(path, request.environ, conditional=True, etag=etag)
+        resp.headers["Accept-Ranges"] = "bytes"
+    resp.headers["Cache-Control"] = cache_control
+    return resp
 
-if __name__ == "__main__":
-    import os
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
 # -----------------------------
-# MESSAGE HANDLER
+# CONVERSAZIONI ADMIN
 # -----------------------------
-def handle_message(message):
-    chat_id = message["chat"]["id"]
-    text = message.get("text", "")
-    message_id = message.get("message_id")
-    sessions = load_sessions()
-    sess = sessions.get(str(chat_id), {})
-
-    # comandi
-    if text and text.startswith("/"):
-        command = text.split()[0].lower()
-
-        # elimina messaggio comando
-        if message_id:
-            delete_message(chat_id, message_id)
-
-
-        # /start disponibile per tutti
-        if command == "/start":
-            keyboard = {
-                "inline_keyboard": [[{"text": "🛒 Apri la Vetrina", "web_app": {"url": MINI_APP_URL}}]]
-            }
-
-            send_message(
-                chat_id,
-                "Benvenuto Fratm! Usa il pulsante sotto per aprire la vetrina.",
-                reply_markup=keyboard,
-                parse_mode="Markdown",
-                is_start=True
-            )
-
-            sessions.pop(str(chat_id), None)
-            save_sessions(sessions)
-            return
-
-        
-
-        # comandi admin solo per ADMIN_ID
-        if command in ("/aggiungi", "/rimuovi", "/modifica", "/info") and chat_id != ADMIN_ID:
-            send_message(chat_id, "❌ Non sei autorizzato a usare questo comando.")
-            return
-        
-        # gestione comandi admin
-        if command == "/info":
-            text = (
-                "Comandi disponibili:\n"
-                "/start - avvia il bot e mostra il pulsante\n"
-                "/aggiungi - aggiungi un nuovo prodotto\n"
-                "/rimuovi - rimuovi un prodotto o una categoria\n"
-                "/modifica - modifica un prodotto o una categoria\n"
-            )
-            send_message(chat_id, text)
-            return
-
-        if command == "/aggiungi":
-            # prima chiediamo quale tipo aggiungere
-            start_adding_choice(chat_id, sessions)
-            return
-
-        if command == "/rimuovi":
-            start_removing(chat_id, sessions)
-            return
-        if command == "/modifica":
-            start_modifying(chat_id, sessions)
-            return
-
-        send_message(chat_id, "Comando non riconosciuto. Usa /aggiungi /rimuovi /modifica")
+# (mode, step) -> gestore: sessione, cancellazione del messaggio e risposte gestite da Conversation
+conversation = Conversation(session_store, send=send_message, delete=delete_message,
+                            answer_callback=lambda cid: tg.call("answerCallbackQuery", data={"callback_query_id": cid}),
+                            is_admin=lambda chat_id: chat_id == ADMIN_ID, observer=observe_update)
+
+# passi in cui l'admin sta scegliendo un prodotto dalla tastiera inline
+PICKER_STEPS = ("remove_product", "modify_select_product")
+
+def select_product_to_modify(turn, prod):
+    turn.buffer["prod_id"] = prod["id"]
+    turn.goto("modify_field_choice")
+    turn.then(answer_with_keyboard, turn.chat_id, f"Cosa vuoi modificare di '{prod['nome']}'?",
+              ["nome", "prezzo", "media", "categoria"])
+
+# ---- CALLBACK (tastiere inline) ----
+@conversation.callback("page")
+def picker_page(turn, page):
+    """Cambio pagina della scelta prodotto: si aggiorna solo la tastiera del messaggio."""
+    if turn.step not in PICKER_STEPS:
         return
+    markup, _ = product_picker_markup(turn.buffer.get("query", ""), int(page))
+    turn.then(tg.call, "editMessageReplyMarkup", data={"chat_id": turn.chat_id, "message_id": turn.message_id,
+                                                       "reply_markup": json.dumps(markup)})
 
- 
-        # Gestione scelta quando siamo in "adding_choice" o "adding_category"
-    if sess and sess.get("mode") == "adding_choice":
-        step = sess.get("step")
-        if step == "choice":
-            # l'utente ha risposto "Prodotto" o "Categoria"
-            if not text:
-                answer_with_keyboard(chat_id, "Cosa vuoi aggiungere? scegli:", ["Prodotto", "Categoria"])
-                return
-            t = text.strip().lower()
-            # cancella il messaggio dell'utente per pulizia
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-            if t.startswith("prod"):
-                # avvia il flow prodotto (nome -> prezzo -> ...)
-                sessions[str(chat_id)] = {"mode": "adding", "step": "name", "buffer": {}}
-                save_sessions(sessions)
-                send_message(chat_id, "🟢 Aggiungi prodotto — inserisci il *nome* del prodotto:", parse_mode="Markdown")
-                return
-            elif t.startswith("cat"):
-                # avvia il flow per aggiungere una categoria
-                sessions[str(chat_id)] = {"mode": "adding_category", "step": "name", "buffer": {}}
-                save_sessions(sessions)
-                send_message(chat_id, "🟢 Aggiungi categoria — inserisci il *nome* della categoria:", parse_mode="Markdown")
-                return
-            else:
-                send_message(chat_id, "Rispondi 'Prodotto' o 'Categoria'.")
-                return
-
-    # Flow per aggiungere una categoria (semplice: chiedo il nome e lo salvo)
-    if sess and sess.get("mode") == "adding_category":
-        step = sess.get("step")
-        if step == "name":
-            if not text:
-                send_message(chat_id, "Inserisci il nome della categoria (testo).")
-                return
-            category_name = text.strip()
-            # cancella il messaggio dell'utente
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-            # carica categorie, aggiungi se non esiste, salva
-            cats = load_categories()
-            if category_name in cats:
-                send_message(chat_id, f"❌ La categoria '{category_name}' esiste già.")
-                sessions.pop(str(chat_id), None); save_sessions(sessions)
-                return
-            cats.append(category_name)
-            save_categories(cats)
-            send_message(chat_id, f"✅ Categoria aggiunta: {category_name}")
-            sessions.pop(str(chat_id), None); save_sessions(sessions)
-            return
-
-    
-    
-    if not sess:
-        send_message(chat_id, "Usa /aggiungi per aggiungere un prodotto, /rimuovi o /modifica. /start per info.")
+@conversation.callback("pick")
+def picker_pick(turn, prod_id):
+    if turn.step not in PICKER_STEPS:
         return
-
-    mode = sess.get("mode")
-    step = sess.get("step")
-    buffer = sess.get("buffer", {})
-
-    # ---- ADDING FLOW ----
-    if mode == "adding":
-        if step == "name":
-            if not text:
-                send_message(chat_id, "Inserisci il nome del prodotto (testo).")
-                return
-            buffer["nome"] = text.strip()
-
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-
-            sess["step"] = "prezzo"
-            sess["buffer"] = buffer
-            sessions[str(chat_id)] = sess
-            save_sessions(sessions)
-            send_message(chat_id, "Ok — inserisci il *prezzo* (es. 9.90):", parse_mode="Markdown")
-            return
-
-        if step == "prezzo":
-            if not text:
-                send_message(chat_id, "Inserisci il prezzo (testo numerico).")
-                return
-            buffer["prezzo"] = text.strip()
-
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-
-            sess["step"] = "categoria"
-            sess["buffer"] = buffer
-            sessions[str(chat_id)] = sess
-            save_sessions(sessions)
-            send_message(chat_id, "Inserisci la *categoria* (tipologia):", parse_mode="Markdown")
-            return
-
-        if step == "categoria":
-            if not text:
-                send_message(chat_id, "Inserisci la categoria (testo).")
-                return
-            buffer["tipologia"] = text.strip()
-
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-
-            sess["step"] = "media"
-            sess["buffer"] = buffer
-            sessions[str(chat_id)] = sess
-            save_sessions(sessions)
-            send_message(chat_id, "Ora invia un *video* o immagine, oppure scrivi 'nessuno'.", parse_mode="Markdown")
-            return
-
-        if step == "media":
-            if "video" in message:
-                file_id = message["video"]["file_id"]
-            elif "photo" in message:
-                file_id = message["photo"][-1]["file_id"]
-            elif text and text.strip().lower() == "nessuno":
-                file_id = None
-            else:
-                send_message(chat_id, "Invia un video o un’immagine o scrivi 'nessuno'.")
-                return
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-
-            if file_id:
-                fp = get_file_path(file_id)
-                if fp:
-                    ext = Path(fp).suffix or ""
-                    filename = f"{int(time.time()*1000)}{ext}"
-                    dest = MEDIA_DIR / filename
-                    if download_file(fp, dest):
-                        buffer["immagine"] = f"media/{filename}"
-                        send_message(chat_id, f"Media salvato come media/{filename}")
-            else:
-                buffer["immagine"] = ""
-
-            entry = create_product_entry(buffer)
-            send_message(chat_id, f"✅ Prodotto aggiunto:\nNome: {entry['nome']}\nPrezzo: {entry['prezzo']}\nCategoria: {entry['tipologia']}")
-            sessions.pop(str(chat_id), None); save_sessions(sessions)
-            return
-
-    # ---- REMOVING FLOW ----
-    if mode == "removing":
-        if step == "choice":
-            if not text:
-                send_message(chat_id, "Rispondi 'Prodotto' o 'Categoria'.")
-                return
-            t = text.strip().lower()
-            if t.startswith("prod"):
-                products = load_products()
-                if not products:
-                    send_message(chat_id, "Non ci sono prodotti.")
-                    sessions.pop(str(chat_id), None); save_sessions(sessions); return
-                names = [p["nome"] for p in products]
-                sess["step"] = "remove_product"; sess["buffer"] = {}
-                sessions[str(chat_id)] = sess; save_sessions(sessions)
-                answer_with_keyboard(chat_id, "Quale prodotto vuoi rimuovere?", names)
-                return
-            elif t.startswith("cat"):
-                by_cat = list_products_by_category()
-                cats = list(by_cat.keys())
-                if not cats:
-                    send_message(chat_id, "Non ci sono categorie.")
-                    sessions.pop(str(chat_id), None); save_sessions(sessions); return
-                sess["step"] = "remove_category"; sess["buffer"] = {}
-                sessions[str(chat_id)] = sess; save_sessions(sessions)
-                answer_with_keyboard(chat_id, "Quale categoria vuoi rimuovere?", cats)
-                return
-            else:
-                send_message(chat_id, "Rispondi 'Prodotto' o 'Categoria'.")
-                return
-
-        if step == "remove_product":
-            if not text:
-                send_message(chat_id, "Scrivi il nome del prodotto.")
-                return
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-
-            ok = remove_product_by_name(text.strip())
-            send_message(chat_id, f"{'✅ Rimosso' if ok else '❌ Non trovato'}: {text.strip()}")
-            sessions.pop(str(chat_id), None); save_sessions(sessions)
-            return
-
-        if step == "remove_category":
-            if not text:
-                send_message(chat_id, "Scrivi il nome della categoria.")
-                return
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-            removed = remove_category(text.strip())
-            send_message(chat_id, f"Rimossi {removed} prodotti dalla categoria '{text.strip()}'.")
-            sessions.pop(str(chat_id), None); save_sessions(sessions)
-            return
-
-    # ---- MODIFY FLOW ----
-    if mode == "modifying":
-        if step == "choice":
-            if not text:
-                send_message(chat_id, "Rispondi 'Prodotto' o 'Categoria'.")
-                return
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-            
-            t = text.strip().lower()
-            if t.startswith("cat"):
-                sess["step"] = "modify_category_name"
-                sessions[str(chat_id)] = sess; save_sessions(sessions)
-                send_message(chat_id, "Scrivi 'VecchioNome -> NuovoNome'")
-                return
-            elif t.startswith("prod"):
-                products = load_products()
-                if not products:
-                    send_message(chat_id, "Non ci sono prodotti.")
-                    sessions.pop(str(chat_id), None); save_sessions(sessions); return
-                names = [p["nome"] for p in products]
-                sess["step"] = "modify_select_product"
-                sessions[str(chat_id)] = sess; save_sessions(sessions)
-                answer_with_keyboard(chat_id, "Quale prodotto vuoi modificare?", names)
-                return
-            else:
-                send_message(chat_id, "Rispondi 'Prodotto' o 'Categoria'.")
-                return
-
-        if step == "modify_category_name":
-            if not text or "->" not in text:
-                send_message(chat_id, "Formato errato. Usa 'Vecchio -> Nuovo'")
-                return
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-
-
-            old, new = [s.strip() for s in text.split("->", 1)]
-            products = load_products()
-            changed = False
-            for p in products:
-                if p.get("tipologia") == old:
-                    p["tipologia"] = new
-                    changed = True
-            if changed:
-                save_products(products)
-                send_message(chat_id, f"✅ Categoria rinominata: {old} -> {new}")
+    prod = catalog.get(int(prod_id))
+    if not prod:
+        turn.reply("❌ Prodotto non trovato (forse è stato rimosso).")
+        turn.end()
+        return
+    if turn.step == "remove_product":
+        ok = remove_product(prod["id"])
+        turn.reply(f"{'✅ Rimosso' if ok else '❌ Non trovato'}: {prod['nome']}")
+        turn.end()
+    else:
+        select_product_to_modify(turn, prod)
+
+# ---- COMANDI ----
+@conversation.command("/start")
+def cmd_start(turn):
+    # /start disponibile per tutti
+    keyboard = {
+        "inline_keyboard": [[{"text": "🛒 Apri la Vetrina", "web_app": {"url": MINI_APP_URL}}]]
+    }
+    turn.reply(
+        "Benvenuto Fratm! Usa il pulsante sotto per aprire la vetrina.",
+        reply_markup=keyboard,
+        parse_mode="Markdown",
+        is_start=True
+    )
+    turn.end()
+
+@conversation.fallback("denied")
+def cmd_denied(turn):
+    turn.reply("❌ Non sei autorizzato a usare questo comando.")
+
+@conversation.fallback("unknown_command")
+def cmd_unknown(turn):
+    turn.reply("Comando non riconosciuto. Usa /aggiungi /rimuovi /modifica")
+
+@conversation.command("/info", admin=True)
+def cmd_info(turn):
+    turn.reply(
+        "Comandi disponibili:\n"
+        "/start - avvia il bot e mostra il pulsante\n"
+        "/aggiungi - aggiungi un nuovo prodotto\n"
+        "/rimuovi - rimuovi un prodotto o una categoria\n"
+        "/modifica - modifica un prodotto o una categoria\n"
+        "/importa - importa prodotti da un file CSV o JSONL\n"
+        "/esporta [csv|jsonl] - scarica il catalogo come file\n"
+    )
+
+# prima chiediamo quale tipo aggiungere
+conversation.command("/aggiungi", admin=True)(start_adding_choice)
+conversation.command("/rimuovi", admin=True)(start_removing)
+conversation.command("/modifica", admin=True)(start_modifying)
+
+@conversation.command("/importa", admin=True)
+def cmd_import(turn):
+    turn.start("importing", "document")
+    turn.reply("Invia un file .csv, .jsonl o .json (lista di prodotti) con le colonne nome, prezzo, tipologia "
+               "(opzionali: id, immagine come URL). I prodotti con lo stesso id o nome vengono aggiornati.")
+
+@conversation.command("/esporta", admin=True)
+def cmd_export(turn):
+    parts = turn.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else "csv"
+    if fmt not in ("csv", "jsonl"):
+        turn.reply("Formato non valido: usa /esporta csv oppure /esporta jsonl")
+        return
+    turn.reply("⏳ Preparo il file del catalogo...")
+    turn.then(bulk_executor.submit, run_export, turn.chat_id, fmt)
+
+# ---- MESSAGGI FUORI DAI FLOW ----
+@conversation.fallback("idle")
+def no_session(turn):
+    turn.reply("Usa /aggiungi per aggiungere un prodotto, /rimuovi o /modifica. /start per info.")
+
+@conversation.fallback("unhandled")
+def not_understood(turn):
+    turn.reply("Non ho capito. Usa /aggiungi /rimuovi /modifica oppure /start.")
+
+# ---- ADDING CHOICE / CATEGORY ----
+@conversation.step("adding_choice", "choice")
+def adding_choice(turn):
+    # l'utente ha risposto "Prodotto" o "Categoria"
+    if not turn.text:
+        turn.then(answer_with_keyboard, turn.chat_id, "Cosa vuoi aggiungere? scegli:", ["Prodotto", "Categoria"])
+        return
+    turn.consume()
+    t = turn.text.strip().lower()
+    if t.startswith("prod"):
+        # avvia il flow prodotto (nome -> prezzo -> ...)
+        turn.start("adding", "name")
+        turn.reply("🟢 Aggiungi prodotto — inserisci il *nome* del prodotto:", parse_mode="Markdown")
+    elif t.startswith("cat"):
+        # avvia il flow per aggiungere una categoria
+        turn.start("adding_category", "name")
+        turn.reply("🟢 Aggiungi categoria — inserisci il *nome* della categoria:", parse_mode="Markdown")
+    else:
+        turn.reply("Rispondi 'Prodotto' o 'Categoria'.")
+
+@conversation.step("adding_category", "name")
+def adding_category(turn):
+    # flow semplice: chiedo il nome e lo salvo
+    if not turn.text:
+        turn.reply("Inserisci il nome della categoria (testo).")
+        return
+    category_name = turn.text.strip()
+    turn.consume()
+    turn.end()
+    # aggiungi se non esiste: rilettura e nuovo tentativo se un altro worker salva nel frattempo
+    if update_categories(lambda cats: None if category_name in cats else cats + [category_name]) is None:
+        turn.reply(f"❌ La categoria '{category_name}' esiste già.")
+        return
+    turn.reply(f"✅ Categoria aggiunta: {category_name}")
+
+# ---- ADDING FLOW ----
+# passi testuali: campo del buffer, messaggio se manca il testo, passo successivo e sua domanda
+ADDING_TEXT_STEPS = {
+    "name": ("nome", "Inserisci il nome del prodotto (testo).",
+             "prezzo", "Ok — inserisci il *prezzo* (es. 9.90):"),
+    "prezzo": ("prezzo", "Inserisci il prezzo (testo numerico).",
+               "categoria", "Inserisci la *categoria* (tipologia):"),
+    "categoria": ("tipologia", "Inserisci la categoria (testo).",
+                  "media", "Ora invia un *video* o immagine, oppure scrivi 'nessuno'."),
+}
+
+@conversation.step("adding", *ADDING_TEXT_STEPS)
+def adding_text(turn):
+    field, missing, next_step, question = ADDING_TEXT_STEPS[turn.step]
+    if not turn.text:
+        turn.reply(missing)
+        return
+    turn.buffer[field] = turn.text.strip()
+    turn.consume()
+    turn.goto(next_step)
+    turn.reply(question, parse_mode="Markdown")
+
+@conversation.step("adding", "media")
+def adding_media(turn):
+    chat_id, text = turn.chat_id, turn.text
+    media = media_from_message(turn.message)
+    if not media and not (text and text.strip().lower() == "nessuno"):
+        turn.reply("Invia un video o un’immagine o scrivi 'nessuno'.")
+        return
+    turn.consume()
+
+    # il prodotto viene creato subito, il media lo completa quando il download finisce
+    buffer = turn.buffer
+    buffer["immagine"] = ""
+    entry = create_product_entry(buffer)
+    summary = f"✅ Prodotto aggiunto:\nNome: {entry['nome']}\nPrezzo: {entry['prezzo']}\nCategoria: {entry['tipologia']}"
+    turn.end()
+    if media:
+        def saved(rel_path, prod_id=entry["id"]):
+            if update_product(prod_id, immagine=rel_path, varianti=media_variants(rel_path)):
+                send_message(chat_id, f"{summary}\nMedia salvato come {rel_path}")
             else:
-                send_message(chat_id, f"Nessuna categoria '{old}' trovata.")
-            sessions.pop(str(chat_id), None); save_sessions(sessions)
+                release_if_unused(rel_path)
+                send_message(chat_id, f"{summary}\n❌ Prodotto rimosso nel frattempo, media non associato.")
+        turn.then(ingest_media, chat_id, media, saved, prefix=summary + "\n")
+    else:
+        turn.reply(summary)
+
+# ---- IMPORT FLOW ----
+@conversation.step("importing", "document")
+def importing_document(turn):
+    document = turn.message.get("document")
+    if not document:
+        turn.reply("Invia il file come documento (.csv, .jsonl o .json), oppure /start per annullare.")
+        return
+    file_name = document.get("file_name", "")
+    fmt = bulk.detect_format(file_name)
+    if fmt is None:
+        turn.reply("Formato non supportato: servono file .csv, .jsonl o .json.")
+        return
+    if (document.get("file_size") or 0) > BULK_MAX_BYTES:
+        turn.reply(f"File troppo grande (massimo {BULK_MAX_BYTES // (1024 * 1024)} MB).")
+        return
+    turn.end()
+    turn.reply(f"⏳ Import di {file_name} in corso...")
+    turn.then(bulk_executor.submit, run_import, turn.chat_id, document["file_id"], file_name, fmt)
+
+# ---- REMOVING FLOW ----
+@conversation.step("removing", "choice")
+def removing_choice(turn):
+    if not turn.text:
+        turn.reply("Rispondi 'Prodotto' o 'Categoria'.")
+        return
+    t = turn.text.strip().lower()
+    if t.startswith("prod"):
+        if not catalog.count():
+            turn.reply("Non ci sono prodotti.")
+            turn.end()
             return
-
-        if step == "modify_select_product":
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-            
-            prod = find_product_by_name(text.strip())
-            if not prod:
-                send_message(chat_id, "Prodotto non trovato.")
-                sessions.pop(str(chat_id), None); save_sessions(sessions); return
-            buffer["prod_id"] = prod["id"]
-            sess["step"] = "modify_field_choice"; sess["buffer"] = buffer
-            sessions[str(chat_id)] = sess; save_sessions(sessions)
-            answer_with_keyboard(chat_id, "Cosa vuoi modificare?", ["nome", "prezzo", "media", "categoria"])
+        turn.start("removing", "remove_product")
+        send_product_picker(turn, "", "Quale prodotto vuoi rimuovere?")
+    elif t.startswith("cat"):
+        # tipologie dei prodotti + categorie vuote, senza copiare i prodotti
+        cats = all_categories()
+        if not cats:
+            turn.reply("Non ci sono categorie.")
+            turn.end()
             return
-
-        if step == "modify_field_choice":
-            choice = text.strip().lower()
-            if choice not in ("nome", "prezzo", "media", "categoria"):
-                send_message(chat_id, "Scegli nome, prezzo, media o categoria.")
-                return
-            buffer["field"] = choice
-            if choice == "media":
-                sess["step"] = "modify_waiting_media"
-                sess["buffer"] = buffer
-                sessions[str(chat_id)] = sess; save_sessions(sessions)
-                send_message(chat_id, "Invia il nuovo media.")
-                return
-            else:
-                sess["step"] = "modify_new_value"
-                sess["buffer"] = buffer
-                sessions[str(chat_id)] = sess; save_sessions(sessions)
-                send_message(chat_id, f"Inserisci il nuovo {choice}:")
-                return
-
-        if step == "modify_new_value":
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
-            
-            prod_id = buffer.get("prod_id")
-            field = buffer.get("field")
-            products = load_products()
-            for p in products:
-                if p["id"] == prod_id:
-                    p[field if field != "categoria" else "tipologia"] = text.strip()
-                    save_products(products)
-                    send_message(chat_id, f"✅ {field} aggiornato.")
-                    break
-            sessions.pop(str(chat_id), None); save_sessions(sessions)
+        turn.start("removing", "remove_category")
+        turn.then(answer_with_keyboard, turn.chat_id, "Quale categoria vuoi rimuovere?", cats)
+    else:
+        turn.reply("Rispondi 'Prodotto' o 'Categoria'.")
+
+@conversation.step("removing", "remove_product")
+def removing_product(turn):
+    if not turn.text:
+        turn.reply("Scrivi il nome del prodotto.")
+        return
+    turn.consume()
+    name = turn.text.strip()
+    if not find_product_by_name(name):
+        # nessun nome esatto: si mostrano i prodotti più simili da scegliere
+        send_product_picker(turn, name, "Quale prodotto vuoi rimuovere?")
+        return
+    ok = remove_product_by_name(name)
+    turn.reply(f"{'✅ Rimosso' if ok else '❌ Non trovato'}: {name}")
+    turn.end()
+
+@conversation.step("removing", "remove_category")
+def removing_category(turn):
+    if not turn.text:
+        turn.reply("Scrivi il nome della categoria.")
+        return
+    turn.consume()
+    removed = remove_category(turn.text.strip())
+    turn.reply(f"Rimossi {removed} prodotti dalla categoria '{turn.text.strip()}'.")
+    turn.end()
+
+# ---- MODIFY FLOW ----
+@conversation.step("modifying", "choice")
+def modifying_choice(turn):
+    if not turn.text:
+        turn.reply("Rispondi 'Prodotto' o 'Categoria'.")
+        return
+    turn.consume()
+    t = turn.text.strip().lower()
+    if t.startswith("cat"):
+        turn.goto("modify_category_name")
+        turn.reply("Scrivi 'VecchioNome -> NuovoNome'")
+    elif t.startswith("prod"):
+        if not catalog.count():
+            turn.reply("Non ci sono prodotti.")
+            turn.end()
             return
+        turn.goto("modify_select_product")
+        send_product_picker(turn, "", "Quale prodotto vuoi modificare?")
+    else:
+        turn.reply("Rispondi 'Prodotto' o 'Categoria'.")
+
+@conversation.step("modifying", "modify_category_name")
+def modifying_category_name(turn):
+    if not turn.text or "->" not in turn.text:
+        turn.reply("Formato errato. Usa 'Vecchio -> Nuovo'")
+        return
+    turn.consume()
+    old, new = [s.strip() for s in turn.text.split("->", 1)]
+    if catalog.rename_category(old, new):
+        turn.reply(f"✅ Categoria rinominata: {old} -> {new}")
+    else:
+        turn.reply(f"Nessuna categoria '{old}' trovata.")
+    turn.end()
+
+@conversation.step("modifying", "modify_select_product")
+def modifying_select_product(turn):
+    turn.consume()
+    if not turn.text:
+        turn.reply("Scrivi il nome del prodotto.")
+        return
+    prod = find_product_by_name(turn.text.strip())
+    if not prod:
+        # nessun nome esatto: si mostrano i prodotti più simili da scegliere
+        send_product_picker(turn, turn.text.strip(), "Quale prodotto vuoi modificare?")
+        return
+    select_product_to_modify(turn, prod)
 
-        if step == "modify_waiting_media":
-            if "video" in message:
-                file_id = message["video"]["file_id"]
-            elif "photo" in message:
-                file_id = message["photo"][-1]["file_id"]
-            else:
-                send_message(chat_id, "Invia un video o immagine.")
-                return
-            
-            # cancella il messaggio dell'utente per mantenere la chat pulita
-            try:
-                if message_id:
-                    delete_message(chat_id, message_id)
-            except Exception:
-                pass
+@conversation.step("modifying", "modify_field_choice")
+def modifying_field_choice(turn):
+    choice = turn.text.strip().lower()
+    if choice not in ("nome", "prezzo", "media", "categoria"):
+        turn.reply("Scegli nome, prezzo, media o categoria.")
+        return
+    turn.buffer["field"] = choice
+    if choice == "media":
+        turn.goto("modify_waiting_media")
+        turn.reply("Invia il nuovo media.")
+    else:
+        turn.goto("modify_new_value")
+        turn.reply(f"Inserisci il nuovo {choice}:")
+
+@conversation.step("modifying", "modify_new_value")
+def modifying_new_value(turn):
+    turn.consume()
+    prod_id = turn.buffer.get("prod_id")
+    field = turn.buffer.get("field")
+    key = field if field != "categoria" else "tipologia"
+    if update_product(prod_id, **{key: turn.text.strip()}):
+        turn.reply(f"✅ {field} aggiornato.")
+    turn.end()
+
+@conversation.step("modifying", "modify_waiting_media")
+def modifying_media(turn):
+    chat_id = turn.chat_id
+    media = media_from_message(turn.message)
+    if not media:
+        turn.reply("Invia un video o immagine.")
+        return
+    turn.consume()
+    prod_id = turn.buffer.get("prod_id")
+    turn.end()
 
-            fp = get_file_path(file_id)
-            ext = Path(fp).suffix or ""
-            filename = f"{int(time.time()*1000)}{ext}"
-            dest = MEDIA_DIR / filename
-            if download_file(fp, dest):
-                prod_id = buffer.get("prod_id")
-                products = load_products()
-                for p in products:
-                    if p["id"] == prod_id:
-                        p["immagine"] = f"media/{filename}"
-                        save_products(products)
-                        send_message(chat_id, f"✅ Media aggiornato: media/{filename}")
-                        break
-            sessions.pop(str(chat_id), None); save_sessions(sessions)
-            return
+    def saved(rel_path):
+        if update_product(prod_id, immagine=rel_path, varianti=media_variants(rel_path)):
+            send_message(chat_id, f"✅ Media aggiornato: {rel_path}")
+        else:
+            release_if_unused(rel_path)
+            send_message(chat_id, "❌ Prodotto non trovato, media non associato.")
+    turn.then(ingest_media, chat_id, media, saved)
 
-    # fallback
-    send_message(chat_id, "Non ho capito. Usa /aggiungi /rimuovi /modifica oppure /start.")
 
+def set_webhook(url):
+    """Registra il webhook chiedendo a Telegram solo gli update gestiti (ALLOWED_UPDATES)."""
+    return tg.call("setWebhook", data={"url": url, "allowed_updates": json.dumps(ALLOWED_UPDATES)})
 
+if __name__ == "__main__":
+    # python bot.py set-webhook https://<host>/webhook
+    if len(sys.argv) > 2 and sys.argv[1] == "set-webhook":
+        print(set_webhook(sys.argv[2]))
+        sys.exit(0)
+    port = int(os.environ.get("PORT", 5000))
+    app.run(host="0.0.0.0", port=port)
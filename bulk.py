@@ -0,0 +1,196 @@
+# bulk.py
+# Import/export massivo del catalogo (CSV o JSONL), letto e scritto come stream.
+# In import si accetta anche un array JSON (.json, es. products.json), letto però tutto insieme.
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog_api import parse_price
+
+
+# colonne del file (nello stesso ordine in esportazione)
+FIELDS = ("id", "nome", "prezzo", "tipologia", "immagine")
+MAX_NAME_LENGTH = 120
+MAX_CATEGORY_LENGTH = 64
+# errori riportati all'admin (gli altri vengono solo contati)
+MAX_REPORTED_ERRORS = 20
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.added = 0
+        self.updated = 0
+        self.media_fetched = 0
+        self.new_categories = []
+        self.errors = []        # (riga, messaggio)
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def summary(self):
+        lines = [f"Righe lette: {self.rows}", f"Aggiunti: {self.added}", f"Aggiornati: {self.updated}"]
+        if self.media_fetched:
+            lines.append(f"Media scaricati: {self.media_fetched}")
+        if self.new_categories:
+            lines.append(f"Nuove categorie: {', '.join(self.new_categories)}")
+        if self.errors:
+            lines.append(f"Righe scartate: {len(self.errors)}")
+            lines += [f"  riga {line}: {msg}" for line, msg in self.errors[:MAX_REPORTED_ERRORS]]
+            if len(self.errors) > MAX_REPORTED_ERRORS:
+                lines.append(f"  ... e altre {len(self.errors) - MAX_REPORTED_ERRORS}")
+        return "\n".join(lines)
+
+
+def detect_format(filename):
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".json"):
+        return "json"
+    return None
+
+
+def iter_records(binary_stream, fmt):
+    """
+    (numero di riga, dict) per ogni record, leggendo il file a flusso (mai tutto in memoria).
+    Per "json" (un array di oggetti) il numero è la posizione nell'array; ValueError se il file
+    non è un array JSON.
+    """
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+    if fmt == "json":
+        # un array JSON non si legge a righe: lo si carica intero (il limite è BULK_MAX_BYTES)
+        try:
+            records = json.load(text)
+        except ValueError:
+            raise ValueError("il file .json non è JSON valido")
+        if not isinstance(records, list):
+            raise ValueError("il file .json deve contenere una lista di prodotti")
+        for pos, record in enumerate(records, start=1):
+            yield pos, record if isinstance(record, dict) else None
+    elif fmt == "csv":
+        sample = text.readline()
+        dialect = csv.excel
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            pass
+        header = [h.strip().lower() for h in next(csv.reader([sample], dialect))]
+        for line, row in enumerate(csv.reader(text, dialect), start=2):
+            if any(cell.strip() for cell in row):
+                yield line, dict(zip(header, row))
+    else:
+        for line, raw in enumerate(text, start=1):
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                yield line, None
+                continue
+            yield line, record if isinstance(record, dict) else None
+
+
+def validate(record):
+    """Prodotto normalizzato dal record; ValueError con il motivo se non è valido."""
+    if record is None:
+        raise ValueError("riga non valida")
+    nome = str(record.get("nome") or "").strip()
+    if not nome:
+        raise ValueError("nome mancante")
+    if len(nome) > MAX_NAME_LENGTH:
+        raise ValueError(f"nome più lungo di {MAX_NAME_LENGTH} caratteri")
+    prezzo = str(record.get("prezzo") if record.get("prezzo") is not None else "").strip()
+    price = parse_price(prezzo)
+    if price is None or price < 0:
+        raise ValueError(f"prezzo non valido: '{prezzo}'")
+    tipologia = str(record.get("tipologia") or "").strip()
+    if not tipologia:
+        raise ValueError("categoria mancante")
+    if len(tipologia) > MAX_CATEGORY_LENGTH:
+        raise ValueError(f"categoria più lunga di {MAX_CATEGORY_LENGTH} caratteri")
+    entry = {"nome": nome, "prezzo": prezzo, "tipologia": tipologia}
+    pid = str(record.get("id") or "").strip()
+    if pid:
+        if not pid.isdigit():
+            raise ValueError(f"id non valido: '{pid}'")
+        entry["id"] = int(pid)
+    immagine = str(record.get("immagine") or "").strip()
+    if immagine:
+        entry["immagine"] = immagine
+    return entry
+
+
+def import_catalog(binary_stream, fmt, catalog, media_ingestor=None, known_categories=(), media_workers=8):
+    """
+    Importa il file: parsing a flusso, validazione, download concorrente dei media indicati
+    come URL, poi un solo upsert nel catalogo (una transazione). Ritorna un ImportReport.
+    """
+    report = ImportReport()
+    entries = []
+    seen_categories = set(known_categories)
+    for line, record in iter_records(binary_stream, fmt):
+        report.rows += 1
+        try:
+            entry = validate(record)
+        except ValueError as e:
+            report.error(line, str(e))
+            continue
+        if entry["tipologia"] not in seen_categories:
+            seen_categories.add(entry["tipologia"])
+            report.new_categories.append(entry["tipologia"])
+        entries.append((line, entry))
+
+    # media remoti: scaricati in parallelo, una volta per URL
+    urls = {e["immagine"] for _, e in entries if e.get("immagine", "").startswith(("http://", "https://"))}
+    fetched = {}
+    if urls and media_ingestor is not None:
+        with ThreadPoolExecutor(max_workers=max(1, media_workers), thread_name_prefix="import-media") as pool:
+            for url, result in zip(urls, pool.map(lambda u: _fetch(media_ingestor, u), urls)):
+                fetched[url] = result
+    valid = []
+    for line, entry in entries:
+        url = entry.get("immagine", "")
+        if url in fetched:
+            rel_path, error = fetched[url]
+            if error:
+                report.error(line, f"media non scaricato ({error}), prodotto importato senza media")
+                entry.pop("immagine")
+            else:
+                entry["immagine"] = rel_path
+        elif url.startswith(("http://", "https://")):
+            entry.pop("immagine")
+        valid.append(entry)
+    report.media_fetched = sum(1 for _, error in fetched.values() if not error)
+
+    if valid:
+        report.added, report.updated = catalog.upsert_many(valid)
+    return report
+
+
+def _fetch(media_ingestor, url):
+    try:
+        return media_ingestor.ingest_url(url), None
+    except Exception as e:
+        return None, str(e)
+
+
+def iter_export(products, fmt):
+    """Righe del file di esportazione (bytes), generate una alla volta."""
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(FIELDS)
+        yield buf.getvalue().encode("utf-8")
+        for p in products:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerow([p.get(f, "") for f in FIELDS])
+            yield buf.getvalue().encode("utf-8")
+    else:
+        for p in products:
+            yield (json.dumps({f: p.get(f, "") for f in FIELDS}, ensure_ascii=False) + "\n").encode("utf-8")
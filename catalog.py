@@ -0,0 +1,317 @@
+# catalog.py
+import threading
+import time
+
+from storage import ANY_VERSION, VersionConflict
+
+
+# tentativi di una modifica quando un altro processo ha scritto nel frattempo
+WRITE_RETRIES = 5
+# versioni fittizie: dati mai caricati / copia in memoria da rileggere (None = file prodotti assente)
+_NOT_LOADED = object()
+_STALE = object()
+
+
+# -----------------------------
+# CATALOGO IN MEMORIA
+# -----------------------------
+class Catalog:
+    """
+    Catalogo prodotti residente in memoria.
+    - Carica i prodotti una sola volta e li ricarica solo se cambia la versione nello storage
+      (mtime di products.json per il backend JSON, contatore per SQLite).
+    - Mantiene indici per id, per nome (minuscolo) e per tipologia: le ricerche sono O(1).
+    - Tutte le modifiche passano da _persist(), unico punto di scrittura verso lo storage.
+      La scrittura vale solo se lo storage è ancora alla versione su cui si è lavorato: se un
+      altro worker ha salvato nel frattempo (VersionConflict) _write() ricarica e ripete la modifica.
+    - Conta i riferimenti ai media (campo "immagine"): quando un file non è più usato da nessun
+      prodotto dopo una modifica viene chiamato on_media_released(rel_path).
+    - subscribe(fn): fn(changed_ids, removed_ids) dopo ogni modifica; (None, None) quando i dati
+      sono stati ricaricati per intero (replace_all o modifica di un altro processo).
+    """
+
+    def __init__(self, storage, lock=None):
+        self.storage = storage
+        self.lock = lock or threading.RLock()
+        self._version = _NOT_LOADED
+        self._products = []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_tipologia = {}
+        self._media_refs = {}
+        self.on_media_released = None
+        self._listeners = []
+        self._last_id = 0
+
+    # ---- caricamento / indici ----
+    def _refresh(self):
+        version = self.storage.products_version()
+        if version == self._version:
+            return
+        first = self._version is _NOT_LOADED
+        products = self.storage.load_products() if version is not None else []
+        self._version = version
+        self._reindex(products)
+        # al primo caricamento non c'è nulla da invalidare
+        if not first:
+            self._notify(None, None)
+
+    def _reindex(self, products):
+        self._products = list(products)
+        self._by_id = {}
+        self._by_name = {}
+        self._by_tipologia = {}
+        self._media_refs = {}
+        for p in self._products:
+            self._index(p)
+
+    def _index(self, p):
+        self._by_id[p.get("id")] = p
+        self._by_name.setdefault(_name_key(p.get("nome")), p)
+        self._by_tipologia.setdefault(_cat_key(p), []).append(p)
+        media = p.get("immagine")
+        if media:
+            self._media_refs[media] = self._media_refs.get(media, 0) + 1
+
+    def _unindex(self, p):
+        self._by_id.pop(p.get("id"), None)
+        key = _name_key(p.get("nome"))
+        if self._by_name.get(key) is p:
+            del self._by_name[key]
+            # un altro prodotto con lo stesso nome torna indicizzato
+            for other in self._products:
+                if other is not p and _name_key(other.get("nome")) == key:
+                    self._by_name[key] = other
+                    break
+        cat = _cat_key(p)
+        items = self._by_tipologia.get(cat)
+        if items is not None:
+            items[:] = [x for x in items if x is not p]
+            if not items:
+                del self._by_tipologia[cat]
+        media = p.get("immagine")
+        if media and media in self._media_refs:
+            self._media_refs[media] -= 1
+            if self._media_refs[media] <= 0:
+                del self._media_refs[media]
+
+    def _write(self, op):
+        """
+        Esegue op() (modifica in memoria + _persist) sui dati aggiornati; se la scrittura trova
+        lo storage cambiato da un altro processo, gli indici vengono ricaricati e op() ripetuta.
+        """
+        with self.lock:
+            for attempt in range(WRITE_RETRIES):
+                self._refresh()
+                try:
+                    return op()
+                except VersionConflict:
+                    # la copia in memoria ha la modifica non salvata: va riletta dallo storage
+                    self._version = _STALE
+                    if attempt == WRITE_RETRIES - 1:
+                        raise
+
+    def _persist(self, changed=None, removed=None, check=True):
+        expected = self._version if check else ANY_VERSION
+        self._version = self.storage.save_products(self._products, changed=changed, removed=removed,
+                                                   expected_version=expected)
+        if changed is None and removed is None:
+            self._notify(None, None)
+        else:
+            self._notify([p.get("id") for p in changed], list(removed))
+
+    def subscribe(self, fn):
+        with self.lock:
+            self._listeners.append(fn)
+
+    def _notify(self, changed_ids, removed_ids):
+        for fn in self._listeners:
+            fn(changed_ids, removed_ids)
+
+    def _release_unused(self, media_paths):
+        # chiamato dopo _persist(): i file non più referenziati possono essere eliminati
+        if self.on_media_released is None:
+            return
+        for media in media_paths:
+            if media and media not in self._media_refs:
+                self.on_media_released(media)
+
+    # ---- letture ----
+    def all(self):
+        """Copia della lista prodotti (nell'ordine del file)."""
+        with self.lock:
+            self._refresh()
+            return [dict(p) for p in self._products]
+
+    def count(self):
+        with self.lock:
+            self._refresh()
+            return len(self._products)
+
+    def get(self, product_id):
+        with self.lock:
+            self._refresh()
+            p = self._by_id.get(product_id)
+            return dict(p) if p else None
+
+    def find_by_name(self, name):
+        with self.lock:
+            self._refresh()
+            p = self._by_name.get(_name_key(name))
+            return dict(p) if p else None
+
+    def by_category(self):
+        """{tipologia: [prodotti]} usando l'indice, senza scansioni."""
+        with self.lock:
+            self._refresh()
+            return {cat: [dict(p) for p in items] for cat, items in self._by_tipologia.items()}
+
+    def categories(self):
+        with self.lock:
+            self._refresh()
+            return list(self._by_tipologia.keys())
+
+    def media_refs(self, media):
+        """Quanti prodotti usano il file media (percorso relativo "media/...")."""
+        with self.lock:
+            self._refresh()
+            return self._media_refs.get(media, 0)
+
+    def referenced_media(self):
+        with self.lock:
+            self._refresh()
+            return set(self._media_refs)
+
+    # ---- scritture ----
+    def replace_all(self, products):
+        """Sostituisce tutto il catalogo (scrittura incondizionata: vince sull'eventuale concorrente)."""
+        with self.lock:
+            before = set(self._media_refs)
+            self._reindex([dict(p) for p in products])
+            self._persist(check=False)
+            self._release_unused(before)
+
+    def add(self, entry):
+        def op():
+            new = dict(entry)
+            if new.get("id") is None:
+                new["id"] = self._new_id()
+            self._products.append(new)
+            self._index(new)
+            self._persist(changed=[new], removed=[])
+            return dict(new)
+        return self._write(op)
+
+    def update(self, product_id, **fields):
+        def op():
+            p = self._by_id.get(product_id)
+            if p is None:
+                return None
+            old_media = p.get("immagine")
+            self._unindex(p)
+            p.update(fields)
+            self._index(p)
+            self._persist(changed=[p], removed=[])
+            self._release_unused([old_media])
+            return dict(p)
+        return self._write(op)
+
+    def upsert_many(self, entries):
+        """
+        Inserisce o aggiorna molti prodotti con una sola scrittura (una transazione su SQLite).
+        Corrispondenza per id, se presente nel catalogo, altrimenti per nome; gli indici vengono
+        ricostruiti una volta sola alla fine. Ritorna (aggiunti, aggiornati).
+        """
+        def op():
+            changed = {}
+            new_by_name = {}
+            old_media = []
+            added = updated = 0
+            for e in entries:
+                key = _name_key(e.get("nome"))
+                p = self._by_id.get(e.get("id")) if e.get("id") is not None else None
+                if p is None:
+                    p = self._by_name.get(key) or new_by_name.get(key)
+                if p is not None:
+                    old_media.append(p.get("immagine"))
+                    p.update({k: v for k, v in e.items() if k != "id"})
+                    if p["id"] not in changed:
+                        updated += 1
+                else:
+                    p = dict(e)
+                    if p.get("id") is None or p["id"] in self._by_id:
+                        p["id"] = self._new_id()
+                    self._products.append(p)
+                    self._by_id[p["id"]] = p
+                    new_by_name[key] = p
+                    added += 1
+                changed[p["id"]] = p
+            if changed:
+                self._reindex(self._products)
+                self._persist(changed=list(changed.values()), removed=[])
+                self._release_unused(old_media)
+            return added, updated
+        return self._write(op)
+
+    def remove(self, product_id):
+        def op():
+            p = self._by_id.get(product_id)
+            if p is None:
+                return False
+            self._unindex(p)
+            self._products = [x for x in self._products if x is not p]
+            self._persist(changed=[], removed=[product_id])
+            self._release_unused([p.get("immagine")])
+            return True
+        return self._write(op)
+
+    def remove_by_name(self, name):
+        def op():
+            key = _name_key(name)
+            if key not in self._by_name:
+                return False
+            removed = [p for p in self._products if _name_key(p.get("nome")) == key]
+            self._reindex([p for p in self._products if _name_key(p.get("nome")) != key])
+            self._persist(changed=[], removed=[p["id"] for p in removed])
+            self._release_unused([p.get("immagine") for p in removed])
+            return True
+        return self._write(op)
+
+    def remove_category(self, cat_name):
+        def op():
+            removed = list(self._by_tipologia.get(cat_name, []))
+            if removed:
+                self._reindex([p for p in self._products if _cat_key(p) != cat_name])
+                self._persist(changed=[], removed=[p["id"] for p in removed])
+                self._release_unused([p.get("immagine") for p in removed])
+            return len(removed)
+        return self._write(op)
+
+    def rename_category(self, old, new):
+        def op():
+            items = self._by_tipologia.pop(old, None)
+            if not items:
+                return 0
+            for p in items:
+                p["tipologia"] = new
+            self._by_tipologia.setdefault(new, []).extend(items)
+            self._persist(changed=items, removed=[])
+            return len(items)
+        return self._write(op)
+
+    def _new_id(self):
+        # stesso schema di prima (millisecondi) ma senza collisioni
+        # (parte dopo l'ultimo assegnato: gli import massivi non ripercorrono le collisioni)
+        new_id = max(int(time.time() * 1000), self._last_id + 1)
+        while new_id in self._by_id:
+            new_id += 1
+        self._last_id = new_id
+        return new_id
+
+
+def _name_key(name):
+    return (name or "").strip().lower()
+
+
+def _cat_key(p):
+    return p.get("tipologia", "Senza categoria")
@@ -0,0 +1,221 @@
+# catalog_api.py
+import base64
+import gzip
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+
+# ordinamenti accettati da /api/catalog?sort=
+SORTS = ("default", "prezzo", "-prezzo", "nome", "-nome")
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class CatalogSnapshot:
+    """Serializzazione del catalogo a una certa versione (corpo JSON + versione gzip)."""
+
+    def __init__(self, version, products, categories, body):
+        self.version = version
+        self.products = products          # lista di prodotti (copie)
+        self.categories = categories
+        self.body = body
+        self.gzip = gzip.compress(body, compresslevel=6, mtime=0)
+        # id -> JSON del prodotto, per calcolare i delta verso le versioni successive
+        self.by_id = {p.get("id"): json.dumps(p, ensure_ascii=False, sort_keys=True) for p in products}
+        # tipologia -> posizioni dei prodotti, per filtrare senza scansioni
+        self.by_category = {}
+        for pos, p in enumerate(products):
+            self.by_category.setdefault(p.get("tipologia", "Senza categoria"), []).append(pos)
+        self._orders = {}
+        self._orders_lock = threading.Lock()
+
+    def order(self, tipologia, sort):
+        """
+        Elenco ordinato (chiave, id, posizione) dei prodotti della tipologia (tutti se None),
+        calcolato alla prima richiesta e poi riusato finché la versione non cambia.
+        """
+        key = (tipologia, sort)
+        with self._orders_lock:
+            cached = self._orders.get(key)
+        if cached is not None:
+            return cached
+        positions = self.by_category.get(tipologia, []) if tipologia else range(len(self.products))
+        entries = sorted(((_sort_key(self.products[pos], pos, sort), self.products[pos].get("id"), pos)
+                          for pos in positions), reverse=sort.startswith("-"))
+        index = {pid: i for i, (_, pid, _) in enumerate(entries)}
+        cached = (entries, index)
+        with self._orders_lock:
+            self._orders[key] = cached
+        return cached
+
+    def page(self, tipologia=None, sort="default", cursor=None, limit=PAGE_SIZE):
+        """Una pagina di prodotti dopo `cursor`; ritorna (prodotti, cursore successivo o None, totale)."""
+        entries, index = self.order(tipologia, sort)
+        start = 0
+        if cursor is not None:
+            csort, ckey, cid = cursor
+            if csort != sort:
+                # cursore emesso per un altro ordinamento: la posizione non avrebbe senso
+                raise ValueError("cursore non valido")
+            if cid in index:
+                start = index[cid] + 1
+            else:
+                # il prodotto del cursore non c'è più: si riparte dal primo che lo seguiva
+                reverse = sort.startswith("-")
+                start = len(entries)
+                try:
+                    for i, (k, pid, _) in enumerate(entries):
+                        if ((k, pid) < (ckey, cid)) if reverse else ((k, pid) > (ckey, cid)):
+                            start = i
+                            break
+                except TypeError:
+                    # chiave di tipo diverso (cursore alterato)
+                    raise ValueError("cursore non valido")
+        chunk = entries[start:start + limit]
+        items = [self.products[pos] for _, _, pos in chunk]
+        next_cursor = None
+        if start + limit < len(entries) and chunk:
+            k, pid, _ = chunk[-1]
+            next_cursor = encode_cursor(sort, k, pid)
+        return items, next_cursor, len(entries)
+
+
+class CatalogFeed:
+    """
+    Catalogo per la Mini App, serializzato e compresso una volta sola per versione:
+    - la versione è l'hash del contenuto, uguale in tutti i worker che hanno gli stessi dati
+    - il blob viene rigenerato solo dopo una modifica (notifica del catalogo o save_categories)
+      oppure se un altro processo ha cambiato lo storage
+    - delta(since) ritorna solo prodotti aggiunti/modificati e id rimossi rispetto a una delle
+      ultime `history` versioni servite
+    """
+
+    def __init__(self, catalog, categories_loader, storage=None, history=32, delta_cache=64):
+        self.catalog = catalog
+        self.categories_loader = categories_loader
+        self.storage = storage
+        self.history = max(1, int(history))
+        self.delta_cache = max(1, int(delta_cache))
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._current = None
+        self._storage_versions = None
+        self._snapshots = OrderedDict()   # versione -> CatalogSnapshot
+        self._deltas = OrderedDict()      # (since, version) -> (body, gzip)
+        self.counters = {"builds": 0, "full": 0, "deltas": 0, "pages": 0, "not_modified": 0}
+        catalog.subscribe(self.invalidate)
+
+    def invalidate(self, *_):
+        self._dirty = True
+
+    # ---- API ----
+    def snapshot(self):
+        with self._lock:
+            versions = self._read_versions()
+            if self._dirty or self._current is None or versions != self._storage_versions:
+                self._rebuild(versions)
+            return self._current
+
+    def delta(self, since):
+        """(body, gzip) con le differenze da `since` alla versione corrente, None se `since` è sconosciuta."""
+        current = self.snapshot()
+        with self._lock:
+            key = (since, current.version)
+            cached = self._deltas.get(key)
+            if cached is not None:
+                return cached
+            old = self._snapshots.get(since)
+            if old is None:
+                return None
+            changed = [p for p in current.products if old.by_id.get(p.get("id")) != current.by_id[p.get("id")]]
+            removed = [pid for pid in old.by_id if pid not in current.by_id]
+            body = _dumps({"version": current.version, "since": since, "categorie": current.categories,
+                           "changed": changed, "removed": removed})
+            result = (body, gzip.compress(body, compresslevel=6, mtime=0))
+            self._deltas[key] = result
+            while len(self._deltas) > self.delta_cache:
+                self._deltas.popitem(last=False)
+            return result
+
+    def record(self, kind):
+        with self._lock:
+            self.counters[kind] += 1
+
+    def stats(self):
+        with self._lock:
+            current = self._current
+            return dict(self.counters, version=current.version if current else None,
+                        bytes=len(current.body) if current else 0,
+                        gzip_bytes=len(current.gzip) if current else 0,
+                        history=len(self._snapshots))
+
+    # ---- interni ----
+    def _read_versions(self):
+        if self.storage is None:
+            return None
+        return (self.storage.products_version(), self.storage.categories_version())
+
+    def _rebuild(self, versions):
+        self._dirty = False
+        self._storage_versions = versions
+        products = self.catalog.all()
+        categories = self.categories_loader()
+        version = hashlib.sha256(_dumps([products, categories])).hexdigest()[:16]
+        if self._current is not None and self._current.version == version:
+            return
+        body = _dumps({"version": version, "categorie": categories, "prodotti": products})
+        snap = CatalogSnapshot(version, products, categories, body)
+        self._snapshots[version] = snap
+        self._snapshots.move_to_end(version)
+        while len(self._snapshots) > self.history:
+            self._snapshots.popitem(last=False)
+        self._current = snap
+        self.counters["builds"] += 1
+
+
+def encode_cursor(sort, key, product_id):
+    raw = json.dumps([sort, key, product_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(ordinamento, chiave, id) dal cursore opaco; ValueError se non valido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort, key, product_id = json.loads(raw)
+    except Exception:
+        raise ValueError("cursore non valido")
+    if sort not in SORTS:
+        raise ValueError("cursore non valido")
+    return sort, _as_tuple(key), product_id
+
+
+def _as_tuple(value):
+    return tuple(_as_tuple(v) for v in value) if isinstance(value, list) else value
+
+
+def parse_price(value):
+    """Prezzo numerico da valori come 10, "10", "9,50", "€ 12.00"; None se non è un numero."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"\d+(?:[.,]\d+)?", str(value or ""))
+    return float(match.group().replace(",", ".")) if match else None
+
+
+def _sort_key(p, pos, sort):
+    # i prodotti senza prezzo finiscono sempre in fondo
+    if sort in ("prezzo", "-prezzo"):
+        price = parse_price(p.get("prezzo"))
+        if sort == "prezzo":
+            return (0, price) if price is not None else (1, 0.0)
+        return (1, price) if price is not None else (0, 0.0)
+    if sort in ("nome", "-nome"):
+        return ((p.get("nome") or "").strip().lower(),)
+    return (pos,)
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
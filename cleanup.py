@@ -0,0 +1,98 @@
+# cleanup.py
+import json
+import threading
+import time
+
+
+# limite di Telegram per una singola chiamata deleteMessages
+MAX_IDS_PER_CALL = 100
+
+
+class DeleteBatcher:
+    """
+    Cancellazioni differite dei messaggi: gli id vengono raccolti per chat e cancellati
+    in blocco con deleteMessages (fino a 100 per chiamata) da un thread in background,
+    fuori dal percorso di risposta all'utente.
+    client_getter ritorna il client Telegram corrente (può essere sostituito, es. in asgi.py).
+    """
+
+    def __init__(self, client_getter, delay=0.5):
+        self.client_getter = client_getter
+        self.delay = float(delay)
+        self._pending = {}     # chat_id -> lista di message_id (ordine di arrivo, senza duplicati)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._due = None
+        self.counters = {"scheduled": 0, "calls": 0, "deleted": 0, "fallback_calls": 0}
+
+    def schedule(self, chat_id, message_id):
+        if not message_id:
+            return
+        self._ensure_started()
+        with self._cond:
+            ids = self._pending.setdefault(chat_id, [])
+            if message_id in ids:
+                return
+            ids.append(message_id)
+            self.counters["scheduled"] += 1
+            if self._due is None:
+                self._due = time.monotonic() + self.delay
+            if len(ids) >= MAX_IDS_PER_CALL:
+                self._due = time.monotonic()
+            self._cond.notify()
+
+    def flush(self):
+        """Cancella subito tutto quello che è in attesa (es. all'uscita)."""
+        with self._cond:
+            pending, self._pending, self._due = self._pending, {}, None
+        for chat_id, ids in pending.items():
+            self._delete(chat_id, ids)
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, pending=sum(len(v) for v in self._pending.values()),
+                        pending_chats=len(self._pending))
+
+    # ---- thread ----
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="delete-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._due is None:
+                    self._cond.wait()
+                wait = self._due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def _delete(self, chat_id, ids):
+        client = self.client_getter()
+        for i in range(0, len(ids), MAX_IDS_PER_CALL):
+            chunk = ids[i:i + MAX_IDS_PER_CALL]
+            if len(chunk) == 1:
+                res = client.call("deleteMessage", data={"chat_id": chat_id, "message_id": chunk[0]})
+            else:
+                res = client.call("deleteMessages", data={"chat_id": chat_id, "message_ids": json.dumps(chunk)})
+            with self._cond:
+                self.counters["calls"] += 1
+            if res.get("ok"):
+                with self._cond:
+                    self.counters["deleted"] += len(chunk)
+                continue
+            if len(chunk) > 1 and res.get("error_code") == 404:
+                # deleteMessages non disponibile (es. server API vecchio): uno alla volta
+                for mid in chunk:
+                    client.call("deleteMessage", data={"chat_id": chat_id, "message_id": mid})
+                    with self._cond:
+                        self.counters["fallback_calls"] += 1
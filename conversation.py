@@ -0,0 +1,201 @@
+# conversation.py
+import threading
+import time
+
+
+class Turn:
+    """
+    Un update (messaggio o pulsante inline) in lavorazione.
+    I gestori non scrivono sullo storage e non chiamano Telegram: annotano cosa fare
+    (sessione da salvare o chiudere, messaggio dell'utente da cancellare, risposte) e
+    Conversation lo esegue una volta sola a gestore finito.
+    """
+
+    def __init__(self, conversation, chat_id, message, sess, callback=None):
+        self.conversation = conversation
+        self.chat_id = chat_id
+        self.message = message
+        self.callback = callback
+        self.text = "" if callback is not None else (message.get("text") or "")
+        self.message_id = message.get("message_id")
+        self.sess = sess or {}
+        self.had_session = bool(sess)
+        self.session_action = None     # None (invariata) | "set" | "clear"
+        self.consumed = False
+        self.actions = []              # (funzione, args, kwargs) da eseguire dopo il salvataggio
+
+    @property
+    def mode(self):
+        return self.sess.get("mode")
+
+    @property
+    def step(self):
+        return self.sess.get("step")
+
+    @property
+    def buffer(self):
+        return self.sess.setdefault("buffer", {})
+
+    # ---- sessione ----
+    def start(self, mode, step):
+        """Nuovo flow: la sessione riparte con il buffer vuoto."""
+        self.sess = {"mode": mode, "step": step, "buffer": {}}
+        self.session_action = "set"
+
+    def goto(self, step):
+        """Passo successivo dello stesso flow (il buffer resta)."""
+        self.sess["step"] = step
+        self.session_action = "set"
+
+    def save(self):
+        self.session_action = "set"
+
+    def end(self):
+        self.sess = {}
+        self.session_action = "clear"
+
+    # ---- azioni ----
+    def consume(self):
+        """Il messaggio dell'utente va cancellato (chat pulita)."""
+        self.consumed = True
+
+    def reply(self, text, **kwargs):
+        self.then(self.conversation.send, self.chat_id, text, **kwargs)
+
+    def then(self, fn, *args, **kwargs):
+        self.actions.append((fn, args, kwargs))
+
+
+class Conversation:
+    """
+    Macchina a stati delle conversazioni admin: tabelle comando -> gestore, (mode, step) -> gestore
+    e prefisso di callback_data -> gestore, quindi un lookup per update invece di una catena di if.
+    Prima e dopo ogni gestore le operazioni comuni sono fatte qui, una volta sola:
+    - i comandi vengono sempre cancellati dalla chat; i gestori chiedono il resto con turn.consume()
+    - la sessione viene scritta al massimo una volta per update (zero se il gestore non l'ha toccata)
+    - le risposte partono dopo il salvataggio, nell'ordine in cui sono state aggiunte
+    """
+
+    FALLBACKS = ("denied", "unknown_command", "idle", "unhandled")
+
+    def __init__(self, sessions, send, delete, answer_callback=None, is_admin=lambda chat_id: False,
+                 observer=None):
+        self.sessions = sessions
+        self.send = send
+        self.delete = delete
+        self.answer_callback = answer_callback
+        self.is_admin = is_admin
+        # observer(mode, step, secondi, errore): etichette a cardinalità limitata (niente testo libero)
+        self.observer = observer
+        self._commands = {}     # "/comando" -> (gestore, solo admin)
+        self._steps = {}        # (mode, step) -> gestore
+        self._callbacks = {}    # prefisso -> gestore(turn, argomento)
+        self._fallbacks = {}
+        self._lock = threading.Lock()
+        self.counters = {"messages": 0, "callbacks": 0, "session_writes": 0, "session_skips": 0, "deletes": 0}
+
+    # ---- registrazione ----
+    def command(self, *names, admin=False):
+        def register(fn):
+            for name in names:
+                self._commands[name] = (fn, admin)
+            return fn
+        return register
+
+    def step(self, mode, *steps):
+        def register(fn):
+            for step in steps:
+                self._steps[(mode, step)] = fn
+            return fn
+        return register
+
+    def callback(self, prefix):
+        """Pulsanti inline con callback_data "<prefix>:<argomento>" (solo admin)."""
+        def register(fn):
+            self._callbacks[prefix] = fn
+            return fn
+        return register
+
+    def fallback(self, kind):
+        """denied (comando admin da altri), unknown_command, idle (nessuna sessione), unhandled."""
+        if kind not in self.FALLBACKS:
+            raise ValueError(f"fallback sconosciuto: {kind}")
+        def register(fn):
+            self._fallbacks[kind] = fn
+            return fn
+        return register
+
+    # ---- dispatch ----
+    def handle_message(self, message):
+        chat_id = message["chat"]["id"]
+        turn = Turn(self, chat_id, message, self.sessions.get(chat_id))
+        if turn.text.startswith("/"):
+            turn.consume()
+            command = turn.text.split()[0].lower()
+            entry = self._commands.get(command)
+            if entry is None:
+                route, handler = ("command", "unknown"), self._fallbacks.get("unknown_command")
+            elif entry[1] and not self.is_admin(chat_id):
+                route, handler = ("command", "denied"), self._fallbacks.get("denied")
+            else:
+                route, handler = ("command", command), entry[0]
+        elif not turn.sess:
+            route, handler = ("idle", ""), self._fallbacks.get("idle")
+        else:
+            handler = self._steps.get((turn.mode, turn.step))
+            route = (turn.mode, turn.step)
+            if handler is None:
+                route, handler = ("unhandled", ""), self._fallbacks.get("unhandled")
+        with self._lock:
+            self.counters["messages"] += 1
+        self._run(route, handler, turn)
+
+    def handle_callback(self, callback):
+        if self.answer_callback is not None:
+            self.answer_callback(callback["id"])
+        message = callback.get("message") or {}
+        chat_id = (message.get("chat") or {}).get("id")
+        prefix, _, arg = callback.get("data", "").partition(":")
+        handler = self._callbacks.get(prefix)
+        if handler is None or chat_id is None or not self.is_admin(chat_id):
+            return
+        with self._lock:
+            self.counters["callbacks"] += 1
+        turn = Turn(self, chat_id, message, self.sessions.get(chat_id), callback=callback)
+        self._run(("callback", prefix), lambda t: handler(t, arg), turn)
+
+    def _run(self, route, handler, turn):
+        start = time.perf_counter()
+        error = None
+        try:
+            if handler is not None:
+                handler(turn)
+            self.finish(turn)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if self.observer is not None:
+                self.observer(route[0], route[1], time.perf_counter() - start, error)
+
+    def finish(self, turn):
+        """Cancellazione del messaggio, una sola scrittura della sessione, poi le risposte."""
+        if turn.consumed and turn.message_id:
+            self.delete(turn.chat_id, turn.message_id)
+            with self._lock:
+                self.counters["deletes"] += 1
+        written = False
+        if turn.session_action == "set":
+            self.sessions.set(turn.chat_id, turn.sess)
+            written = True
+        elif turn.session_action == "clear" and turn.had_session:
+            self.sessions.delete(turn.chat_id)
+            written = True
+        with self._lock:
+            self.counters["session_writes" if written else "session_skips"] += 1
+        for fn, args, kwargs in turn.actions:
+            fn(*args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, commands=len(self._commands), steps=len(self._steps))
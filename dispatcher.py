@@ -0,0 +1,286 @@
+# dispatcher.py
+import json
+import queue
+import threading
+import time
+from array import array
+from collections import deque
+from pathlib import Path
+
+from storage import FileLock, file_version, write_atomic
+
+
+_STOP = object()
+
+
+def chat_key(update):
+    """Chiave di serializzazione: la chat del messaggio (o l'update_id se non c'è una chat)."""
+    for field in ("message", "edited_message", "callback_query"):
+        obj = update.get(field)
+        if obj:
+            msg = obj.get("message", obj) if field == "callback_query" else obj
+            chat = msg.get("chat") or obj.get("from") or {}
+            if "id" in chat:
+                return chat["id"]
+    return ("update", update.get("update_id"))
+
+
+class UpdateDeduplicator:
+    """
+    Finestra degli ultimi update_id visti: un ring buffer di interi (array compatto) più un set
+    per il controllo O(1). Telegram riconsegna gli update quando il webhook è lento: i replay
+    vengono scartati prima di arrivare a handle_message.
+    Se path è impostato la finestra sopravvive ai riavvii (salvata ogni persist_every nuovi id).
+    Con più worker gunicorn sullo stesso file:
+    - ogni salvataggio unisce, sotto lock, gli id del file con quelli del processo (nessun worker
+      cancella la finestra degli altri) e porta in memoria quelli degli altri worker
+    - un id mai visto fa rileggere il file se nel frattempo è cambiato (una stat se non è cambiato),
+      così la riconsegna a un altro worker di un update già gestito viene scartata;
+      resta scoperto al più l'ultimo blocco di persist_every id non ancora salvato da ciascun worker
+    """
+
+    def __init__(self, window=10000, path=None, persist_every=50):
+        self.window = max(1, int(window))
+        self.path = Path(path) if path else None
+        self.persist_every = max(1, int(persist_every))
+        self._ring = array("q", [0]) * self.window
+        self._pos = 0
+        self._count = 0
+        self._seen = set()
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.path) if self.path else None
+        self._file_version = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        if self.path:
+            self._sync_file()
+
+    def seen(self, update_id):
+        """True se l'update è un replay (da scartare), altrimenti lo registra e ritorna False."""
+        if update_id is None:
+            return False
+        with self._lock:
+            if update_id not in self._seen and self.path:
+                # forse l'ha già gestito un altro worker
+                self._sync_file()
+            if update_id in self._seen:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._add(update_id)
+            self._dirty += 1
+            if self.path and self._dirty >= self.persist_every:
+                self._persist()
+        return False
+
+    def forget(self, update_id):
+        """Toglie l'id dalla finestra: la prossima consegna dell'update verrà processata (es. dopo un errore)."""
+        with self._lock:
+            if update_id not in self._seen:
+                return
+            self._seen.discard(update_id)
+            for i, value in enumerate(self._ring):
+                if value == update_id:
+                    self._ring[i] = 0
+            if self.path:
+                # anche dal file, altrimenti la prossima unione lo riporterebbe in memoria
+                self._persist(exclude=(update_id,))
+
+    def _add(self, update_id):
+        if self._count == self.window:
+            self._seen.discard(self._ring[self._pos])
+        else:
+            self._count += 1
+        self._ring[self._pos] = update_id
+        self._seen.add(update_id)
+        self._pos = (self._pos + 1) % self.window
+
+    def _ordered(self):
+        if self._count < self.window:
+            ids = self._ring[:self._count].tolist()
+        else:
+            ids = (self._ring[self._pos:] + self._ring[:self._pos]).tolist()
+        return [u for u in ids if u]   # 0 = posto liberato da forget()
+
+    def _read_file(self):
+        try:
+            return [int(u) for u in json.loads(self.path.read_text(encoding="utf-8"))]
+        except (FileNotFoundError, ValueError, TypeError):
+            return []
+
+    def _sync_file(self):
+        # chiamato con self._lock preso: porta in memoria gli id salvati dagli altri worker
+        version = file_version(self.path)
+        if version is None or version == self._file_version:
+            return
+        for update_id in self._read_file():
+            if update_id not in self._seen:
+                self._add(update_id)
+        self._file_version = version
+        self.reloads += 1
+
+    def _persist(self, exclude=()):
+        with self._file_lock.exclusive():
+            others = [u for u in self._read_file() if u not in self._seen and u not in exclude]
+            # prima gli id degli altri processi, poi i nostri (i più recenti); restano gli ultimi `window`
+            merged = list(dict.fromkeys(others + self._ordered()))[-self.window:]
+            write_atomic(self.path, json.dumps(merged), fsync=False)
+            self._file_version = file_version(self.path)
+            for update_id in others:
+                self._add(update_id)
+        self._dirty = 0
+
+    def flush(self):
+        with self._lock:
+            if self.path and self._dirty:
+                self._persist()
+
+    def stats(self):
+        with self._lock:
+            return {"window": self.window, "size": self._count, "hits": self.hits, "misses": self.misses,
+                    "reloads": self.reloads}
+
+
+class UpdateDispatcher:
+    """
+    Coda limitata + pool di thread per gli update di Telegram.
+    - submit() accoda e ritorna subito (False se la coda è piena: backpressure);
+      on_done(ok), se passato, viene chiamato a fine gestione dell'update
+    - gli update della stessa chat sono eseguiti in ordine, uno alla volta;
+      chat diverse girano in parallelo sui worker
+    - i thread partono al primo submit (sicuro con il fork dei worker gunicorn)
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000, key_func=chat_key, on_error=None, dedup=None):
+        self.handler = handler
+        self.dedup = dedup
+        self.workers = max(1, int(workers))
+        self.maxsize = int(maxsize)
+        self.key_func = key_func
+        self.on_error = on_error
+        # la coda interna non ha limite: il limite è sugli update in sospeso (in coda + in attesa
+        # dietro la propria chat), così una chat che inonda non aggira la backpressure
+        self.queue = queue.Queue()
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._active = {}      # chiave -> deque di update in attesa dietro a quello in esecuzione
+        self._threads = []
+        self._counters = {
+            "submitted": 0, "rejected": 0, "processed": 0, "errors": 0,
+            "high_water": 0, "wait_s_total": 0.0, "wait_s_max": 0.0,
+        }
+
+    # ---- API ----
+    def submit(self, update, on_done=None):
+        self._ensure_started()
+        with self._lock:
+            if self._outstanding >= self.maxsize:
+                self._counters["rejected"] += 1
+                return False
+            self._outstanding += 1
+        # il controllo dei replay viene dopo la backpressure: un update rifiutato (503)
+        # non va segnato come visto, Telegram lo riconsegnerà
+        if self.dedup is not None and self.dedup.seen(update.get("update_id")):
+            with self._lock:
+                self._outstanding -= 1
+            return True
+        with self._lock:
+            self._counters["submitted"] += 1
+            self._counters["high_water"] = max(self._counters["high_water"], self._outstanding)
+        self.queue.put((self.key_func(update), update, time.monotonic(), on_done))
+        return True
+
+    def join(self):
+        """Attende che tutti gli update accodati siano stati processati."""
+        self.queue.join()
+
+    def shutdown(self, wait=True):
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            depth = self._outstanding
+            active_chats = len(self._active)
+            deferred = sum(len(d) for d in self._active.values())
+        done = c["processed"] + c["errors"]
+        return {
+            "workers": self.workers,
+            "queue_depth": depth,
+            "queue_max": self.maxsize,
+            "queue_high_water": c["high_water"],
+            "active_chats": active_chats,
+            "deferred_same_chat": deferred,
+            "submitted": c["submitted"],
+            "rejected": c["rejected"],
+            "processed": c["processed"],
+            "errors": c["errors"],
+            "wait_ms_avg": round(c["wait_s_total"] / done * 1000, 2) if done else 0.0,
+            "wait_ms_max": round(c["wait_s_max"] * 1000, 2),
+        }
+
+    # ---- worker ----
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            threads = [threading.Thread(target=self._worker, name=f"update-worker-{i}", daemon=True)
+                       for i in range(self.workers)]
+            for t in threads:
+                t.start()
+            self._threads = threads
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                return
+            key = item[0]
+            with self._lock:
+                if key in self._active:
+                    # la chat è già in lavorazione su un altro worker: resta in coda dietro di lei
+                    self._active[key].append(item)
+                    continue
+                self._active[key] = deque()
+            while item is not None:
+                self._process(item)
+                with self._lock:
+                    pending = self._active[key]
+                    if pending:
+                        item = pending.popleft()
+                    else:
+                        del self._active[key]
+                        item = None
+
+    def _process(self, item):
+        _key, update, enqueued_at, on_done = item
+        waited = time.monotonic() - enqueued_at
+        ok = True
+        try:
+            self.handler(update)
+        except Exception as e:
+            ok = False
+            if self.on_error:
+                try:
+                    self.on_error(update, e)
+                except Exception:
+                    pass
+        finally:
+            with self._lock:
+                self._outstanding -= 1
+                self._counters["processed" if ok else "errors"] += 1
+                self._counters["wait_s_total"] += waited
+                self._counters["wait_s_max"] = max(self._counters["wait_s_max"], waited)
+            if on_done is not None:
+                on_done(ok)
+            self.queue.task_done()
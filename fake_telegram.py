@@ -0,0 +1,210 @@
+# fake_telegram.py
+# Finto server della Bot API per benchmark e prove locali (nessuna rete, nessun token reale).
+# Uso: python fake_telegram.py [--port 8081] [--latency 0.05] [--jitter 0.02] [--rate-429 0.01]
+# poi avvia il bot con TELEGRAM_API_URL=http://127.0.0.1:8081
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# metodi che creano un messaggio (la risposta contiene un Message)
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendVideo", "sendDocument", "editMessageText",
+                   "editMessageReplyMarkup"}
+# file generati per i file_id non registrati: estensione -> primi byte riconosciuti da media.sniff_kind
+FILE_HEADERS = {
+    ".jpg": b"\xff\xd8\xff\xe0\x00\x10JFIF\x00",
+    ".mp4": b"\x00\x00\x00\x18ftypmp42",
+    ".csv": b"nome,prezzo,tipologia\n",
+}
+
+
+class FakeTelegram:
+    """
+    Server HTTP che risponde come api.telegram.org:
+    - /bot<token>/<metodo>: risposte plausibili (message_id progressivi, getFile, deleteMessages...)
+    - /file/bot<token>/<percorso>: contenuto dei file registrati con add_file, oppure generato
+      (file_size byte deterministici per file_id; i file_id che iniziano con "video" sono .mp4)
+    - latency (+ jitter casuale) secondi di attesa per ogni richiesta
+    - rate_429: probabilità di rispondere 429 con retry_after (flood control simulato)
+    - contatori delle chiamate per metodo, dei 429 e dei byte serviti (stats / reset)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1,
+                 file_size=64 * 1024, seed=None):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.rate_429 = float(rate_429)
+        self.retry_after = retry_after
+        self.file_size = int(file_size)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._files = {}           # file_id -> (file_path, bytes)
+        self._message_id = 0
+        self.counters = {}
+        self.throttled = 0
+        self.bytes_served = 0
+        self.updates = []          # restituiti (e svuotati) da getUpdates
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+            self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread = None
+
+    def add_file(self, file_id, data, ext=".jpg"):
+        with self._lock:
+            self._files[file_id] = (f"files/{file_id}{ext}", bytes(data))
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.counters), "total_calls": sum(self.counters.values()),
+                    "throttled": self.throttled, "bytes_served": self.bytes_served}
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.throttled = 0
+            self.bytes_served = 0
+
+    # ---- risposte ----
+    def _sleep(self):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _count(self, method):
+        with self._lock:
+            self.counters[method] = self.counters.get(method, 0) + 1
+            throttle = self.rate_429 > 0 and self._random.random() < self.rate_429
+            if throttle:
+                self.throttled += 1
+        return throttle
+
+    def _file(self, file_id):
+        with self._lock:
+            known = self._files.get(file_id)
+        if known is not None:
+            return known
+        ext = ".mp4" if file_id.startswith("video") else ".jpg"
+        head = FILE_HEADERS[ext]
+        # contenuto diverso per ogni file_id (hash diversi nel MediaStore), stesso ad ogni richiesta
+        seed = hashlib.sha256(file_id.encode("utf-8")).digest()
+        body = (seed * (self.file_size // len(seed) + 1))[:max(0, self.file_size - len(head))]
+        return f"files/{file_id}{ext}", head + body
+
+    def api(self, method, params):
+        if self._count(method):
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+        if method in MESSAGE_METHODS:
+            with self._lock:
+                self._message_id += 1
+                message_id = self._message_id
+            chat_id = params.get("chat_id", "0")
+            return 200, {"ok": True, "result": {"message_id": message_id, "date": int(time.time()),
+                                                "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0},
+                                                "text": params.get("text", "")}}
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            file_path, data = self._file(file_id)
+            return 200, {"ok": True, "result": {"file_id": file_id, "file_unique_id": file_id[-16:],
+                                                "file_size": len(data), "file_path": file_path}}
+        if method == "getUpdates":
+            with self._lock:
+                updates, self.updates = self.updates, []
+            return 200, {"ok": True, "result": updates}
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}}
+        # deleteMessage(s), answerCallbackQuery, setWebhook, ...: nessun dato utile oltre all'esito
+        return 200, {"ok": True, "result": True}
+
+    def download(self, file_path):
+        file_id = file_path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        path, data = self._file(file_id)
+        if path != file_path:
+            return None
+        with self._lock:
+            self.counters["download"] = self.counters.get("download", 0) + 1
+            self.bytes_served += len(data)
+        return data
+
+
+def _handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # intestazioni e corpo partono in due write: senza TCP_NODELAY ogni risposta attende ~40 ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self._dispatch(b"")
+
+        def do_POST(self):
+            self._dispatch(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+
+        def _dispatch(self, body):
+            fake._sleep()
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            if len(parts) >= 3 and parts[0] == "file" and parts[1].startswith("bot"):
+                data = fake.download("/".join(parts[2:]))
+                if data is None:
+                    return self._send(404, b'{"ok":false,"error_code":404,"description":"Not Found"}')
+                return self._send(200, data, "application/octet-stream")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                return self._send(404, b'{"ok":false,"error_code":404,"description":"Not Found"}')
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params.update({k: v[0] for k, v in parse_qs(body.decode("utf-8", "replace")).items()})
+            status, res = fake.api(parts[1], params)
+            self._send(status, json.dumps(res).encode("utf-8"))
+
+        def _send(self, status, data, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Finto server della Bot API di Telegram")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="secondi di attesa per richiesta")
+    parser.add_argument("--jitter", type=float, default=0.0, help="attesa casuale aggiuntiva (secondi)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probabilità di rispondere 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="byte dei file generati")
+    args = parser.parse_args()
+    fake = FakeTelegram(args.host, args.port, latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                        retry_after=args.retry_after, file_size=args.file_size)
+    print(f"Finto Telegram su {fake.url} (Ctrl+C per uscire)")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(fake.stats(), indent=2))
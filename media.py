@@ -0,0 +1,340 @@
+# media.py
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+from storage import FileLock, write_atomic
+
+
+# estensioni accettate e tipo atteso
+ALLOWED_EXTS = {
+    ".jpg": "image", ".jpeg": "image", ".png": "image", ".webp": "image", ".gif": "image",
+    ".mp4": "video", ".m4v": "video", ".mov": "video", ".webm": "video",
+}
+# limite di getFile della Bot API
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+# nomi content-addressed: sha256 del contenuto + estensione
+HASHED_NAME_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+# originali content-addressed e loro derivati (<sha256>.<variante>.<ext>): il contenuto non cambia mai
+IMMUTABLE_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)+$")
+
+
+class MediaError(Exception):
+    """Errore di ingestione, con messaggio da mostrare all'admin."""
+
+
+def sniff_kind(head):
+    """Tipo reale del file dai primi byte ("image", "video" o None)."""
+    if head.startswith(b"\xff\xd8\xff") or head.startswith(b"\x89PNG\r\n\x1a\n") or head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image"
+    if head[4:8] == b"ftyp" or head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video"
+    return None
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_hashed_media(rel_path):
+    """True per i percorsi "media/<sha256>.<ext>" gestiti dal MediaStore."""
+    return bool(rel_path) and rel_path.startswith("media/") and bool(HASHED_NAME_RE.match(rel_path[len("media/"):]))
+
+
+def is_immutable_name(filename):
+    return bool(IMMUTABLE_NAME_RE.match(filename))
+
+
+class MediaStore:
+    """
+    Archivio dei media indirizzato per contenuto: ogni file è salvato come <sha256>.<ext>,
+    quindi lo stesso contenuto caricato per più prodotti occupa un solo file e due upload
+    nello stesso istante non collidono.
+    - i riferimenti sono contati dal catalogo: release() viene chiamato quando nessun prodotto
+      usa più un file, che viene eliminato
+    - index_path conserva la mappa file_unique_id -> percorso, per non riscaricare file già presenti
+    """
+
+    def __init__(self, media_dir, index_path=None):
+        self.media_dir = Path(media_dir)
+        self.index_path = Path(index_path) if index_path else None
+        self._lock = threading.Lock()
+        self._index_lock = FileLock(self.index_path) if self.index_path else None
+        self._unique = {}
+        if self.index_path and self.index_path.exists():
+            try:
+                self._unique = json.loads(self.index_path.read_text(encoding="utf-8"))
+            except Exception:
+                self._unique = {}
+        self._etags = {}      # percorso -> (mtime_ns, size, etag) per i file con nome non content-addressed
+        self.counters = {"stored": 0, "deduplicated": 0, "cache_hits": 0, "released": 0}
+
+    def store(self, tmp, ext):
+        """Sposta tmp in archivio col nome del suo hash; ritorna "media/<sha256><ext>"."""
+        filename = f"{file_sha256(tmp)}{ext}"
+        dest = self.media_dir / filename
+        with self._lock:
+            if dest.exists():
+                tmp.unlink()
+                self.counters["deduplicated"] += 1
+            else:
+                os.replace(tmp, dest)
+                self.counters["stored"] += 1
+        return f"media/{filename}"
+
+    def lookup_unique(self, unique_id):
+        if not unique_id:
+            return None
+        with self._lock:
+            rel_path = self._unique.get(unique_id)
+            if rel_path and (self.media_dir / rel_path[len("media/"):]).exists():
+                self.counters["cache_hits"] += 1
+                return rel_path
+        return None
+
+    def remember_unique(self, unique_id, rel_path):
+        if not unique_id:
+            return
+        with self._lock:
+            self._unique[unique_id] = rel_path
+            self._save_index(added={unique_id: rel_path})
+
+    def release(self, rel_path):
+        """Elimina un file content-addressed non più referenziato (gli altri file non si toccano)."""
+        if not is_hashed_media(rel_path):
+            return False
+        with self._lock:
+            name = rel_path[len("media/"):]
+            # l'originale e i suoi derivati (<sha256>.<variante>.<ext>, vedi variants.py)
+            for path in [self.media_dir / name, *self.media_dir.glob(f"{Path(name).stem}.*.*")]:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            stale = [k for k, v in self._unique.items() if v == rel_path]
+            for k in stale:
+                del self._unique[k]
+            if stale:
+                self._save_index(removed=stale)
+            self.counters["released"] += 1
+        return True
+
+    def gc(self, referenced):
+        """Elimina i file content-addressed in MEDIA_DIR che non compaiono in referenced."""
+        removed = 0
+        for path in self.media_dir.iterdir():
+            rel_path = f"media/{path.name}"
+            if is_hashed_media(rel_path) and rel_path not in referenced:
+                self.release(rel_path)
+                removed += 1
+        return removed
+
+    def etag(self, path):
+        """
+        ETag forte del file: per i nomi content-addressed è il nome stesso (nessuna lettura),
+        per gli altri lo sha256 del contenuto, ricalcolato solo se cambiano mtime o dimensione.
+        """
+        path = Path(path)
+        if is_immutable_name(path.name):
+            return path.name
+        st = path.stat()
+        key = str(path)
+        with self._lock:
+            cached = self._etags.get(key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        etag = file_sha256(path)
+        with self._lock:
+            if len(self._etags) > 4096:
+                self._etags.clear()
+            self._etags[key] = (st.st_mtime_ns, st.st_size, etag)
+        return etag
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, known_unique_ids=len(self._unique))
+
+    def _save_index(self, added=None, removed=()):
+        # più worker sullo stesso indice: si riparte dal file sotto lock, si applicano solo le
+        # nostre modifiche e si riscrive in modo atomico (le voci degli altri restano)
+        if not self.index_path:
+            return
+        with self._index_lock.exclusive():
+            try:
+                data = json.loads(self.index_path.read_text(encoding="utf-8"))
+            except (FileNotFoundError, ValueError):
+                data = {}
+            data.update(added or {})
+            for k in removed:
+                data.pop(k, None)
+            write_atomic(self.index_path, json.dumps(data), fsync=False)
+        self._unique = data
+
+
+class MediaIngestor:
+    """
+    Scarica i media inviati dall'admin in background:
+    getFile -> download a blocchi grandi in un file temporaneo -> controlli (dimensione dichiarata
+    e reale, estensione, tipo dai primi byte) -> rename atomico in MEDIA_DIR.
+    Il risultato arriva al callback on_done(rel_path) oppure on_error(MediaError).
+    """
+
+    def __init__(self, client_getter, media_dir, workers=2, max_bytes=DEFAULT_MAX_BYTES,
+                 allowed_exts=None, chunk_size=1024 * 1024, store=None):
+        self.client_getter = client_getter
+        self.media_dir = Path(media_dir)
+        self.store = store or MediaStore(media_dir)
+        self.workers = max(1, int(workers))
+        self.max_bytes = int(max_bytes)
+        self.allowed_exts = allowed_exts or ALLOWED_EXTS
+        self.chunk_size = int(chunk_size)
+        self._executor = None
+        self._http = None
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "bytes": 0, "in_flight": 0}
+
+    # ---- API ----
+    def submit(self, file_id, on_done, on_error, expected_size=None, unique_id=None):
+        """Accoda il download di file_id; ritorna subito."""
+        if expected_size and expected_size > self.max_bytes:
+            on_error(MediaError(self._too_large_text()))
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="media")
+            self.counters["submitted"] += 1
+            self.counters["in_flight"] += 1
+        return self._executor.submit(self._run, file_id, on_done, on_error, expected_size, unique_id)
+
+    def ingest(self, file_id, expected_size=None, unique_id=None):
+        """Scarica e salva il file (sincrono); ritorna il percorso relativo "media/<nome>"."""
+        cached = self.store.lookup_unique(unique_id)
+        if cached:
+            # stesso file già scaricato in passato: niente getFile né download
+            return cached
+        client = self.client_getter()
+        res = client.call("getFile", params={"file_id": file_id})
+        if not res.get("ok"):
+            raise MediaError("Impossibile ottenere il file da Telegram.")
+        info = res["result"]
+        file_path = info.get("file_path")
+        if not file_path:
+            raise MediaError("Telegram non ha restituito il percorso del file.")
+        size = info.get("file_size") or expected_size
+        if size and size > self.max_bytes:
+            raise MediaError(self._too_large_text())
+
+        ext = Path(file_path).suffix.lower()
+        kind = self.allowed_exts.get(ext)
+        if kind is None:
+            raise MediaError(f"Formato non supportato ({ext or 'senza estensione'}).")
+
+        tmp = self.media_dir / f".{file_id[-16:]}.{threading.get_ident()}.part"
+        try:
+            if not client.download(file_path, tmp, chunk_size=self.chunk_size, max_bytes=self.max_bytes):
+                if tmp.exists() and tmp.stat().st_size > self.max_bytes:
+                    raise MediaError(self._too_large_text())
+                raise MediaError("Download del media fallito.")
+            rel_path = self._check_and_store(tmp, ext, kind, size)
+            self.store.remember_unique(unique_id, rel_path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        return rel_path
+
+    def ingest_url(self, url, timeout=(3.05, 30)):
+        """Scarica un media da un URL http(s) (import massivo) con gli stessi controlli di ingest()."""
+        if urlparse(url).scheme not in ("http", "https"):
+            raise MediaError(f"URL non valido: {url}")
+        with self._lock:
+            if self._http is None:
+                self._http = requests.Session()
+        tmp = self.media_dir / f".url.{threading.get_ident()}.{hashlib.sha1(url.encode()).hexdigest()[:12]}.part"
+        try:
+            try:
+                with self._http.get(url, stream=True, timeout=timeout) as r:
+                    if r.status_code != 200:
+                        raise MediaError(f"Download fallito (HTTP {r.status_code}).")
+                    ext = Path(urlparse(url).path).suffix.lower()
+                    if ext not in self.allowed_exts:
+                        content_type = r.headers.get("Content-Type", "").split(";")[0].strip()
+                        ext = (mimetypes.guess_extension(content_type) or "").lower()
+                    kind = self.allowed_exts.get(ext)
+                    if kind is None:
+                        raise MediaError(f"Formato non supportato ({ext or 'sconosciuto'}).")
+                    size = int(r.headers.get("Content-Length") or 0) or None
+                    if size and size > self.max_bytes:
+                        raise MediaError(self._too_large_text())
+                    written = 0
+                    with open(tmp, "wb") as f:
+                        for chunk in r.iter_content(self.chunk_size):
+                            f.write(chunk)
+                            written += len(chunk)
+                            if written > self.max_bytes:
+                                raise MediaError(self._too_large_text())
+            except requests.RequestException as e:
+                raise MediaError(f"Download fallito: {e}")
+            return self._check_and_store(tmp, ext, kind, size)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, max_bytes=self.max_bytes, workers=self.workers, store=self.store.stats())
+
+    # ---- interni ----
+    def _check_and_store(self, tmp, ext, kind, size):
+        written = tmp.stat().st_size
+        if size and written != size:
+            raise MediaError("Download incompleto, riprova.")
+        with open(tmp, "rb") as f:
+            head = f.read(16)
+        if sniff_kind(head) != kind:
+            raise MediaError("Il contenuto del file non corrisponde al formato dichiarato.")
+        rel_path = self.store.store(tmp, ext)
+        with self._lock:
+            self.counters["bytes"] += written
+        return rel_path
+
+    def _run(self, file_id, on_done, on_error, expected_size, unique_id):
+        try:
+            rel_path = self.ingest(file_id, expected_size, unique_id)
+        except Exception as e:
+            with self._lock:
+                self.counters["failed"] += 1
+                self.counters["in_flight"] -= 1
+            on_error(e if isinstance(e, MediaError) else MediaError(f"Errore media: {e}"))
+            return
+        with self._lock:
+            self.counters["completed"] += 1
+            self.counters["in_flight"] -= 1
+        on_done(rel_path)
+
+    def _too_large_text(self):
+        return f"File troppo grande (massimo {self.max_bytes // (1024 * 1024)} MB)."
+
+
+if __name__ == "__main__":
+    # python media.py gc  -> elimina i file content-addressed non usati da nessun prodotto
+    import sys
+    if sys.argv[1:] != ["gc"]:
+        print("Uso: python media.py gc")
+        sys.exit(1)
+    import bot
+    removed = bot.media_store.gc(bot.catalog.referenced_media())
+    print(f"File rimossi: {removed}")
@@ -0,0 +1,224 @@
+# metrics.py
+# Metriche in formato testo Prometheus (senza dipendenze) e span per update scritti come log JSON.
+# Le metriche sono per processo: con più worker gunicorn ognuno espone le proprie.
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+
+# secondi: da chiamate in memoria (sessioni) a download e timeout di rete
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}      # etichette -> [conteggi per bucket (non cumulativi), somma, totale]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(e[0]), e[1], e[2])) for key, e in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Sampled:
+    """Valore letto al momento dello scrape da fn(): un numero o {valore etichetta: numero}."""
+
+    def __init__(self, name, help, fn, kind="gauge", label=None):
+        self.name, self.help, self.fn, self.kind, self.label = name, help, fn, kind, label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            lines += [f"{self.name}{_labels((self.label,), (k,))} {_number(v)}" for k, v in sorted(value.items())]
+        elif value is not None:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels, buckets))
+
+    def sampled(self, name, help, fn, kind="gauge", label=None):
+        return self._add(Sampled(self.prefix + name, help, fn, kind, label))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class TimedProxy:
+    """Avvolge un oggetto (es. lo storage) misurando la durata di ogni metodo pubblico: observe(nome, secondi)."""
+
+    def __init__(self, target, observe):
+        self._target = target
+        self._observe = observe
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._observe(name, time.perf_counter() - start)
+        return timed
+
+
+class Tracer:
+    """
+    Span per update: durata totale, attributi (mode, step, ...) e gli eventi misurati nel thread
+    dell'update (chiamate Telegram, operazioni di storage).
+    Uno span finisce nel log (una riga JSON sul logger "vetrina.trace") se è andato in errore,
+    se supera slow_ms oppure con probabilità sample; gli ultimi `keep` restano in memoria (recent).
+    """
+
+    MAX_EVENTS = 100
+
+    def __init__(self, logger=None, sample=0.0, slow_ms=1000, keep=100):
+        self.logger = logger or logging.getLogger("vetrina.trace")
+        self.sample = float(sample)
+        self.slow_ms = float(slow_ms)
+        self._local = threading.local()
+        self._recent = deque(maxlen=max(1, int(keep)))
+        self._lock = threading.Lock()
+        self.counters = {"spans": 0, "logged": 0, "errors": 0}
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span = {"span": name, **attrs, "events": []}
+        parent = getattr(self._local, "span", None)
+        self._local.span = span
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self._local.span = parent
+            self._finish(span)
+
+    def annotate(self, **attrs):
+        span = getattr(self._local, "span", None)
+        if span is not None:
+            span.update(attrs)
+
+    def event(self, kind, name, seconds, **attrs):
+        span = getattr(self._local, "span", None)
+        if span is None:
+            return
+        events = span["events"]
+        if len(events) < self.MAX_EVENTS:
+            events.append({"k": kind, "name": name, "ms": round(seconds * 1000, 2), **attrs})
+        else:
+            span["dropped_events"] = span.get("dropped_events", 0) + 1
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, sample=self.sample, slow_ms=self.slow_ms)
+
+    def _finish(self, span):
+        error = "error" in span
+        log = error or span["ms"] >= self.slow_ms or (self.sample > 0 and random.random() < self.sample)
+        with self._lock:
+            self.counters["spans"] += 1
+            if error:
+                self.counters["errors"] += 1
+            if log:
+                self.counters["logged"] += 1
+                self._recent.append(span)
+        if log:
+            self.logger.log(logging.ERROR if error else logging.INFO,
+                            json.dumps(span, ensure_ascii=False, default=str))
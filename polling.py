@@ -0,0 +1,134 @@
+# polling.py
+# Modalità long-polling (getUpdates): nessun endpoint pubblico necessario (es. staging).
+# Uso: python polling.py
+import json
+import os
+import time
+
+
+class PollingRunner:
+    """
+    Scarica gli update a blocchi con getUpdates e li passa allo stesso dispatcher del webhook
+    (quindi allo stesso process_update / handle_message), distribuiti sui worker.
+    L'offset viene confermato a Telegram solo fino all'ultimo update gestito senza errori:
+    - se il processo muore a metà, il blocco viene riconsegnato
+    - se un handler fallisce, l'offset si ferma su quell'update e il blocco torna dal punto
+      dell'errore; gli update successivi già riusciti li scarta il deduplicatore del dispatcher
+    - dopo max_attempts tentativi falliti l'update viene scartato (contato in "dropped"),
+      altrimenti un update che fa sempre fallire l'handler bloccherebbe la coda
+    """
+
+    def __init__(self, client, dispatcher, batch_size=100, poll_timeout=30, allowed_updates=None,
+                 idle_sleep=1.0, max_attempts=3):
+        self.client = client
+        self.dispatcher = dispatcher
+        self.batch_size = max(1, min(int(batch_size), 100))
+        self.poll_timeout = int(poll_timeout)
+        self.allowed_updates = allowed_updates
+        self.idle_sleep = idle_sleep
+        self.max_attempts = max(1, int(max_attempts))
+        self.offset = None
+        self.running = False
+        self._attempts = {}    # update_id -> tentativi falliti finora
+        self.counters = {"batches": 0, "updates": 0, "errors": 0, "retried": 0, "dropped": 0}
+        # il long-poll tiene aperta la richiesta: il timeout di lettura deve superarlo
+        timeouts = getattr(client, "timeouts", None)
+        if timeouts is not None:
+            timeouts["getUpdates"] = (3.05, self.poll_timeout + 10)
+
+    def fetch(self):
+        data = {"timeout": self.poll_timeout, "limit": self.batch_size}
+        if self.offset is not None:
+            data["offset"] = self.offset
+        if self.allowed_updates is not None:
+            data["allowed_updates"] = json.dumps(self.allowed_updates)
+        res = self.client.call("getUpdates", data=data)
+        if not res.get("ok"):
+            self.counters["errors"] += 1
+            return None
+        return res.get("result", [])
+
+    def process_batch(self, updates):
+        """Processa il blocco; ritorna False se l'offset si è fermato su un update da ritentare."""
+        results = {}
+        for update in updates:
+            done = lambda ok, update_id=update["update_id"]: results.__setitem__(update_id, ok)
+            while not self.dispatcher.submit(update, on_done=done):
+                # coda piena: aspetta che i worker si liberino
+                self.dispatcher.join()
+        self.dispatcher.join()
+        self.counters["batches"] += 1
+        # il prossimo getUpdates con questo offset conferma a Telegram gli update fino al primo da ritentare
+        # (un update senza esito è un replay scartato dal deduplicatore: già gestito)
+        retry_from = None
+        for update in updates:
+            update_id = update["update_id"]
+            if results.get(update_id, True):
+                self._attempts.pop(update_id, None)
+                continue
+            attempts = self._attempts.get(update_id, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(update_id, None)
+                self.counters["dropped"] += 1
+                continue
+            self._attempts[update_id] = attempts
+            self.counters["retried"] += 1
+            # alla riconsegna l'update non deve risultare già visto
+            if self.dispatcher.dedup is not None:
+                self.dispatcher.dedup.forget(update_id)
+            if retry_from is None:
+                retry_from = update_id
+        if retry_from is None:
+            self.offset = updates[-1]["update_id"] + 1
+            self.counters["updates"] += len(updates)
+            return True
+        self.offset = retry_from
+        self.counters["updates"] += sum(1 for u in updates if u["update_id"] < retry_from)
+        return False
+
+    def poll_once(self):
+        updates = self.fetch()
+        if updates is None:
+            time.sleep(self.idle_sleep)
+            return 0
+        if updates and not self.process_batch(updates):
+            # errore in un handler: si riprova dopo una pausa, non subito
+            time.sleep(self.idle_sleep)
+        return len(updates)
+
+    def commit(self):
+        """Conferma l'offset corrente senza aspettare nuovi update (es. prima di uscire)."""
+        if self.offset is not None:
+            self.client.call("getUpdates", data={"offset": self.offset, "limit": 1, "timeout": 0})
+
+    def run_forever(self, drop_webhook=True):
+        if drop_webhook:
+            # con un webhook attivo getUpdates risponde 409
+            self.client.call("deleteWebhook", data={"drop_pending_updates": "false"})
+        self.running = True
+        try:
+            while self.running:
+                self.poll_once()
+        finally:
+            self.commit()
+
+    def stop(self):
+        self.running = False
+
+
+if __name__ == "__main__":
+    import bot
+
+    runner = PollingRunner(
+        bot.tg,
+        bot.dispatcher,
+        batch_size=int(os.environ.get("POLLING_BATCH_SIZE", 100)),
+        poll_timeout=int(os.environ.get("POLLING_TIMEOUT", 30)),
+        allowed_updates=bot.ALLOWED_UPDATES,
+    )
+    bot.start_publishing()
+    print("Long polling avviato (Ctrl+C per uscire).")
+    try:
+        runner.run_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,111 @@
+# prerender.py
+# vetrina.html con la prima pagina del catalogo già disegnata dal server: la griglia e il menu
+# delle tipologie arrivano con l'HTML, script.js li riusa (idratazione) invece di scaricarli.
+import gzip
+import hashlib
+import re
+import threading
+from html import escape
+from pathlib import Path
+
+
+# segnaposto nel template (vetrina.html): sostituiti qui, ignorati dal browser se la pagina è statica
+OPTIONS_MARKER = "<!--#tipologie-->"
+GRID_MARKER = "<!--#prodotti-->"
+GRID_OPEN = '<div class="prodotti">'
+# stesse larghezze delle card di script.js (SIZES_CARD)
+SIZES_CARD = "(min-width: 1200px) 25vw, (min-width: 901px) 33vw, 50vw"
+VIDEO_EXTS = ("mp4", "webm", "ogg", "mov", "m4v")
+ABSOLUTE_URL = re.compile(r"^(https?:)?//", re.IGNORECASE)
+
+
+class VetrinaRenderer:
+    """
+    Rende il template con la prima pagina (ordine "In vetrina", tutte le tipologie) dello snapshot
+    corrente del catalogo. Il risultato (HTML + gzip) resta in cache finché non cambiano la versione
+    dello snapshot (cioè il catalogo o le categorie) o il template su disco.
+    """
+
+    def __init__(self, template_path, snapshot, page_size=24, media_base=""):
+        self.template_path = Path(template_path)
+        self.snapshot = snapshot
+        self.page_size = max(1, int(page_size))
+        self.media_base = media_base.rstrip("/")
+        self._lock = threading.Lock()
+        self._key = None
+        self._page = None
+        self.counters = {"renders": 0, "hits": 0}
+
+    def render(self):
+        """
+        (etag, html, html gzip) della vetrina per lo snapshot corrente. L'etag è l'hash dell'HTML:
+        cambia sia con il catalogo sia con il template, ed è uguale in tutti i worker.
+        """
+        snap = self.snapshot()
+        key = (snap.version, self.template_path.stat().st_mtime_ns)
+        with self._lock:
+            if key == self._key:
+                self.counters["hits"] += 1
+                return self._page
+        body = self._render(snap).encode("utf-8")
+        page = (hashlib.sha256(body).hexdigest()[:16], body, gzip.compress(body, compresslevel=6, mtime=0))
+        with self._lock:
+            self._key, self._page = key, page
+            self.counters["renders"] += 1
+        return page
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, version=self._key[0] if self._key else None,
+                        etag=self._page[0] if self._page else None)
+
+    # ---- interni ----
+    def _render(self, snap):
+        template = self.template_path.read_text(encoding="utf-8")
+        items, next_cursor, _ = snap.page(None, "default", None, self.page_size)
+        options = ['<option value="tutti">Tutti</option>']
+        options += [f'<option value="{escape(c)}">{escape(c)}</option>' for c in snap.categories]
+        cards = "".join(self._card(p) for p in items)
+        # i dati per riprendere la paginazione da dove si è fermato il server
+        grid_open = (f'<div class="prodotti" data-prerender data-version="{escape(snap.version)}" '
+                     f'data-offset="{len(items)}" data-next="{escape(next_cursor or "")}">')
+        return (template.replace(OPTIONS_MARKER, "".join(options), 1)
+                .replace(GRID_OPEN, grid_open, 1)
+                .replace(GRID_MARKER, cards, 1))
+
+    def _url(self, path):
+        # stessa regola di urlMedia() in script.js: gli URL assoluti (http(s)://, //) restano come sono
+        if ABSOLUTE_URL.match(path):
+            return escape(path)
+        return escape(f"{self.media_base}/{path.lstrip('/')}")
+
+    def _card(self, p):
+        # stessa struttura di creaCard() in script.js
+        if p.get("immagine"):
+            media = self._media(p)
+        else:
+            media = '<p style="color: #ccc;">Nessun media</p>'
+        return (f'<div class="prodotto" data-tipologia="{escape(str(p.get("tipologia", "")))}">'
+                f'<div class="media">{media}</div>'
+                f'<div class="titolo">{escape(str(p.get("nome", "")))}</div>'
+                f'<div class="prezzo">€{escape(str(p.get("prezzo", "")))}</div></div>')
+
+    def _media(self, p):
+        path = p["immagine"]
+        varianti = p.get("varianti") or {}
+        if path.rsplit(".", 1)[-1].lower() in VIDEO_EXTS:
+            poster = f' poster="{self._url(varianti["poster"])}"' if varianti.get("poster") else ""
+            return (f'<video src="{self._url(path)}"{poster} controls muted loop playsinline '
+                    f'preload="none"></video>')
+        alt = escape(str(p.get("nome", "")))
+        srcset = varianti.get("srcset") or []
+        if not srcset:
+            return f'<img src="{self._url(path)}" alt="{alt}" loading="lazy" decoding="async">'
+        size = ""
+        if varianti.get("width") and varianti.get("height"):
+            size = f' width="{int(varianti["width"])}" height="{int(varianti["height"])}"'
+        jpg = ", ".join(f'{self._url(v["jpg"])} {v["w"]}w' for v in srcset)
+        webp = ", ".join(f'{self._url(v["webp"])} {v["w"]}w' for v in srcset)
+        return (f'<picture><source type="image/webp" srcset="{webp}" sizes="{SIZES_CARD}">'
+                f'<img src="{self._url(srcset[0]["jpg"])}" srcset="{jpg}" sizes="{SIZES_CARD}" alt="{alt}"'
+                f'{size} loading="lazy" decoding="async"></picture>')
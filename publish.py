@@ -0,0 +1,209 @@
+# publish.py
+# Pubblicazione statica del catalogo per la Mini App ospitata su un altro host (Vercel):
+# dopo le modifiche (con debounce) uno snapshot versionato, minificato e precompresso
+# e un piccolo manifest che punta allo snapshot corrente.
+# Compressione brotli opzionale: se il modulo brotli non è installato si pubblica solo gzip.
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from storage import FileLock, write_atomic
+
+
+MANIFEST_NAME = "catalog-manifest.json"
+SNAPSHOT_PREFIX = "catalog."
+# il manifest va rivalidato ad ogni apertura, gli snapshot non cambiano mai (il nome contiene l'hash)
+MANIFEST_CACHE_CONTROL = "no-cache"
+SNAPSHOT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def snapshot_name(version):
+    return f"{SNAPSHOT_PREFIX}{version}.json"
+
+
+def is_snapshot_name(name):
+    return name.startswith(SNAPSHOT_PREFIX) and name != MANIFEST_NAME and ".json" in name
+
+
+class DirectorySink:
+    """
+    Sink che scrive i file pubblicati in una cartella (servita da /catalog/ del bot, da nginx
+    o copiata nel deploy della Mini App). Scritture atomiche: chi legge non vede mai un file a metà.
+    Un sink alternativo (object storage, API di un CDN...) deve offrire gli stessi metodi:
+    put(name, data, content_type, content_encoding, cache_control), exists, delete, names, lock.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = FileLock(self.path / MANIFEST_NAME)
+
+    def put(self, name, data, content_type="application/json", content_encoding=None, cache_control=None):
+        # le intestazioni le decide chi serve la cartella (vedi catalog_static in bot.py)
+        write_atomic(self.path / name, data, fsync=False)
+
+    def exists(self, name):
+        return (self.path / name).exists()
+
+    def delete(self, name):
+        try:
+            (self.path / name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def names(self):
+        """Nomi dei file presenti, dal più vecchio al più recente."""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.endswith((".tmp", ".lock")):
+                entries.append((entry.stat().st_mtime_ns, entry.name))
+        return [name for _, name in sorted(entries)]
+
+    def lock(self):
+        """Un solo publisher alla volta anche tra worker: il manifest non torna a una versione vecchia."""
+        return self._lock.exclusive()
+
+
+class CatalogPublisher:
+    """
+    Stadio di pubblicazione che segue ogni modifica del catalogo:
+    - schedule() (sottoscritto al catalogo) fissa la pubblicazione dopo `delay` secondi di quiete;
+      una raffica di modifiche produce una sola pubblicazione, al più ogni `max_delay` secondi
+    - build() ritorna lo snapshot corrente (CatalogSnapshot: versione = hash del contenuto, corpo minificato)
+    - nel sink finiscono catalog.<versione>.json, .json.gz (e .json.br con brotli) e il manifest;
+      i file di una versione già pubblicata (anche da un altro worker) non vengono riscritti
+    - restano gli ultimi `keep` snapshot, per i client che hanno appena letto il manifest precedente
+    """
+
+    def __init__(self, build, sink, delay=2.0, max_delay=30.0, keep=5):
+        self.build = build
+        self.sink = sink
+        self.delay = float(delay)
+        self.max_delay = max(float(max_delay), self.delay)
+        self.keep = max(1, int(keep))
+        self._cond = threading.Condition()
+        self._thread = None
+        self._due = None
+        self._first = None
+        self._version = None
+        self.counters = {"scheduled": 0, "published": 0, "reused": 0, "errors": 0, "pruned": 0}
+        self.last_error = None
+
+    def schedule(self, *_):
+        self._ensure_started()
+        now = time.monotonic()
+        with self._cond:
+            self.counters["scheduled"] += 1
+            if self._first is None:
+                self._first = now
+            self._due = min(now + self.delay, self._first + self.max_delay)
+            self._cond.notify()
+
+    def flush(self):
+        """Pubblica subito se c'è una pubblicazione in attesa (es. all'uscita)."""
+        with self._cond:
+            pending = self._due is not None
+            self._due = self._first = None
+        if pending:
+            self.publish()
+
+    def publish(self):
+        """
+        Pubblica lo snapshot corrente e ritorna il manifest. Il manifest viene sempre riscritto
+        (un altro worker può aver pubblicato nel frattempo); i file di una versione già presente no.
+        """
+        try:
+            with self.sink.lock():
+                return self._publish(self.build())
+        except Exception as e:
+            with self._cond:
+                self.counters["errors"] += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+            raise
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, version=self._version, pending=self._due is not None,
+                        last_error=self.last_error)
+
+    # ---- interni ----
+    def _publish(self, snap):
+        name = snapshot_name(snap.version)
+        files = {"json": name, "gzip": name + ".gz"}
+        reused = self.sink.exists(name)
+        if not reused:
+            # prima le varianti compresse, per ultimo il file che rende la versione "esistente"
+            self.sink.put(name + ".gz", gzip.compress(snap.body, compresslevel=9, mtime=0),
+                          content_encoding="gzip", cache_control=SNAPSHOT_CACHE_CONTROL)
+            brotli = _brotli()
+            if brotli is not None:
+                self.sink.put(name + ".br", brotli.compress(snap.body, quality=11),
+                              content_encoding="br", cache_control=SNAPSHOT_CACHE_CONTROL)
+            self.sink.put(name, snap.body, cache_control=SNAPSHOT_CACHE_CONTROL)
+        if self.sink.exists(name + ".br"):
+            files["br"] = name + ".br"
+        manifest = {
+            "version": snap.version,
+            "file": name,
+            "files": files,
+            "bytes": len(snap.body),
+            "sha256": hashlib.sha256(snap.body).hexdigest(),
+            "products": len(snap.products),
+            "published_at": int(time.time()),
+        }
+        self.sink.put(MANIFEST_NAME, json.dumps(manifest, separators=(",", ":")).encode("utf-8"),
+                      cache_control=MANIFEST_CACHE_CONTROL)
+        pruned = self._prune(name)
+        with self._cond:
+            self._version = snap.version
+            self.counters["reused" if reused else "published"] += 1
+            self.counters["pruned"] += pruned
+        return manifest
+
+    def _prune(self, current):
+        names = self.sink.names()
+        # versioni in ordine di pubblicazione (il file .json è l'ultimo scritto di ogni versione)
+        versions = [n for n in names if is_snapshot_name(n) and n.endswith(".json")]
+        old = [n for n in versions if n != current][:max(0, len(versions) - self.keep)]
+        pruned = 0
+        for base in old:
+            for n in (base, base + ".gz", base + ".br"):
+                if n in names:
+                    self.sink.delete(n)
+                    pruned += 1
+        return pruned
+
+    # ---- thread ----
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="catalog-publisher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._due is None:
+                    self._cond.wait()
+                wait = self._due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                pass
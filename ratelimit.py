@@ -0,0 +1,177 @@
+# ratelimit.py
+import threading
+import time
+
+
+# priorità delle chiamate: le risposte all'utente passano prima delle pulizie
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+# metodi che "inviano" in una chat (limite per chat di Telegram)
+SEND_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendMediaGroup",
+    "sendAnimation", "editMessageText", "editMessageReplyMarkup", "copyMessage", "forwardMessage",
+}
+# metodi a bassa priorità (pulizia della chat)
+LOW_PRIORITY_METHODS = {"deleteMessage", "deleteMessages"}
+# metodi esclusi dal limitatore (long-poll, configurazione)
+UNLIMITED_METHODS = {"getUpdates", "setWebhook", "deleteWebhook", "getMe"}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Secondi da attendere per avere un token (0 se disponibile subito)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class SendScheduler:
+    """
+    Limitatore centrale delle chiamate a Telegram:
+    - un bucket globale (tutte le chiamate) e un bucket per chat (solo invii)
+    - i chiamanti ad alta priorità (invii) vengono serviti prima delle cancellazioni
+    - su 429 blocca tutto per retry_after e dimezza il ritmo globale, che poi risale
+      gradualmente fino al massimo configurato (AIMD)
+    """
+
+    def __init__(self, global_rate=30, global_burst=30, chat_rate=1, chat_burst=3,
+                 group_rate=20 / 60, group_burst=3, min_rate=1, recovery=0.5, max_chats=10000):
+        self.max_rate = float(global_rate)
+        self.min_rate = float(min_rate)
+        self.recovery = float(recovery)   # token/s recuperati per ogni secondo senza 429
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.group_rate, self.group_burst = group_rate, group_burst
+        self.max_chats = max_chats
+        self._chats = {}
+        self._cond = threading.Condition()
+        self._waiting = [0, 0]
+        self._blocked_until = 0.0
+        self._last_throttle = 0.0
+        self._last_recover = time.monotonic()
+        self.counters = {"acquired": 0, "waited_s": 0.0, "retry_after": 0}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                self._prune()
+            # chat_id negativo = gruppo/canale: limite molto più basso
+            if str(chat_id).startswith("-"):
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chats.items() if b.idle(now)]:
+            del self._chats[chat_id]
+
+    def _recover(self, now):
+        bucket = self.global_bucket
+        if bucket.rate < self.max_rate and now > self._last_throttle:
+            elapsed = now - max(self._last_throttle, self._last_recover)
+            bucket.rate = min(self.max_rate, bucket.rate + elapsed * self.recovery)
+        self._last_recover = now
+
+    def acquire(self, chat_id=None, priority=PRIORITY_HIGH, per_chat=True):
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._recover(now)
+                    if now < self._blocked_until:
+                        self._cond.wait(self._blocked_until - now)
+                        continue
+                    if priority == PRIORITY_LOW and self._waiting[PRIORITY_HIGH]:
+                        self._cond.wait(0.05)
+                        continue
+                    chat_bucket = self._chat_bucket(chat_id) if per_chat and chat_id is not None else None
+                    wait = self.global_bucket.wait_time(now)
+                    if chat_bucket is not None:
+                        wait = max(wait, chat_bucket.wait_time(now))
+                    if wait <= 0:
+                        self.global_bucket.consume()
+                        if chat_bucket is not None:
+                            chat_bucket.consume()
+                        self.counters["acquired"] += 1
+                        self.counters["waited_s"] += time.monotonic() - start
+                        return
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def on_retry_after(self, method, retry_after):
+        with self._cond:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._last_throttle = now + retry_after
+            bucket = self.global_bucket
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            bucket.tokens = min(bucket.tokens, 0)
+            self.counters["retry_after"] += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, global_rate=round(self.global_bucket.rate, 2),
+                        waiting_high=self._waiting[PRIORITY_HIGH], waiting_low=self._waiting[PRIORITY_LOW],
+                        tracked_chats=len(self._chats))
+
+
+class RateLimitedClient:
+    """Avvolge un client Telegram (sync o ponte async) facendo passare ogni chiamata dallo scheduler."""
+
+    def __init__(self, inner, scheduler, on_call=None):
+        self.inner = inner
+        self.scheduler = scheduler
+        # on_call(metodo, attesa nello scheduler, durata della chiamata, ok): metriche e tracing
+        self.on_call = on_call
+        # i 429 visti dal client interno rallentano lo scheduler
+        target = getattr(inner, "async_client", inner)
+        target.on_retry_after = scheduler.on_retry_after
+
+    def call(self, method, data=None, params=None, files=None):
+        start = time.perf_counter()
+        if method not in UNLIMITED_METHODS:
+            chat_id = (data or params or {}).get("chat_id")
+            priority = PRIORITY_LOW if method in LOW_PRIORITY_METHODS else PRIORITY_HIGH
+            self.scheduler.acquire(chat_id, priority, per_chat=method in SEND_METHODS)
+        if self.on_call is None:
+            return self.inner.call(method, data=data, params=params, files=files)
+        waited = time.perf_counter() - start
+        res = None
+        try:
+            res = self.inner.call(method, data=data, params=params, files=files)
+            return res
+        finally:
+            self.on_call(method, waited, time.perf_counter() - start - waited, bool(res and res.get("ok")))
+
+    def __getattr__(self, name):
+        # download, stats, timeouts, timeout_for... vanno al client interno
+        return getattr(self.inner, name)
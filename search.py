@@ -0,0 +1,182 @@
+# search.py
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+
+
+# pesi dei tipi di corrispondenza per ogni parola cercata
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+TRIGRAM_SCORE = 0.6
+# quota minima di trigrammi in comune perché una parola conti come "simile" (errori di battitura)
+TRIGRAM_MIN_SIMILARITY = 0.5
+# le parole più corte si cercano solo per prefisso (troppi falsi positivi)
+TRIGRAM_MIN_LENGTH = 4
+# quante parole dell'indice esaminare al massimo per un prefisso
+MAX_PREFIX_TOKENS = 200
+
+
+def normalize(text):
+    """Minuscolo, senza accenti e punteggiatura: "Caffè  Arabica!" -> "caffe arabica"."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Indice di ricerca in memoria sui nomi dei prodotti:
+    - parole normalizzate (corrispondenza esatta), elenco ordinato delle parole (prefissi)
+      e trigrammi (nomi scritti male)
+    - resta allineato al catalogo: ogni modifica notificata da Catalog.subscribe viene applicata
+      in modo incrementale alla ricerca successiva (ricostruzione completa solo se il catalogo
+      è stato ricaricato per intero)
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._docs = {}          # id -> (prodotto, parole)
+        self._tokens = {}        # parola -> set(id)
+        self._trigrams = {}      # trigramma -> set(parola)
+        self._sorted_tokens = None
+        self._stale = True
+        self._pending = set()
+        self.counters = {"queries": 0, "rebuilds": 0, "updates": 0}
+        catalog.subscribe(self._on_change)
+
+    # ---- API ----
+    def search(self, query, limit=10, offset=0, tipologia=None):
+        """(prodotti ordinati per pertinenza, totale dei risultati)."""
+        self._sync()
+        words = normalize(query).split()
+        with self._lock:
+            self.counters["queries"] += 1
+            if not words:
+                ids = list(self._docs)
+                scores = dict.fromkeys(ids, 0.0)
+            else:
+                scores = self._score(words)
+            ranked = []
+            for pid, score in scores.items():
+                product = self._docs[pid][0]
+                if tipologia and product.get("tipologia") != tipologia:
+                    continue
+                ranked.append((-score, normalize(product.get("nome")), pid))
+            if words:
+                ranked.sort()
+            total = len(ranked)
+            return [dict(self._docs[pid][0]) for _, _, pid in ranked[offset:offset + limit]], total
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, products=len(self._docs), tokens=len(self._tokens))
+
+    # ---- aggiornamento ----
+    def _on_change(self, changed_ids, removed_ids):
+        # chiamato con il lock del catalogo: solo annotazioni, il lavoro si fa in _sync()
+        with self._lock:
+            if changed_ids is None:
+                self._stale = True
+                self._pending.clear()
+            elif not self._stale:
+                self._pending.update(changed_ids)
+                self._pending.update(removed_ids)
+
+    def _sync(self):
+        with self._lock:
+            stale, self._stale = self._stale, False
+            pending, self._pending = self._pending, set()
+        if stale:
+            products = self.catalog.all()
+            with self._lock:
+                self._docs, self._tokens, self._trigrams = {}, {}, {}
+                for p in products:
+                    self._add(p)
+                self._sorted_tokens = None
+                self.counters["rebuilds"] += 1
+        elif pending:
+            products = {pid: self.catalog.get(pid) for pid in pending}
+            with self._lock:
+                for pid, p in products.items():
+                    self._remove(pid)
+                    if p is not None:
+                        self._add(p)
+                self._sorted_tokens = None
+                self.counters["updates"] += len(products)
+
+    def _add(self, p):
+        pid = p.get("id")
+        words = set(normalize(p.get("nome")).split())
+        self._docs[pid] = (p, words)
+        for w in words:
+            ids = self._tokens.get(w)
+            if ids is None:
+                ids = self._tokens[w] = set()
+                for t in trigrams(w):
+                    self._trigrams.setdefault(t, set()).add(w)
+            ids.add(pid)
+
+    def _remove(self, pid):
+        doc = self._docs.pop(pid, None)
+        if doc is None:
+            return
+        for w in doc[1]:
+            ids = self._tokens.get(w)
+            if ids is None:
+                continue
+            ids.discard(pid)
+            if not ids:
+                del self._tokens[w]
+                for t in trigrams(w):
+                    words = self._trigrams.get(t)
+                    if words is not None:
+                        words.discard(w)
+                        if not words:
+                            del self._trigrams[t]
+
+    # ---- punteggio ----
+    def _score(self, words):
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._tokens)
+        scores = {}
+        for word in words:
+            best = {}
+            for token, score in self._matching_tokens(word):
+                for pid in self._tokens[token]:
+                    if score > best.get(pid, 0):
+                        best[pid] = score
+            for pid, score in best.items():
+                scores[pid] = scores.get(pid, 0) + score
+        return scores
+
+    def _matching_tokens(self, word):
+        """(parola dell'indice, punteggio) per le parole uguali, con lo stesso prefisso o simili."""
+        found = {}
+        if word in self._tokens:
+            found[word] = EXACT_SCORE
+        i = bisect_left(self._sorted_tokens, word)
+        for token in self._sorted_tokens[i:i + MAX_PREFIX_TOKENS]:
+            if not token.startswith(word):
+                break
+            found.setdefault(token, PREFIX_SCORE)
+        if len(word) < TRIGRAM_MIN_LENGTH:
+            return found.items()
+        query_trigrams = trigrams(word)
+        shared = {}
+        for t in query_trigrams:
+            for token in self._trigrams.get(t, ()):
+                shared[token] = shared.get(token, 0) + 1
+        for token, n in shared.items():
+            if token in found:
+                continue
+            similarity = 2 * n / (len(query_trigrams) + len(trigrams(token)))
+            if similarity >= TRIGRAM_MIN_SIMILARITY:
+                found[token] = TRIGRAM_SCORE * similarity
+        return found.items()
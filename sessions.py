@@ -0,0 +1,67 @@
+# sessions.py
+import threading
+import time
+
+
+class SessionStore:
+    """
+    Sessioni delle conversazioni admin (adding / modifying / removing ...) con scadenza:
+    una sessione non toccata da ttl secondi viene considerata abbandonata e rimossa.
+    Ogni lettura/scrittura riguarda una sola chat; la pulizia delle sessioni scadute
+    avviene ogni sweep_every scritture, quindi il costo per messaggio resta costante.
+    """
+
+    def __init__(self, storage, ttl=3600, sweep_every=200):
+        self.storage = storage
+        self.ttl = float(ttl)
+        self.sweep_every = max(1, int(sweep_every))
+        # le sessioni salvate prima dell'introduzione di updated_at scadono a partire dall'avvio
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {"gets": 0, "sets": 0, "deletes": 0, "expired": 0}
+
+    def _expired(self, sess, now):
+        return now - sess.get("updated_at", self.started_at) > self.ttl
+
+    def get(self, chat_id):
+        now = time.time()
+        sess = self.storage.get_session(chat_id)
+        with self._lock:
+            self.counters["gets"] += 1
+        if sess and self._expired(sess, now):
+            self.storage.delete_session(chat_id)
+            with self._lock:
+                self.counters["expired"] += 1
+            return {}
+        return sess or {}
+
+    def set(self, chat_id, sess):
+        sess["updated_at"] = time.time()
+        self.storage.set_session(chat_id, sess)
+        self._after_write("sets")
+
+    def delete(self, chat_id):
+        self.storage.delete_session(chat_id)
+        self._after_write("deletes")
+
+    def sweep(self):
+        removed = self.storage.prune_sessions(time.time() - self.ttl)
+        with self._lock:
+            self.counters["expired"] += removed or 0
+        return removed
+
+    def flush(self):
+        self.storage.flush_sessions()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, ttl=self.ttl)
+
+    def _after_write(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+            self._writes += 1
+            sweep = self._writes % self.sweep_every == 0
+        if sweep:
+            self.sweep()
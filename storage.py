@@ -0,0 +1,726 @@
+# storage.py
+import copy
+import json
+import os
+import sqlite3
+from array import array
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: resta solo il lock tra thread dello stesso processo
+    fcntl = None
+
+
+# -----------------------------
+# LOCK TRA PROCESSI E SCRITTURE ATOMICHE
+# -----------------------------
+class VersionConflict(Exception):
+    """La scrittura partiva da una versione dei dati che nel frattempo un altro writer ha cambiato."""
+
+
+# expected_version di default: scrittura incondizionata (nessun controllo di versione)
+ANY_VERSION = object()
+
+
+class FileLock:
+    """
+    Lock su <file>.lock valido tra processi (flock) e tra thread.
+    Il file di lock viene aperto ad ogni acquisizione: i worker gunicorn creati con fork
+    non condividono così lo stesso descrittore (che renderebbe il flock inutile tra di loro).
+    - exclusive(): un writer alla volta
+    - shared(): più lettori insieme, esclusi solo mentre un writer tiene il lock
+    """
+
+    def __init__(self, path):
+        self.path = Path(str(path) + ".lock")
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def exclusive(self):
+        with self._thread_lock:
+            with self._flock(fcntl.LOCK_EX if fcntl else None):
+                yield
+
+    @contextmanager
+    def shared(self):
+        with self._flock(fcntl.LOCK_SH if fcntl else None):
+            yield
+
+    @contextmanager
+    def _flock(self, mode):
+        if mode is None:
+            yield
+            return
+        with open(self.path, "a") as f:
+            fcntl.flock(f.fileno(), mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def file_version(path):
+    """
+    Versione di un file scritto con write_atomic: ogni scrittura crea un nuovo inode,
+    quindi (inode, mtime, dimensione) cambia anche se due scritture cadono nello stesso tick di mtime.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def write_atomic(path, data, fsync=True):
+    """
+    Scrive data (str o bytes) su un file temporaneo nella stessa cartella e lo sostituisce con
+    os.replace: chi legge vede il file vecchio o quello nuovo, mai uno troncato (anche dopo un crash).
+    """
+    path = Path(path)
+    try:
+        mode = path.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with (os.fdopen(fd, "wb") if isinstance(data, bytes) else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+# -----------------------------
+# INTERFACCIA STORAGE
+# -----------------------------
+class Storage:
+    """
+    Interfaccia comune dei backend di persistenza (prodotti, categorie, sessioni).
+    save_products riceve sempre la lista completa; changed/removed sono un suggerimento
+    che i backend capaci di aggiornamenti per riga (SQLite) usano per non riscrivere tutto.
+    Le scritture di prodotti e categorie accettano expected_version (il valore di *_version()
+    su cui si basa la modifica): se nel frattempo un altro processo ha scritto sollevano
+    VersionConflict invece di sovrascriverlo; ritornano la nuova versione.
+    """
+
+    name = "base"
+    # True se più processi vedono gli stessi dati (le cache in memoria vanno rilette)
+    shared = False
+
+    # prodotti
+    def load_products(self):
+        raise NotImplementedError
+
+    def save_products(self, products, changed=None, removed=None, expected_version=ANY_VERSION):
+        raise NotImplementedError
+
+    def products_version(self):
+        """Token che cambia ad ogni modifica dei prodotti (anche da altri processi)."""
+        raise NotImplementedError
+
+    # categorie
+    def load_categories(self):
+        raise NotImplementedError
+
+    def save_categories(self, categories, expected_version=ANY_VERSION):
+        raise NotImplementedError
+
+    def categories_version(self):
+        """Come products_version, per le categorie."""
+        raise NotImplementedError
+
+    def update_categories(self, fn, retries=5):
+        """
+        Lettura-modifica-scrittura delle categorie senza perdere le modifiche degli altri worker:
+        fn(categorie) ritorna la nuova lista (None = niente da salvare); se un altro processo
+        ha salvato nel frattempo si rilegge e si riprova. Ritorna la lista salvata oppure None.
+        """
+        for attempt in range(retries):
+            version = self.categories_version()
+            categories = fn(list(self.load_categories()))
+            if categories is None:
+                return None
+            try:
+                self.save_categories(categories, expected_version=version)
+                return categories
+            except VersionConflict:
+                if attempt == retries - 1:
+                    raise
+
+    # sessioni
+    def load_sessions(self):
+        raise NotImplementedError
+
+    def save_sessions(self, sessions):
+        raise NotImplementedError
+
+    def get_session(self, chat_id):
+        return self.load_sessions().get(str(chat_id))
+
+    def set_session(self, chat_id, sess):
+        sessions = self.load_sessions()
+        sessions[str(chat_id)] = sess
+        self.save_sessions(sessions)
+
+    def delete_session(self, chat_id):
+        sessions = self.load_sessions()
+        if sessions.pop(str(chat_id), None) is not None:
+            self.save_sessions(sessions)
+
+    def prune_sessions(self, older_than):
+        """Elimina le sessioni con updated_at precedente a older_than; ritorna quante."""
+        sessions = self.load_sessions()
+        kept = {k: v for k, v in sessions.items() if v.get("updated_at", older_than) >= older_than}
+        if len(kept) != len(sessions):
+            self.save_sessions(kept)
+        return len(sessions) - len(kept)
+
+    def flush_sessions(self):
+        """Rende durevoli le modifiche in sospeso (no-op per i backend che scrivono subito)."""
+
+    # messaggi tracciati per chat (cronologia da ripulire + /start fissato)
+    def get_tracking(self, chat_id):
+        """(lista di message_id, pinned_id o None, updated_at) oppure None."""
+        raise NotImplementedError
+
+    def set_tracking(self, chat_id, history=None, pinned=None):
+        """
+        Aggiorna cronologia e/o pinned (None = resta il valore salvato). Il valore salvato
+        si rilegge sotto il lock di scrittura: un altro worker che cambia l'altro campo non si perde.
+        """
+        raise NotImplementedError
+
+    def prune_tracking(self, older_than, keep=None):
+        """Elimina le chat aggiornate prima di older_than e, se keep è dato, tutte tranne le keep più recenti."""
+        raise NotImplementedError
+
+
+# -----------------------------
+# BACKEND JSON (comportamento storico)
+# -----------------------------
+class JsonStorage(Storage):
+    """
+    File JSON nella cartella dei dati, utilizzabili da più worker gunicorn insieme:
+    - ogni file ha un <file>.lock (flock): i writer si serializzano tra processi
+    - sessioni e messaggi tracciati: una riga di log per modifica (_LoggedDict), riletta dagli altri processi
+    - le scritture sono atomiche (temporaneo + rename), quindi i lettori non prendono lock
+      e non aspettano i writer: vedono sempre il file intero, vecchio o nuovo
+    - prodotti e categorie: expected_version rifiuta le scritture basate su dati non più attuali
+    """
+
+    name = "json"
+    shared = True
+
+    def __init__(self, products_path, categories_path, sessions_path, tracking_path=None, compact_every=500):
+        self.products_path = Path(products_path)
+        self.categories_path = Path(categories_path)
+        self.sessions_path = Path(sessions_path)
+        self.tracking_path = Path(tracking_path) if tracking_path else self.sessions_path.with_name("tracking.json")
+        self._products_lock = FileLock(self.products_path)
+        self._categories_lock = FileLock(self.categories_path)
+        # sessioni e messaggi tracciati: in memoria + log append-only (una riga per modifica),
+        # compattati nel JSON ogni compact_every righe e riletti se un altro processo li cambia
+        self.sessions_log_path = self.sessions_path.with_suffix(".log")
+        self.tracking_log_path = self.tracking_path.with_suffix(".log")
+        self._sessions = _LoggedDict(self.sessions_path, compact_every)
+        # niente fsync per il tracking: la cronologia serve solo a ripulire la chat
+        self._tracking = _LoggedDict(self.tracking_path, compact_every, fsync=False)
+        # assicurati che il file esista (lo creeremo vuoto solo se necessario)
+        if not self.categories_path.exists():
+            with self._categories_lock.exclusive():
+                if not self.categories_path.exists():
+                    write_atomic(self.categories_path, "[]")
+
+    def _read(self, path, default):
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return default
+
+    def _write(self, path, data, fsync=True):
+        write_atomic(path, json.dumps(data, ensure_ascii=False, indent=2), fsync=fsync)
+
+    def _checked_write(self, lock, path, data, expected_version):
+        with lock.exclusive():
+            if expected_version is not ANY_VERSION and file_version(path) != expected_version:
+                raise VersionConflict(f"{path.name} modificato da un altro processo")
+            self._write(path, data)
+            return file_version(path)
+
+    def load_products(self):
+        return self._read(self.products_path, [])
+
+    def save_products(self, products, changed=None, removed=None, expected_version=ANY_VERSION):
+        return self._checked_write(self._products_lock, self.products_path, products, expected_version)
+
+    def products_version(self):
+        return file_version(self.products_path)
+
+    def load_categories(self):
+        try:
+            return self._read(self.categories_path, [])
+        except Exception:
+            return []
+
+    def save_categories(self, categories, expected_version=ANY_VERSION):
+        return self._checked_write(self._categories_lock, self.categories_path, categories, expected_version)
+
+    def categories_version(self):
+        return file_version(self.categories_path)
+
+    # ---- sessioni ----
+    def load_sessions(self):
+        return self._sessions.items()
+
+    def save_sessions(self, sessions):
+        self._sessions.replace(sessions)
+
+    def get_session(self, chat_id):
+        return self._sessions.get(str(chat_id))
+
+    def set_session(self, chat_id, sess):
+        self._sessions.set(str(chat_id), sess)
+
+    def delete_session(self, chat_id):
+        self._sessions.delete(str(chat_id))
+
+    def prune_sessions(self, older_than):
+        return self._sessions.prune(lambda v: v.get("updated_at", older_than) < older_than)
+
+    def flush_sessions(self):
+        self._sessions.compact()
+        self._tracking.compact()
+
+    # ---- messaggi tracciati ----
+    def get_tracking(self, chat_id):
+        row = self._tracking.get(str(chat_id))
+        return (row["history"], row.get("pinned"), row.get("updated_at", 0)) if row else None
+
+    def set_tracking(self, chat_id, history=None, pinned=None):
+        # una riga nel log per chat, non la riscrittura di tutto tracking.json
+        def merge(row):
+            row = row or {"history": [], "pinned": None}
+            return {"history": list(history) if history is not None else row["history"],
+                    "pinned": pinned if pinned is not None else row.get("pinned"),
+                    "updated_at": time.time()}
+        self._tracking.update(str(chat_id), merge)
+
+    def prune_tracking(self, older_than, keep=None):
+        # il dizionario sta tutto in memoria: keep è il limite che la tiene sotto controllo
+        self._tracking.prune(lambda v: v.get("updated_at", 0) < older_than, keep=keep,
+                             order=lambda v: v.get("updated_at", 0))
+
+
+class _LoggedDict:
+    """
+    Dizionario JSON persistito come snapshot (<file>.json) + log append-only (<file>.log, una riga
+    {"k", "v"} per modifica, v null = cancellazione) compattato ogni compact_every righe:
+    ogni scrittura costa una riga, non la riscrittura dell'intero file.
+    Condiviso tra processi: le scritture avvengono sotto flock esclusivo dopo aver riletto
+    i dati se un altro processo li ha cambiati; le letture rileggono (sotto flock condiviso)
+    solo quando snapshot o log sono cambiati, altrimenti costano due stat.
+    """
+
+    def __init__(self, path, compact_every=500, fsync=True):
+        self.path = Path(path)
+        self.log_path = self.path.with_suffix(".log")
+        self.compact_every = max(1, int(compact_every))
+        self.fsync = fsync
+        self._data = None
+        self._stamp = None
+        self._log_lines = 0
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.path)
+
+    # ---- letture ----
+    def get(self, key):
+        with self._lock:
+            return copy.deepcopy(self._loaded().get(key))
+
+    def items(self):
+        with self._lock:
+            return copy.deepcopy(self._loaded())
+
+    # ---- scritture ----
+    def set(self, key, value):
+        with self._writing() as data:
+            data[key] = copy.deepcopy(value)
+            self._append(key, value)
+
+    def update(self, key, fn):
+        """Scrive fn(valore attuale o None), calcolato sui dati riletti sotto il lock del file."""
+        with self._writing() as data:
+            value = fn(copy.deepcopy(data.get(key)))
+            data[key] = copy.deepcopy(value)
+            self._append(key, value)
+
+    def delete(self, key):
+        with self._writing() as data:
+            if data.pop(key, None) is not None:
+                self._append(key, None)
+
+    def prune(self, expired, keep=None, order=None):
+        """
+        Elimina le voci per cui expired(valore) è vero e, se keep è dato, quelle in eccesso
+        (le prime secondo order(valore), cioè le più vecchie); ritorna quante.
+        """
+        with self._writing() as data:
+            keys = [k for k, v in data.items() if expired(v)]
+            excess = len(data) - len(keys) - keep if keep is not None else 0
+            if excess > 0:
+                dropped = set(keys)
+                alive = sorted((k for k in data if k not in dropped), key=lambda k: order(data[k]))
+                keys += alive[:excess]
+            for k in keys:
+                del data[k]
+                self._append(k, None)
+            return len(keys)
+
+    def replace(self, data):
+        with self._writing():
+            self._data = copy.deepcopy(data)
+            self._compact()
+
+    def compact(self):
+        """Scrive lo snapshot se il log ha righe in sospeso (es. all'uscita)."""
+        with self._lock:
+            if self._data is None or not self._log_lines:
+                return
+        with self._writing():
+            if self._log_lines:
+                self._compact()
+
+    # ---- interni ----
+    def _current_stamp(self):
+        try:
+            log_size = os.stat(self.log_path).st_size
+        except FileNotFoundError:
+            log_size = 0
+        return file_version(self.path), log_size
+
+    def _reload(self):
+        # chiamato con il lock del file preso: snapshot e log sono coerenti tra loro
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            data = {}
+        lines = 0
+        if self.log_path.exists():
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # riga troncata da un crash: si ignora
+                    lines += 1
+                    if rec.get("v") is None:
+                        data.pop(rec["k"], None)
+                    else:
+                        data[rec["k"]] = rec["v"]
+        self._data = data
+        self._log_lines = lines
+        self._stamp = self._current_stamp()
+
+    def _loaded(self):
+        if self._data is None or self._current_stamp() != self._stamp:
+            with self._file_lock.shared():
+                self._reload()
+        return self._data
+
+    @contextmanager
+    def _writing(self):
+        with self._lock, self._file_lock.exclusive():
+            if self._data is None or self._current_stamp() != self._stamp:
+                self._reload()
+            yield self._data
+            self._stamp = self._current_stamp()
+
+    def _append(self, key, value):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"k": key, "v": value}, ensure_ascii=False) + "\n")
+        self._log_lines += 1
+        if self._log_lines >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        # snapshot atomico, poi si svuota il log (riapplicarlo sullo snapshot è innocuo)
+        write_atomic(self.path, json.dumps(self._data, ensure_ascii=False, indent=2), fsync=self.fsync)
+        with open(self.log_path, "w", encoding="utf-8"):
+            pass
+        self._log_lines = 0
+
+
+# -----------------------------
+# BACKEND SQLITE (WAL)
+# -----------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    pos INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER UNIQUE NOT NULL,
+    nome TEXT,
+    tipologia TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_tipologia ON products(tipologia);
+CREATE TABLE IF NOT EXISTS categories (
+    pos INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    chat_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS message_tracking (
+    chat_id TEXT PRIMARY KEY,
+    history BLOB NOT NULL,
+    pinned INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS message_tracking_updated ON message_tracking(updated_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SqliteStorage(Storage):
+    """
+    Backend SQLite in modalità WAL: lettori concorrenti, un writer alla volta
+    (anche tra più worker gunicorn), aggiornamenti di una sola riga.
+    Una connessione per thread.
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, db_path, busy_timeout_ms=5000):
+        self.db_path = Path(db_path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        with self._write() as conn:
+            conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('products_version', '0')")
+            conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('categories_version', '0')")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        return _Transaction(self._conn())
+
+    # ---- meta ----
+    def get_meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._write() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _check_version(self, conn, key, expected_version):
+        if expected_version is ANY_VERSION:
+            return
+        row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        if int(row[0] if row else 0) != expected_version:
+            raise VersionConflict(f"{key} cambiata da un altro processo")
+
+    def _bump_version(self, conn, key):
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key=?", (key,))
+        return int(conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()[0])
+
+    def is_empty(self):
+        conn = self._conn()
+        for table in ("products", "categories", "sessions"):
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    # ---- prodotti ----
+    def load_products(self):
+        rows = self._conn().execute("SELECT data FROM products ORDER BY pos").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def save_products(self, products, changed=None, removed=None, expected_version=ANY_VERSION):
+        with self._write() as conn:
+            # il controllo avviene dentro BEGIN IMMEDIATE: nessun altro writer può intromettersi
+            self._check_version(conn, "products_version", expected_version)
+            if changed is None and removed is None:
+                conn.execute("DELETE FROM products")
+                changed = products
+            for pid in removed or ():
+                conn.execute("DELETE FROM products WHERE id=?", (pid,))
+            for p in changed or ():
+                conn.execute(
+                    "INSERT INTO products(id, nome, tipologia, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET nome=excluded.nome, tipologia=excluded.tipologia, data=excluded.data",
+                    (p.get("id"), p.get("nome"), p.get("tipologia"), json.dumps(p, ensure_ascii=False)),
+                )
+            return self._bump_version(conn, "products_version")
+
+    def products_version(self):
+        return int(self.get_meta("products_version", 0))
+
+    # ---- categorie ----
+    def load_categories(self):
+        rows = self._conn().execute("SELECT name FROM categories ORDER BY pos").fetchall()
+        return [r[0] for r in rows]
+
+    def save_categories(self, categories, expected_version=ANY_VERSION):
+        with self._write() as conn:
+            self._check_version(conn, "categories_version", expected_version)
+            conn.execute("DELETE FROM categories")
+            conn.executemany("INSERT OR IGNORE INTO categories(name) VALUES (?)", [(c,) for c in categories])
+            return self._bump_version(conn, "categories_version")
+
+    def categories_version(self):
+        return int(self.get_meta("categories_version", 0))
+
+    # ---- sessioni ----
+    def load_sessions(self):
+        rows = self._conn().execute("SELECT chat_id, data FROM sessions").fetchall()
+        return {r[0]: json.loads(r[1]) for r in rows}
+
+    def save_sessions(self, sessions):
+        with self._write() as conn:
+            conn.execute("DELETE FROM sessions")
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO sessions(chat_id, data, updated_at) VALUES (?, ?, ?)",
+                [(str(k), json.dumps(v, ensure_ascii=False), now) for k, v in sessions.items()],
+            )
+
+    def get_session(self, chat_id):
+        row = self._conn().execute("SELECT data FROM sessions WHERE chat_id=?", (str(chat_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_session(self, chat_id, sess):
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions(chat_id, data, updated_at) VALUES (?, ?, ?)",
+                (str(chat_id), json.dumps(sess, ensure_ascii=False), time.time()),
+            )
+
+    def delete_session(self, chat_id):
+        with self._write() as conn:
+            conn.execute("DELETE FROM sessions WHERE chat_id=?", (str(chat_id),))
+
+    def prune_sessions(self, older_than):
+        with self._write() as conn:
+            return conn.execute("DELETE FROM sessions WHERE updated_at < ?", (older_than,)).rowcount
+
+    # ---- messaggi tracciati ----
+    def get_tracking(self, chat_id):
+        row = self._conn().execute(
+            "SELECT history, pinned, updated_at FROM message_tracking WHERE chat_id=?", (str(chat_id),)
+        ).fetchone()
+        if not row:
+            return None
+        history = array("q")
+        history.frombytes(row[0])
+        return history.tolist(), row[1], row[2]
+
+    def set_tracking(self, chat_id, history=None, pinned=None):
+        # la cronologia è salvata come int64 impacchettati, non come JSON
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT history, pinned FROM message_tracking WHERE chat_id=?", (str(chat_id),)
+            ).fetchone()
+            blob = array("q", history).tobytes() if history is not None else (row[0] if row else b"")
+            if pinned is None and row:
+                pinned = row[1]
+            conn.execute(
+                "INSERT OR REPLACE INTO message_tracking(chat_id, history, pinned, updated_at) VALUES (?, ?, ?, ?)",
+                (str(chat_id), blob, pinned, time.time()),
+            )
+
+    def prune_tracking(self, older_than, keep=None):
+        with self._write() as conn:
+            conn.execute("DELETE FROM message_tracking WHERE updated_at < ?", (older_than,))
+            if keep is not None:
+                conn.execute(
+                    "DELETE FROM message_tracking WHERE chat_id NOT IN "
+                    "(SELECT chat_id FROM message_tracking ORDER BY updated_at DESC LIMIT ?)", (int(keep),)
+                )
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK: serializza i writer tra processi."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+# -----------------------------
+# MIGRAZIONE
+# -----------------------------
+def migrate_json_to_sqlite(source, target, force=False):
+    """
+    Copia prodotti, categorie e sessioni da un JsonStorage a un SqliteStorage.
+    Eseguita una sola volta: se il db è già stato migrato (o non è vuoto) non fa nulla.
+    """
+    if not force and (target.get_meta("migrated_at") or not target.is_empty()):
+        return False
+    target.save_products(source.load_products())
+    target.save_categories(source.load_categories())
+    target.save_sessions(source.load_sessions())
+    target.set_meta("migrated_at", time.time())
+    return True
+
+
+def make_storage(backend, products_path, categories_path, sessions_path, sqlite_path=None):
+    json_storage = JsonStorage(products_path, categories_path, sessions_path)
+    if backend == "json":
+        return json_storage
+    if backend == "sqlite":
+        sqlite_storage = SqliteStorage(sqlite_path)
+        migrate_json_to_sqlite(json_storage, sqlite_storage)
+        return sqlite_storage
+    raise ValueError(f"STORAGE_BACKEND sconosciuto: {backend}")
+
+
+if __name__ == "__main__":
+    # python storage.py migrate [db_path] [--force]
+    import sys
+    root = Path(__file__).parent
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args or args[0] != "migrate":
+        print("Uso: python storage.py migrate [db_path] [--force]")
+        sys.exit(1)
+    db_path = Path(args[1]) if len(args) > 1 else root / "vetrina.db"
+    src = JsonStorage(root / "products.json", root / "categories.json", root / "sessions.json")
+    done = migrate_json_to_sqlite(src, SqliteStorage(db_path), force="--force" in sys.argv)
+    print("Migrazione completata." if done else "Database già migrato, nulla da fare (usa --force).")
@@ -0,0 +1,284 @@
+# telegram_api.py
+import asyncio
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# timeout (connessione, lettura) in secondi per ogni metodo dell'API
+DEFAULT_TIMEOUTS = {
+    "sendMessage": (3.05, 10),
+    "sendPhoto": (3.05, 20),
+    "sendDocument": (3.05, 60),
+    "deleteMessage": (3.05, 5),
+    "getFile": (3.05, 10),
+    "download": (3.05, 60),
+    "getUpdates": (3.05, 40),
+}
+DEFAULT_TIMEOUT = (3.05, 15)
+
+# metodi che si possono ripetere anche dopo un timeout in lettura senza effetti doppi
+IDEMPOTENT_METHODS = {"getFile", "deleteMessage", "getMe", "getUpdates", "download"}
+
+
+class _ClientStats:
+    """Timeout, backoff e contatori per metodo condivisi dai client sync e async."""
+
+    def _init_common(self, token, base_url, timeouts, max_retries, backoff, max_retry_after):
+        self.api_url = f"{base_url.rstrip('/')}/bot{token}"
+        self.file_url = f"{base_url.rstrip('/')}/file/bot{token}"
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def on_retry_after(self, method, retry_after):
+        """Hook chiamato quando Telegram risponde 429 (per adattare eventuali limitatori)."""
+
+    def timeout_for(self, method):
+        return self.timeouts.get(method, DEFAULT_TIMEOUT)
+
+    def _backoff_delay(self, attempt):
+        return self.backoff * (2 ** (attempt - 1))
+
+    def _retry_delay(self, method, res, status_code, attempt):
+        """Secondi da attendere prima di ripetere una risposta non ok, None se non va ripetuta."""
+        if attempt >= self.max_retries:
+            return None
+        code = res.get("error_code") or status_code
+        if code == 429:
+            retry_after = (res.get("parameters") or {}).get("retry_after", 1)
+            if retry_after > self.max_retry_after:
+                return None
+            self.on_retry_after(method, retry_after)
+            return retry_after
+        if code >= 500:
+            return self._backoff_delay(attempt + 1)
+        return None
+
+    # ---- statistiche ----
+    def _record(self, method, start, error=False):
+        elapsed = time.monotonic() - start
+        with self._stats_lock:
+            st = self._stats.setdefault(method, {"calls": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0})
+            st["calls"] += 1
+            st["total_s"] += elapsed
+            st["max_s"] = max(st["max_s"], elapsed)
+            if error:
+                st["errors"] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            out = {}
+            for method, st in self._stats.items():
+                out[method] = dict(st, avg_ms=round(st["total_s"] / st["calls"] * 1000, 2) if st["calls"] else 0.0)
+            return out
+
+
+class TelegramClient(_ClientStats):
+    """
+    Client condiviso per la Bot API:
+    - una requests.Session con pool di connessioni keep-alive (niente handshake TLS ad ogni chiamata)
+    - timeout per metodo
+    - retry con backoff esponenziale, rispettando il retry_after dei 429 di Telegram
+    - contatori di latenza ed errori per metodo (vedi stats())
+    """
+
+    def __init__(self, token, base_url="https://api.telegram.org", pool_size=10,
+                 timeouts=None, max_retries=3, backoff=0.5, max_retry_after=30):
+        self._init_common(token, base_url, timeouts, max_retries, backoff, max_retry_after)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # ---- chiamate API ----
+    def call(self, method, data=None, params=None, files=None):
+        """
+        Esegue un metodo della Bot API e restituisce la risposta JSON di Telegram.
+        In caso di errore di rete definitivo restituisce {"ok": False, "description": ...}.
+        """
+        url = f"{self.api_url}/{method}"
+        http_method = "GET" if params is not None and data is None and files is None else "POST"
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                r = self.session.request(http_method, url, data=data, params=params, files=files,
+                                         timeout=self.timeout_for(method))
+                res = r.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(method, start, error=True)
+                # dopo un timeout in lettura la richiesta può essere arrivata: ripeti solo se innocua
+                retryable = method in IDEMPOTENT_METHODS or not isinstance(e, requests.exceptions.ReadTimeout)
+                if retryable and attempt < self.max_retries:
+                    attempt += 1
+                    time.sleep(self._backoff_delay(attempt))
+                    continue
+                return {"ok": False, "description": str(e)}
+            except ValueError:
+                # risposta non JSON (es. pagina di errore del proxy)
+                res = {"ok": False, "error_code": r.status_code, "description": r.text[:200]}
+
+            ok = bool(res.get("ok"))
+            self._record(method, start, error=not ok)
+            delay = None if ok else self._retry_delay(method, res, r.status_code, attempt)
+            if delay is None:
+                return res
+            attempt += 1
+            time.sleep(delay)
+
+    def download(self, file_path, dest_path, chunk_size=64 * 1024, max_bytes=None):
+        """Scarica un file in dest_path; False se fallisce o supera max_bytes (il file resta parziale)."""
+        url = f"{self.file_url}/{file_path}"
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout_for("download")) as r:
+                    if r.status_code != 200:
+                        self._record("download", start, error=True)
+                        if r.status_code >= 500 and attempt < self.max_retries:
+                            attempt += 1
+                            time.sleep(self._backoff_delay(attempt))
+                            continue
+                        return False
+                    written = 0
+                    with open(dest_path, "wb") as f:
+                        for chunk in r.iter_content(chunk_size):
+                            f.write(chunk)
+                            written += len(chunk)
+                            if max_bytes is not None and written > max_bytes:
+                                break
+                if max_bytes is not None and written > max_bytes:
+                    self._record("download", start, error=True)
+                    return False
+                self._record("download", start)
+                return True
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._record("download", start, error=True)
+                if attempt < self.max_retries:
+                    attempt += 1
+                    time.sleep(self._backoff_delay(attempt))
+                    continue
+                return False
+
+
+# -----------------------------
+# CLIENT ASYNC (httpx)
+# -----------------------------
+class AsyncTelegramClient(_ClientStats):
+    """
+    Versione asyncio di TelegramClient (stessi timeout, retry e contatori) basata su httpx:
+    un solo processo può tenere centinaia di richieste in volo sullo stesso pool.
+    """
+
+    def __init__(self, token, base_url="https://api.telegram.org", max_connections=100,
+                 timeouts=None, max_retries=3, backoff=0.5, max_retry_after=30):
+        import httpx  # dipendenza opzionale: serve solo al percorso ASGI
+        self._httpx = httpx
+        self._init_common(token, base_url, timeouts, max_retries, backoff, max_retry_after)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(limits=limits)
+
+    def _httpx_timeout(self, method):
+        connect, read = self.timeout_for(method)
+        return self._httpx.Timeout(read, connect=connect)
+
+    async def call(self, method, data=None, params=None, files=None):
+        httpx = self._httpx
+        url = f"{self.api_url}/{method}"
+        http_method = "GET" if params is not None and data is None and files is None else "POST"
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                r = await self.client.request(http_method, url, data=data, params=params, files=files,
+                                              timeout=self._httpx_timeout(method))
+                res = r.json()
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                self._record(method, start, error=True)
+                retryable = method in IDEMPOTENT_METHODS or not isinstance(e, httpx.ReadTimeout)
+                if retryable and attempt < self.max_retries:
+                    attempt += 1
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    continue
+                return {"ok": False, "description": str(e)}
+            except ValueError:
+                res = {"ok": False, "error_code": r.status_code, "description": r.text[:200]}
+
+            ok = bool(res.get("ok"))
+            self._record(method, start, error=not ok)
+            delay = None if ok else self._retry_delay(method, res, r.status_code, attempt)
+            if delay is None:
+                return res
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def download(self, file_path, dest_path, chunk_size=64 * 1024, max_bytes=None):
+        httpx = self._httpx
+        url = f"{self.file_url}/{file_path}"
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                async with self.client.stream("GET", url, timeout=self._httpx_timeout("download")) as r:
+                    if r.status_code != 200:
+                        self._record("download", start, error=True)
+                        if r.status_code >= 500 and attempt < self.max_retries:
+                            attempt += 1
+                            await asyncio.sleep(self._backoff_delay(attempt))
+                            continue
+                        return False
+                    written = 0
+                    with open(dest_path, "wb") as f:
+                        async for chunk in r.aiter_bytes(chunk_size):
+                            f.write(chunk)
+                            written += len(chunk)
+                            if max_bytes is not None and written > max_bytes:
+                                break
+                if max_bytes is not None and written > max_bytes:
+                    self._record("download", start, error=True)
+                    return False
+                self._record("download", start)
+                return True
+            except (httpx.TransportError, httpx.TimeoutException):
+                self._record("download", start, error=True)
+                if attempt < self.max_retries:
+                    attempt += 1
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    continue
+                return False
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class LoopBridgeClient:
+    """
+    Facciata sincrona di un AsyncTelegramClient: gli handler (codice sync, eseguiti in thread)
+    chiamano call()/download() come con TelegramClient, ma l'I/O gira sull'event loop.
+    """
+
+    def __init__(self, async_client, loop):
+        self.async_client = async_client
+        self.loop = loop
+
+    def call(self, method, data=None, params=None, files=None):
+        fut = asyncio.run_coroutine_threadsafe(self.async_client.call(method, data=data, params=params, files=files), self.loop)
+        return fut.result()
+
+    def download(self, file_path, dest_path, chunk_size=64 * 1024, max_bytes=None):
+        fut = asyncio.run_coroutine_threadsafe(
+            self.async_client.download(file_path, dest_path, chunk_size, max_bytes), self.loop)
+        return fut.result()
+
+    def timeout_for(self, method):
+        return self.async_client.timeout_for(method)
+
+    def stats(self):
+        return self.async_client.stats()
@@ -0,0 +1,19 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope="session")
+def bot():
+    """bot.py su una cartella dati temporanea: niente Telegram reale, niente pubblicazione statica."""
+    os.environ.update(DATA_DIR=tempfile.mkdtemp(prefix="vetrina-test-"), PUBLISH_DIR="",
+                      TELEGRAM_API_URL="http://127.0.0.1:9", TG_CHAT_RATE="1000", TG_GLOBAL_RATE="1000")
+    import bot
+    return bot
@@ -0,0 +1,62 @@
+# tests/test_bulk.py
+import io
+import json
+
+import pytest
+
+import bulk
+from catalog import Catalog
+from storage import JsonStorage
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return Catalog(JsonStorage(tmp_path / "products.json", tmp_path / "categories.json", tmp_path / "sessions.json"))
+
+
+def stream(text):
+    return io.BytesIO(text.encode("utf-8"))
+
+
+@pytest.mark.parametrize("name, fmt", [
+    ("catalogo.csv", "csv"), ("catalogo.JSONL", "jsonl"), ("catalogo.ndjson", "jsonl"),
+    ("products.json", "json"), ("catalogo.xlsx", None),
+])
+def test_detect_format(name, fmt):
+    assert bulk.detect_format(name) == fmt
+
+
+def test_import_json_array(catalog):
+    products = [{"id": 1, "nome": "Vaso", "prezzo": "10", "tipologia": "Vasi", "immagine": "media/vaso.jpg"},
+                {"id": 2, "nome": "Piatto", "prezzo": "5,50", "tipologia": "Piatti"}]
+    report = bulk.import_catalog(stream(json.dumps(products, indent=2)), "json", catalog)
+    assert (report.rows, report.added, report.errors) == (2, 2, [])
+    assert sorted(p["nome"] for p in catalog.all()) == ["Piatto", "Vaso"]
+
+
+def test_import_json_rejects_non_list(catalog):
+    with pytest.raises(ValueError):
+        bulk.import_catalog(stream('{"nome": "Vaso"}'), "json", catalog)
+
+
+def test_import_jsonl_reports_bad_lines(catalog):
+    text = '{"nome": "Vaso", "prezzo": "10", "tipologia": "Vasi"}\nnon json\n{"nome": "Tazza", "prezzo": "x", "tipologia": "Tazze"}\n'
+    report = bulk.import_catalog(stream(text), "jsonl", catalog)
+    assert report.added == 1
+    assert [line for line, _ in report.errors] == [2, 3]
+
+
+def test_import_csv_updates_by_name(catalog):
+    catalog.add({"nome": "Vaso", "prezzo": "10", "tipologia": "Vasi"})
+    report = bulk.import_catalog(stream("nome;prezzo;tipologia\nvaso;12;Vasi\nTazza;3;Tazze\n"), "csv", catalog,
+                                 known_categories=catalog.categories())
+    assert (report.added, report.updated) == (1, 1)
+    assert catalog.find_by_name("Vaso")["prezzo"] == "12"
+    assert report.new_categories == ["Tazze"]
+
+
+def test_export_roundtrip(catalog):
+    catalog.add({"nome": "Vaso", "prezzo": "10", "tipologia": "Vasi"})
+    data = b"".join(bulk.iter_export(catalog.all(), "jsonl"))
+    records = [r for _, r in bulk.iter_records(io.BytesIO(data), "jsonl")]
+    assert records[0]["nome"] == "Vaso"
@@ -0,0 +1,42 @@
+# tests/test_catalog.py
+import pytest
+
+from catalog import Catalog
+from storage import JsonStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return JsonStorage(tmp_path / "products.json", tmp_path / "categories.json", tmp_path / "sessions.json")
+
+
+def test_remove_category_without_tipologia(storage):
+    catalog = Catalog(storage)
+    released = []
+    catalog.on_media_released = released.append
+    catalog.add({"nome": "Senza", "immagine": "media/a.jpg"})
+    catalog.add({"nome": "Vaso", "tipologia": "Vasi", "immagine": "media/b.jpg"})
+    assert catalog.remove_category("Senza categoria") == 1
+    assert [p["nome"] for p in catalog.all()] == ["Vaso"]
+    assert [p["nome"] for p in Catalog(storage).all()] == ["Vaso"]
+    assert released == ["media/a.jpg"]
+
+
+def test_reads_without_products_file_do_not_notify(storage):
+    catalog = Catalog(storage)
+    events = []
+    catalog.subscribe(lambda changed, removed: events.append((changed, removed)))
+    assert catalog.all() == []
+    assert catalog.count() == 0
+    assert catalog.get(1) is None
+    assert events == []
+
+
+def test_change_from_other_worker_notifies(storage):
+    catalog, other = Catalog(storage), Catalog(storage)
+    catalog.count()
+    events = []
+    catalog.subscribe(lambda changed, removed: events.append((changed, removed)))
+    other.add({"nome": "Vaso"})
+    assert catalog.count() == 1
+    assert events == [(None, None)]
@@ -0,0 +1,75 @@
+# tests/test_catalog_api.py
+import pytest
+
+from catalog_api import CatalogSnapshot, decode_cursor, encode_cursor
+
+
+def make_snapshot(n=10):
+    products = [{"id": i, "nome": f"Prodotto {i:02d}", "prezzo": str(100 - i), "tipologia": "A" if i % 2 else "B"}
+                for i in range(1, n + 1)]
+    return CatalogSnapshot("v1", products, ["A", "B"], b"{}")
+
+
+def all_pages(snap, tipologia=None, sort="default", limit=3):
+    ids, cursor = [], None
+    while True:
+        items, next_cursor, total = snap.page(tipologia, sort, cursor, limit)
+        ids += [p["id"] for p in items]
+        if next_cursor is None:
+            return ids, total
+        cursor = decode_cursor(next_cursor)
+
+
+def test_cursor_roundtrip():
+    cursor = encode_cursor("prezzo", (0, 9.5), 42)
+    assert decode_cursor(cursor) == ("prezzo", (0, 9.5), 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "!!!", encode_cursor("casuale", (1,), 1)])
+def test_decode_rejects_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("sort, expected", [
+    ("default", list(range(1, 11))),
+    ("prezzo", list(range(10, 0, -1))),
+    ("-nome", list(range(10, 0, -1))),
+])
+def test_pages_cover_the_catalog_once(sort, expected):
+    ids, total = all_pages(make_snapshot(), sort=sort)
+    assert ids == expected
+    assert total == 10
+
+
+def test_pages_filter_by_tipologia():
+    ids, total = all_pages(make_snapshot(), tipologia="A")
+    assert ids == [1, 3, 5, 7, 9]
+    assert total == 5
+
+
+def test_cursor_of_another_sort_is_rejected():
+    snap = make_snapshot()
+    _, next_cursor, _ = snap.page(None, "prezzo", None, 3)
+    with pytest.raises(ValueError):
+        snap.page(None, "nome", decode_cursor(next_cursor), 3)
+
+
+def test_cursor_survives_removed_product():
+    snap = make_snapshot()
+    _, next_cursor, _ = snap.page(None, "default", None, 3)
+    products = [p for p in snap.products if p["id"] != 3]
+    newer = CatalogSnapshot("v2", products, snap.categories, b"{}")
+    items, _, _ = newer.page(None, "default", decode_cursor(next_cursor), 3)
+    assert [p["id"] for p in items] == [4, 5, 6]
+
+
+@pytest.mark.parametrize("query, error", [
+    ("limit=abc", "limit non valido"),
+    ("cursor=xyz", "cursore non valido"),
+    ("sort=nome&cursor=" + encode_cursor("prezzo", (0, 1.0), 1), "cursore non valido"),
+])
+def test_api_rejects_bad_parameters(bot, query, error):
+    res = bot.app.test_client().get(f"/api/catalog?{query}")
+    assert res.status_code == 400
+    assert res.get_json()["error"] == error
@@ -0,0 +1,40 @@
+# tests/test_cleanup.py
+import json
+
+from cleanup import DeleteBatcher
+
+
+class RecordingClient:
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.calls = []
+
+    def call(self, method, data=None, params=None, files=None):
+        self.calls.append((method, data))
+        if method == "deleteMessages" and not self.ok:
+            return {"ok": False, "error_code": 404}
+        return {"ok": True}
+
+
+def test_deletes_are_batched_per_chat():
+    client = RecordingClient()
+    batcher = DeleteBatcher(lambda: client, delay=60)
+    for mid in (1, 2, 2, 3):
+        batcher.schedule(10, mid)
+    batcher.schedule(20, 7)
+    batcher.flush()
+    calls = {data["chat_id"]: (method, data) for method, data in client.calls}
+    assert calls[10][0] == "deleteMessages"
+    assert json.loads(calls[10][1]["message_ids"]) == [1, 2, 3]
+    assert calls[20] == ("deleteMessage", {"chat_id": 20, "message_id": 7})
+    assert batcher.stats()["deleted"] == 4
+
+
+def test_falls_back_to_single_deletes():
+    client = RecordingClient(ok=False)
+    batcher = DeleteBatcher(lambda: client, delay=60)
+    for mid in (1, 2):
+        batcher.schedule(10, mid)
+    batcher.flush()
+    assert [m for m, _ in client.calls] == ["deleteMessages", "deleteMessage", "deleteMessage"]
+    assert batcher.stats()["fallback_calls"] == 2
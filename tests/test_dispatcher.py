@@ -0,0 +1,69 @@
+# tests/test_dispatcher.py
+import threading
+
+from dispatcher import UpdateDeduplicator, UpdateDispatcher, chat_key
+
+
+def test_dedup_window_drops_oldest():
+    dedup = UpdateDeduplicator(window=3)
+    assert [dedup.seen(u) for u in (1, 2, 3, 1, 4)] == [False, False, False, True, False]
+    assert dedup.seen(1) is False   # uscito dalla finestra
+
+
+def test_dedup_shared_between_workers(tmp_path):
+    path = tmp_path / "dedup.json"
+    a = UpdateDeduplicator(window=100, path=path, persist_every=1)
+    b = UpdateDeduplicator(window=100, path=path, persist_every=1)
+    assert a.seen(10) is False
+    # Telegram riconsegna a un altro worker l'update già gestito dal primo
+    assert b.seen(10) is True
+    assert b.seen(11) is False
+    assert a.seen(11) is True
+
+
+def test_dedup_merge_keeps_other_workers_ids(tmp_path):
+    path = tmp_path / "dedup.json"
+    a = UpdateDeduplicator(window=100, path=path, persist_every=2)
+    b = UpdateDeduplicator(window=100, path=path, persist_every=2)
+    for u in (1, 2):
+        a.seen(u)
+    for u in (3, 4):
+        b.seen(u)
+    restarted = UpdateDeduplicator(window=100, path=path)
+    assert all(restarted.seen(u) for u in (1, 2, 3, 4))
+
+
+def test_dedup_forget_survives_merge(tmp_path):
+    path = tmp_path / "dedup.json"
+    dedup = UpdateDeduplicator(window=100, path=path, persist_every=1)
+    dedup.seen(5)
+    dedup.forget(5)
+    dedup.seen(6)
+    assert dedup.seen(5) is False
+
+
+def test_dispatcher_keeps_order_within_chat():
+    seen, lock = {}, threading.Lock()
+
+    def handler(update):
+        with lock:
+            seen.setdefault(chat_key(update), []).append(update["update_id"])
+
+    dispatcher = UpdateDispatcher(handler, workers=4)
+    for i in range(200):
+        assert dispatcher.submit({"update_id": i, "message": {"chat": {"id": i % 5}}})
+    dispatcher.join()
+    for chat, ids in seen.items():
+        assert ids == sorted(ids)
+    assert sum(len(ids) for ids in seen.values()) == 200
+
+
+def test_dispatcher_rejects_when_full():
+    release = threading.Event()
+    dispatcher = UpdateDispatcher(lambda u: release.wait(5), workers=1, maxsize=2)
+    assert dispatcher.submit({"update_id": 1})
+    assert dispatcher.submit({"update_id": 2})
+    assert dispatcher.submit({"update_id": 3}) is False
+    release.set()
+    dispatcher.join()
+    assert dispatcher.stats()["rejected"] == 1
@@ -0,0 +1,70 @@
+# tests/test_media.py
+import pytest
+
+from catalog import Catalog
+from media import MediaStore, is_hashed_media, sniff_kind
+from storage import JsonStorage
+
+JPEG = b"\xff\xd8\xff\xe0" + b"x" * 32
+
+
+@pytest.fixture
+def store(tmp_path):
+    media_dir = tmp_path / "media"
+    media_dir.mkdir()
+    return MediaStore(media_dir, index_path=tmp_path / "media_index.json")
+
+
+def write_tmp(store, name, data):
+    tmp = store.media_dir / name
+    tmp.write_bytes(data)
+    return tmp
+
+
+def test_same_content_is_stored_once(store):
+    a = store.store(write_tmp(store, "a.tmp", JPEG), ".jpg")
+    b = store.store(write_tmp(store, "b.tmp", JPEG), ".jpg")
+    assert a == b and is_hashed_media(a)
+    assert sorted(p.name for p in store.media_dir.iterdir()) == [a[len("media/"):]]
+    assert store.stats()["deduplicated"] == 1
+
+
+def test_release_removes_file_variants_and_index(store):
+    rel = store.store(write_tmp(store, "a.tmp", JPEG), ".jpg")
+    name = rel[len("media/"):]
+    (store.media_dir / name.replace(".jpg", ".w400.webp")).write_bytes(b"webp")
+    store.remember_unique("uid-1", rel)
+    assert store.lookup_unique("uid-1") == rel
+    assert store.release(rel)
+    assert list(store.media_dir.iterdir()) == []
+    assert store.lookup_unique("uid-1") is None
+    assert not store.release("media/foto.jpg")
+
+
+def test_index_is_merged_between_workers(store, tmp_path):
+    other = MediaStore(store.media_dir, index_path=store.index_path)
+    rel = store.store(write_tmp(store, "a.tmp", JPEG), ".jpg")
+    store.remember_unique("uid-1", rel)
+    other.remember_unique("uid-2", rel)
+    restarted = MediaStore(store.media_dir, index_path=store.index_path)
+    assert restarted.lookup_unique("uid-1") == restarted.lookup_unique("uid-2") == rel
+
+
+def test_catalog_releases_media_only_when_unused(store, tmp_path):
+    catalog = Catalog(JsonStorage(tmp_path / "products.json", tmp_path / "categories.json",
+                                  tmp_path / "sessions.json"))
+    catalog.on_media_released = store.release
+    rel = store.store(write_tmp(store, "a.tmp", JPEG), ".jpg")
+    a = catalog.add({"nome": "Vaso", "immagine": rel})
+    b = catalog.add({"nome": "Piatto", "immagine": rel})
+    assert catalog.media_refs(rel) == 2
+    catalog.remove(a["id"])
+    assert (store.media_dir / rel[len("media/"):]).exists()
+    catalog.update(b["id"], immagine=None)
+    assert not (store.media_dir / rel[len("media/"):]).exists()
+
+
+def test_sniff_kind():
+    assert sniff_kind(JPEG) == "image"
+    assert sniff_kind(b"\x00\x00\x00\x18ftypmp42") == "video"
+    assert sniff_kind(b"<html>") is None
@@ -0,0 +1,60 @@
+# tests/test_polling.py
+from dispatcher import UpdateDeduplicator, UpdateDispatcher
+from polling import PollingRunner
+
+
+class FakeClient:
+    """getUpdates da una lista fissa: riconsegna tutto ciò che segue l'offset."""
+
+    def __init__(self, updates):
+        self.updates = updates
+
+    def call(self, method, data=None):
+        offset = int((data or {}).get("offset") or 0)
+        return {"ok": True, "result": [u for u in self.updates if u["update_id"] >= offset]}
+
+
+def make_runner(handler, max_attempts=3):
+    updates = [{"update_id": i, "message": {"chat": {"id": i % 2}, "text": str(i)}} for i in range(1, 6)]
+    dispatcher = UpdateDispatcher(handler, workers=2, dedup=UpdateDeduplicator(window=100))
+    return PollingRunner(FakeClient(updates), dispatcher, idle_sleep=0, max_attempts=max_attempts)
+
+
+def test_offset_covers_batch_when_all_succeed():
+    handled = []
+    runner = make_runner(lambda u: handled.append(u["update_id"]))
+    runner.poll_once()
+    assert runner.offset == 6
+    assert sorted(handled) == [1, 2, 3, 4, 5]
+
+
+def test_failed_update_is_retried_without_reprocessing_others():
+    handled, failures = [], {3: 1}
+
+    def handler(update):
+        uid = update["update_id"]
+        if failures.get(uid):
+            failures[uid] -= 1
+            raise RuntimeError("temporaneo")
+        handled.append(uid)
+
+    runner = make_runner(handler)
+    runner.poll_once()
+    assert runner.offset == 3
+    runner.poll_once()
+    assert runner.offset == 6
+    assert sorted(handled) == [1, 2, 3, 4, 5]
+    assert runner.counters["retried"] == 1
+
+
+def test_update_failing_every_time_is_dropped():
+    def handler(update):
+        if update["update_id"] == 2:
+            raise RuntimeError("sempre")
+
+    runner = make_runner(handler, max_attempts=2)
+    runner.poll_once()
+    assert runner.offset == 2
+    runner.poll_once()
+    assert runner.offset == 6
+    assert runner.counters["dropped"] == 1
@@ -0,0 +1,81 @@
+# tests/test_prerender.py
+import json
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from catalog_api import CatalogSnapshot
+from prerender import VetrinaRenderer
+
+SCRIPT_JS = Path(__file__).resolve().parent.parent / "web_app" / "script.js"
+
+PATHS = ["media/a.jpg", "/media/a.jpg", "https://cdn.example/a.jpg", "http://cdn.example/a.jpg",
+         "//cdn.example/a.jpg", "HTTPS://cdn.example/a.jpg"]
+
+
+def renderer(tmp_path, products=(), media_base=""):
+    template = tmp_path / "vetrina.html"
+    template.write_text('<select><!--#tipologie--></select><div class="prodotti"><!--#prodotti--></div>',
+                        encoding="utf-8")
+    snap = CatalogSnapshot("v1", list(products), ["Vasi"], b"{}")
+    return VetrinaRenderer(template, lambda: snap, media_base=media_base)
+
+
+@pytest.mark.parametrize("media_base, path, expected", [
+    ("", "media/a.jpg", "/media/a.jpg"),
+    ("", "/media/a.jpg", "/media/a.jpg"),
+    ("https://api.example/", "media/a.jpg", "https://api.example/media/a.jpg"),
+    ("https://api.example", "https://cdn.example/a.jpg", "https://cdn.example/a.jpg"),
+    ("https://api.example", "//cdn.example/a.jpg", "//cdn.example/a.jpg"),
+    ("", "https://cdn.example/a.jpg?w=1&h=2", "https://cdn.example/a.jpg?w=1&amp;h=2"),
+])
+def test_url(tmp_path, media_base, path, expected):
+    assert renderer(tmp_path, media_base=media_base)._url(path) == expected
+
+
+def test_render_keeps_absolute_variant_urls(tmp_path):
+    product = {"id": 1, "nome": "Vaso", "prezzo": "10", "tipologia": "Vasi", "immagine": "media/vaso.jpg",
+               "varianti": {"width": 800, "height": 600,
+                            "srcset": [{"w": 400, "jpg": "https://cdn.example/vaso-400.jpg",
+                                        "webp": "media/vaso-400.webp"}]}}
+    _, html, _ = renderer(tmp_path, [product]).render()
+    html = html.decode("utf-8")
+    assert 'src="https://cdn.example/vaso-400.jpg"' in html
+    assert "/media/vaso-400.webp 400w" in html
+    assert "/https:" not in html
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node non disponibile")
+def test_same_rule_as_script_js(tmp_path):
+    # urlMedia() di script.js con VETRINA_API impostato deve dare gli stessi URL del server
+    source = SCRIPT_JS.read_text(encoding="utf-8")
+    fn = re.search(r"function urlMedia\(percorso\) \{.*?\n  \}", source, re.S).group()
+    js = (f"const API_BASE = 'https://api.example';\n{fn}\n"
+          f"console.log(JSON.stringify({json.dumps(PATHS)}.map(urlMedia)));")
+    out = subprocess.run(["node", "-e", js], capture_output=True, text=True, check=True).stdout
+    r = renderer(tmp_path, media_base="https://api.example")
+    assert json.loads(out) == [r._url(p) for p in PATHS]
+
+
+def test_etag_follows_template(tmp_path):
+    r = renderer(tmp_path)
+    etag, _, _ = r.render()
+    assert r.render()[0] == etag
+    r.template_path.write_text('<main><div class="prodotti"><!--#prodotti--></div></main>', encoding="utf-8")
+    assert r.render()[0] != etag
+
+
+def test_vetrina_revalidates_after_template_change(bot, tmp_path, monkeypatch):
+    template = tmp_path / "vetrina.html"
+    template.write_text(bot.vetrina_renderer.template_path.read_text(encoding="utf-8"), encoding="utf-8")
+    monkeypatch.setattr(bot.vetrina_renderer, "template_path", template)
+    client = bot.app.test_client()
+    etag = client.get("/vetrina/").headers["ETag"]
+    assert client.get("/vetrina/", headers={"If-None-Match": etag}).status_code == 304
+    template.write_text(template.read_text(encoding="utf-8").replace("<body", "<body data-v2", 1), encoding="utf-8")
+    res = client.get("/vetrina/", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
@@ -0,0 +1,66 @@
+# tests/test_publish.py
+import json
+import time
+
+import pytest
+
+from catalog import Catalog
+from catalog_api import CatalogFeed
+from publish import MANIFEST_NAME, CatalogPublisher, DirectorySink, snapshot_name
+from storage import JsonStorage
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    storage = JsonStorage(tmp_path / "products.json", tmp_path / "categories.json", tmp_path / "sessions.json")
+    return Catalog(storage)
+
+
+@pytest.fixture
+def feed(catalog):
+    return CatalogFeed(catalog, lambda: ["Vasi"], storage=catalog.storage)
+
+
+def manifest(sink):
+    return json.loads((sink.path / MANIFEST_NAME).read_text(encoding="utf-8"))
+
+
+def test_publish_writes_snapshot_and_manifest(tmp_path, catalog, feed):
+    catalog.add({"nome": "Vaso", "tipologia": "Vasi"})
+    sink = DirectorySink(tmp_path / "public")
+    publisher = CatalogPublisher(feed.snapshot, sink)
+    m = publisher.publish()
+    assert manifest(sink) == m
+    assert m["file"] == snapshot_name(m["version"])
+    body = json.loads((sink.path / m["file"]).read_bytes())
+    assert [p["nome"] for p in body["prodotti"]] == ["Vaso"]
+    assert (sink.path / (m["file"] + ".gz")).exists()
+    # stessa versione: i file non vengono riscritti
+    publisher.publish()
+    assert publisher.stats()["reused"] == 1
+
+
+def test_old_snapshots_are_pruned(tmp_path, catalog, feed):
+    sink = DirectorySink(tmp_path / "public")
+    publisher = CatalogPublisher(feed.snapshot, sink, keep=2)
+    for i in range(4):
+        catalog.add({"nome": f"Prodotto {i}", "tipologia": "Vasi"})
+        publisher.publish()
+        time.sleep(0.01)
+    versions = [n for n in sink.names() if n.startswith("catalog.") and n.endswith(".json")]
+    assert len(versions) == 2
+    assert manifest(sink)["file"] in versions
+
+
+def test_schedule_debounces_changes(tmp_path, catalog, feed):
+    sink = DirectorySink(tmp_path / "public")
+    publisher = CatalogPublisher(feed.snapshot, sink, delay=0.05)
+    catalog.subscribe(publisher.schedule)
+    for i in range(5):
+        catalog.add({"nome": f"Prodotto {i}", "tipologia": "Vasi"})
+    deadline = time.monotonic() + 2
+    while not (sink.path / MANIFEST_NAME).exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert manifest(sink)["products"] == 5
+    assert publisher.stats()["published"] == 1
@@ -0,0 +1,59 @@
+# tests/test_ratelimit.py
+import time
+
+from ratelimit import RateLimitedClient, SendScheduler, TokenBucket
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def call(self, method, data=None, params=None, files=None):
+        self.calls.append((method, data))
+        return {"ok": True}
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = bucket.updated
+    bucket.consume()
+    bucket.consume()
+    assert bucket.wait_time(now) > 0
+    assert bucket.wait_time(now + 0.1) == 0
+
+
+def test_chat_limit_spaces_sends_to_one_chat():
+    scheduler = SendScheduler(global_rate=1000, global_burst=1000, chat_rate=20, chat_burst=1)
+    start = time.monotonic()
+    for _ in range(3):
+        scheduler.acquire(chat_id=1)
+    # dopo il primo token ne servono altri due a 20/s
+    assert time.monotonic() - start >= 0.09
+    # un'altra chat non aspetta la prima
+    start = time.monotonic()
+    scheduler.acquire(chat_id=2)
+    assert time.monotonic() - start < 0.05
+
+
+def test_retry_after_halves_global_rate():
+    scheduler = SendScheduler(global_rate=30, global_burst=30, min_rate=1)
+    scheduler.on_retry_after("sendMessage", 0)
+    assert scheduler.stats()["global_rate"] == 15
+    assert scheduler.stats()["retry_after"] == 1
+
+
+def test_client_skips_limiter_for_unlimited_methods():
+    scheduler = SendScheduler(global_rate=1000, global_burst=1000)
+    client = RateLimitedClient(RecordingClient(), scheduler)
+    client.call("getUpdates", data={"timeout": 0})
+    client.call("sendMessage", data={"chat_id": 1, "text": "ciao"})
+    assert scheduler.stats()["acquired"] == 1
+    assert [m for m, _ in client.inner.calls] == ["getUpdates", "sendMessage"]
+
+
+def test_idle_chat_buckets_are_pruned():
+    scheduler = SendScheduler(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1, max_chats=2)
+    for chat in (1, 2, 3):
+        scheduler.acquire(chat_id=chat)
+        time.sleep(0.01)
+    assert scheduler.stats()["tracked_chats"] <= 2
@@ -0,0 +1,48 @@
+# tests/test_search.py
+import pytest
+
+from catalog import Catalog
+from search import SearchIndex, normalize
+from storage import JsonStorage
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = Catalog(JsonStorage(tmp_path / "products.json", tmp_path / "categories.json",
+                                  tmp_path / "sessions.json"))
+    for nome, tipologia in [("Caffè Arabica", "Caffè"), ("Caffè Robusta", "Caffè"), ("Tè verde", "Tè")]:
+        catalog.add({"nome": nome, "tipologia": tipologia})
+    return catalog
+
+
+def names(result):
+    return [p["nome"] for p in result[0]]
+
+
+def test_normalize():
+    assert normalize("Caffè  Arabica!") == "caffe arabica"
+
+
+def test_exact_prefix_and_typo(catalog):
+    index = SearchIndex(catalog)
+    assert names(index.search("arabica")) == ["Caffè Arabica"]
+    assert names(index.search("rob")) == ["Caffè Robusta"]
+    assert names(index.search("arabika")) == ["Caffè Arabica"]
+    assert index.search("caffe")[1] == 2
+
+
+def test_filter_by_tipologia(catalog):
+    index = SearchIndex(catalog)
+    assert names(index.search("", tipologia="Tè")) == ["Tè verde"]
+
+
+def test_follows_catalog_changes(catalog):
+    index = SearchIndex(catalog)
+    index.search("caffe")
+    product = catalog.find_by_name("Tè verde")
+    catalog.update(product["id"], nome="Tè nero")
+    catalog.add({"nome": "Caffè Moka", "tipologia": "Caffè"})
+    assert names(index.search("nero")) == ["Tè nero"]
+    assert index.search("verde")[1] == 0
+    assert index.search("caffe")[1] == 3
+    assert index.stats()["rebuilds"] == 1
@@ -0,0 +1,53 @@
+# tests/test_sessions.py
+import time
+
+import pytest
+
+from sessions import SessionStore
+from storage import JsonStorage, SqliteStorage
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def open_storage(request, tmp_path):
+    def open_():
+        if request.param == "json":
+            return JsonStorage(tmp_path / "products.json", tmp_path / "categories.json", tmp_path / "sessions.json",
+                               compact_every=3)
+        return SqliteStorage(tmp_path / "vetrina.db")
+    return open_
+
+
+def test_sessions_persist_and_are_shared(open_storage):
+    a, b = SessionStore(open_storage()), SessionStore(open_storage())
+    a.set(1, {"mode": "adding", "step": "nome"})
+    assert b.get(1)["step"] == "nome"
+    b.delete(1)
+    assert a.get(1) == {}
+
+
+def test_json_log_survives_restart_and_compaction(open_storage):
+    store = SessionStore(open_storage())
+    for chat in range(7):
+        store.set(chat, {"mode": "adding", "n": chat})
+    store.delete(3)
+    restarted = SessionStore(open_storage())
+    assert [restarted.get(chat).get("n") for chat in range(7)] == [0, 1, 2, None, 4, 5, 6]
+
+
+def test_expired_session_is_dropped(open_storage):
+    store = SessionStore(open_storage(), ttl=60)
+    store.set(1, {"mode": "adding"})
+    stale = store.storage.get_session(1)
+    stale["updated_at"] = time.time() - 120
+    store.storage.set_session(1, stale)
+    assert store.get(1) == {}
+    assert store.storage.get_session(1) is None
+
+
+def test_sweep_removes_expired_sessions(open_storage):
+    store = SessionStore(open_storage(), ttl=0.05)
+    store.set(2, {"mode": "removing"})
+    time.sleep(0.1)
+    store.set(1, {"mode": "adding"})
+    assert store.sweep() == 1
+    assert store.get(1)["mode"] == "adding"
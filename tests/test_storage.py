@@ -0,0 +1,100 @@
+# tests/test_storage.py
+import pytest
+
+import storage as storage_module
+from catalog import Catalog
+from storage import ANY_VERSION, JsonStorage, SqliteStorage, VersionConflict
+from tracking import MessageTracker
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def open_storage(request, tmp_path):
+    """Apre un'altra istanza sugli stessi dati: come un secondo worker gunicorn."""
+    def open_():
+        if request.param == "json":
+            return JsonStorage(tmp_path / "products.json", tmp_path / "categories.json", tmp_path / "sessions.json")
+        return SqliteStorage(tmp_path / "vetrina.db")
+    return open_
+
+
+def test_save_products_rejects_stale_version(open_storage):
+    a, b = open_storage(), open_storage()
+    version = a.save_products([{"id": 1, "nome": "Uno"}])
+    b.save_products([{"id": 1, "nome": "Uno"}, {"id": 2, "nome": "Due"}], expected_version=version)
+    with pytest.raises(VersionConflict):
+        a.save_products([{"id": 1, "nome": "Uno bis"}], expected_version=version)
+    assert [p["id"] for p in a.load_products()] == [1, 2]
+    # la scrittura incondizionata vince comunque
+    a.save_products([{"id": 3, "nome": "Tre"}], expected_version=ANY_VERSION)
+    assert [p["id"] for p in b.load_products()] == [3]
+
+
+def test_update_categories_retries_on_conflict(open_storage):
+    a, b = open_storage(), open_storage()
+    a.save_categories(["Vasi"])
+    calls = []
+
+    def add_piatti(categories):
+        calls.append(list(categories))
+        if len(calls) == 1:
+            # un altro worker salva tra la lettura e la scrittura
+            b.save_categories(categories + ["Tazze"])
+        return categories + ["Piatti"]
+
+    assert a.update_categories(add_piatti) == ["Vasi", "Tazze", "Piatti"]
+    assert calls == [["Vasi"], ["Vasi", "Tazze"]]
+    assert b.load_categories() == ["Vasi", "Tazze", "Piatti"]
+
+
+def test_update_categories_none_saves_nothing(open_storage):
+    s = open_storage()
+    s.save_categories(["Vasi"])
+    version = s.categories_version()
+    assert s.update_categories(lambda categories: None) is None
+    assert s.categories_version() == version
+
+
+def test_json_save_categories_propagates_errors(tmp_path, monkeypatch):
+    s = JsonStorage(tmp_path / "products.json", tmp_path / "categories.json", tmp_path / "sessions.json")
+
+    def broken(*args, **kwargs):
+        raise OSError("disco pieno")
+
+    monkeypatch.setattr(storage_module, "write_atomic", broken)
+    with pytest.raises(OSError):
+        s.save_categories(["Vasi"])
+
+
+def test_catalog_write_retries_after_other_worker(open_storage):
+    a, b = Catalog(open_storage()), Catalog(open_storage())
+    a.add({"nome": "Vaso", "tipologia": "Vasi"})
+    assert b.count() == 1
+    a.add({"nome": "Piatto", "tipologia": "Piatti"})
+    # b ha in memoria la versione precedente: la modifica si riapplica sui dati aggiornati
+    b.add({"nome": "Tazza", "tipologia": "Tazze"})
+    names = sorted(p["nome"] for p in a.all())
+    assert names == ["Piatto", "Tazza", "Vaso"]
+    assert sorted(p["nome"] for p in b.all()) == names
+
+
+def test_catalog_gives_up_after_write_retries(open_storage, monkeypatch):
+    s = open_storage()
+    catalog = Catalog(s)
+    catalog.add({"nome": "Vaso"})
+
+    def always_conflict(*args, **kwargs):
+        raise VersionConflict("sempre")
+
+    monkeypatch.setattr(s, "save_products", always_conflict)
+    with pytest.raises(VersionConflict):
+        catalog.add({"nome": "Piatto"})
+
+
+def test_tracking_fields_merge_across_workers(open_storage):
+    a, b = MessageTracker(open_storage()), MessageTracker(open_storage())
+    a.set_pinned(42, 7)
+    b.set_history(42, [10, 11])
+    a.set_history(42, [10, 11, 12])
+    assert b.pinned(42) == 7
+    assert b.history(42) == [10, 11, 12]
+    assert a.pinned(42) == 7
@@ -0,0 +1,42 @@
+# tests/test_tracking.py
+import pytest
+
+from storage import JsonStorage, SqliteStorage
+from tracking import MessageTracker
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "json":
+        return JsonStorage(tmp_path / "products.json", tmp_path / "categories.json", tmp_path / "sessions.json")
+    return SqliteStorage(tmp_path / "vetrina.db")
+
+
+def tracked(storage, chats):
+    return [c for c in chats if storage.get_tracking(c) is not None]
+
+
+def test_memory_lru_is_bounded():
+    tracker = MessageTracker(max_chats=3)
+    for chat in range(10):
+        tracker.set_history(chat, [chat])
+    assert tracker.stats()["chats"] == 3
+    assert tracker.history(9) == [9]
+    assert tracker.history(0) == []
+
+
+def test_shared_storage_is_bounded(storage):
+    tracker = MessageTracker(storage, max_chats=3, prune_every=1)
+    for chat in range(10):
+        tracker.set_history(chat, [chat])
+    assert tracked(storage, [str(c) for c in range(10)]) == ["7", "8", "9"]
+    # con uno storage condiviso la LRU non tiene copie
+    assert tracker.stats()["chats"] == 0
+    assert tracker.history(9) == [9]
+
+
+def test_expired_chats_are_pruned(storage):
+    tracker = MessageTracker(storage, ttl=60, prune_every=1)
+    tracker.set_pinned(1, 5)
+    storage.prune_tracking(older_than=float("inf"))
+    assert tracker.pinned(1) is None
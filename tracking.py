@@ -0,0 +1,105 @@
+# tracking.py
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+class MessageTracker:
+    """
+    Messaggi del bot da ripulire per ogni chat (cronologia) e /start fissato.
+    - al più max_chats chat, con scadenza dopo ttl secondi di inattività
+      (i bot non possono comunque cancellare messaggi più vecchi di 48 ore)
+    - senza storage o con uno storage di un solo processo: LRU in memoria limitata a max_chats,
+      per chat solo un piccolo array di interi, non liste di oggetti
+    - ogni modifica viene scritta nello storage (solo il campo cambiato: l'altro lo rilegge lo
+      storage sotto il suo lock); se lo storage è condiviso tra worker (SQLite, JSON con il log)
+      le letture passano sempre dallo storage, così la pulizia resta corretta tra processi, e
+      niente viene tenuto nella LRU: il limite si applica allo storage, ogni prune_every scritture
+      si eliminano le chat scadute e quelle oltre le max_chats più recenti
+      (tra una potatura e l'altra le chat possono superare max_chats di al più prune_every)
+    """
+
+    def __init__(self, storage=None, max_chats=10000, ttl=48 * 3600, prune_every=500):
+        self.storage = storage
+        self.max_chats = max(1, int(max_chats))
+        self.ttl = float(ttl)
+        self.prune_every = max(1, int(prune_every))
+        self.read_through = bool(storage is not None and storage.shared)
+        self._lru = OrderedDict()   # chat_id -> [array("q") cronologia, pinned, ultimo uso]
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {"hits": 0, "loads": 0, "evicted": 0, "expired": 0}
+
+    # ---- letture ----
+    def history(self, chat_id):
+        entry = self._entry(chat_id)
+        return entry[0].tolist() if entry else []
+
+    def pinned(self, chat_id):
+        entry = self._entry(chat_id)
+        return entry[1] if entry else None
+
+    # ---- scritture ----
+    def set_history(self, chat_id, message_ids):
+        self._update(chat_id, history=message_ids)
+
+    def set_pinned(self, chat_id, message_id):
+        self._update(chat_id, pinned=message_id)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, chats=len(self._lru), max_chats=self.max_chats)
+
+    # ---- interni ----
+    def _entry(self, chat_id):
+        key = str(chat_id)
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and now - entry[2] > self.ttl:
+                del self._lru[key]
+                self.counters["expired"] += 1
+                entry = None
+            if entry is not None and not self.read_through:
+                self._lru.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry
+        if self.storage is None:
+            return None
+        row = self.storage.get_tracking(key)
+        with self._lock:
+            self.counters["loads"] += 1
+        if row is None or now - row[2] > self.ttl:
+            return None
+        entry = [array("q", row[0]), row[1], row[2]]
+        if not self.read_through:
+            with self._lock:
+                self._put(key, entry)
+        return entry
+
+    def _update(self, chat_id, history=None, pinned=None):
+        key = str(chat_id)
+        current = self._entry(chat_id)
+        with self._lock:
+            entry = [array("q"), None, time.time()] if current is None else [current[0], current[1], time.time()]
+            if history is not None:
+                entry[0] = array("q", history)
+            if pinned is not None:
+                entry[1] = pinned
+            if not self.read_through:
+                self._put(key, entry)
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if self.storage is not None:
+            self.storage.set_tracking(key, history=entry[0].tolist() if history is not None else None,
+                                      pinned=pinned)
+            if prune:
+                self.storage.prune_tracking(time.time() - self.ttl, keep=self.max_chats)
+
+    def _put(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_chats:
+            self._lru.popitem(last=False)
+            self.counters["evicted"] += 1
@@ -0,0 +1,147 @@
+# variants.py
+# Derivati dei media per la vetrina: miniature WebP/JPEG a più larghezze e poster dei video.
+# Dipendenze opzionali: Pillow per le immagini, il binario ffmpeg per il fotogramma dei video.
+# Se mancano il media originale resta comunque utilizzabile, semplicemente senza varianti.
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+from media import ALLOWED_EXTS
+
+
+# larghezze generate (px): card su mobile, card su desktop, schermi ad alta densità
+VARIANT_WIDTHS = (320, 640, 1080)
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+# secondo del video da cui estrarre il poster
+POSTER_AT = 1.0
+
+
+def _pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def available():
+    """Quali generatori sono installati: {"images": bool, "video": bool}."""
+    return {"images": _pillow() is not None, "video": shutil.which("ffmpeg") is not None}
+
+
+def variant_name(src_name, tag, ext):
+    """media/<stem>.<tag>.<ext>: i derivati condividono lo stem (l'hash) dell'originale."""
+    return f"{Path(src_name).stem}.{tag}.{ext}"
+
+
+def derive_variants(rel_path, media_dir, widths=VARIANT_WIDTHS, force=False):
+    """
+    Genera le varianti di rel_path ("media/<nome>") accanto all'originale.
+    Ritorna il dizionario da salvare nel prodotto come "varianti", oppure None se non è
+    stato possibile generare nulla (formato non gestito, dipendenze assenti, file mancante).
+    I file già presenti non vengono rigenerati (salvo force).
+    """
+    media_dir = Path(media_dir)
+    src = media_dir / Path(rel_path).name
+    kind = ALLOWED_EXTS.get(src.suffix.lower())
+    if kind is None or not src.exists():
+        return None
+
+    result = {}
+    if kind == "video":
+        poster = _poster(src, media_dir, force)
+        if poster is None:
+            return None
+        result["poster"] = f"media/{poster.name}"
+        image_src = poster
+    else:
+        image_src = src
+
+    thumbs = _thumbnails(image_src, src.name, media_dir, widths, force)
+    if thumbs:
+        result.update(thumbs)
+    return result or None
+
+
+def _poster(src, media_dir, force):
+    dest = media_dir / variant_name(src.name, "poster", "jpg")
+    if dest.exists() and not force:
+        return dest
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    tmp = dest.with_name(f".{dest.name}.part.jpg")
+    for seek in (POSTER_AT, 0):
+        # i video più corti di POSTER_AT non hanno quel fotogramma: si riprova dall'inizio
+        cmd = [ffmpeg, "-v", "error", "-y", "-ss", str(seek), "-i", str(src),
+               "-frames:v", "1", "-q:v", "3", str(tmp)]
+        try:
+            subprocess.run(cmd, check=True, timeout=60, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (subprocess.SubprocessError, OSError):
+            continue
+        if tmp.exists() and tmp.stat().st_size:
+            os.replace(tmp, dest)
+            return dest
+    if tmp.exists():
+        tmp.unlink()
+    return None
+
+
+def _thumbnails(image_src, src_name, media_dir, widths, force):
+    Image = _pillow()
+    if Image is None:
+        return None
+    try:
+        with Image.open(image_src) as im:
+            im.seek(0)   # GIF animate: primo fotogramma
+            im = im.convert("RGB")
+            width, height = im.size
+            # niente ingrandimenti: oltre la larghezza originale basta l'ultima variante
+            targets = sorted({w for w in widths if w < width} | {min(width, max(widths))})
+            srcset = []
+            for w in targets:
+                h = max(1, round(height * w / width))
+                resized = None
+                entry = {"w": w, "h": h}
+                for fmt, ext, opts in (("WEBP", "webp", {"quality": WEBP_QUALITY, "method": 4}),
+                                       ("JPEG", "jpg", {"quality": JPEG_QUALITY, "optimize": True,
+                                                        "progressive": True})):
+                    dest = media_dir / variant_name(src_name, f"w{w}", ext)
+                    if force or not dest.exists():
+                        if resized is None:
+                            resized = im if w == width else im.resize((w, h), Image.LANCZOS)
+                        tmp = dest.with_name(f".{dest.name}.part")
+                        resized.save(tmp, fmt, **opts)
+                        os.replace(tmp, dest)
+                    entry[ext] = f"media/{dest.name}"
+                srcset.append(entry)
+    except (OSError, ValueError):
+        return None
+    return {"width": width, "height": height, "srcset": srcset}
+
+
+def backfill(catalog, media_dir, widths=VARIANT_WIDTHS, force=False):
+    """Genera le varianti per i prodotti che non le hanno ancora; ritorna quanti sono stati aggiornati."""
+    updated = 0
+    for p in catalog.all():
+        if not p.get("immagine") or (p.get("varianti") and not force):
+            continue
+        variants = derive_variants(p["immagine"], media_dir, widths, force=force)
+        if variants and catalog.update(p["id"], varianti=variants):
+            updated += 1
+    return updated
+
+
+if __name__ == "__main__":
+    # python variants.py backfill [--force]
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args != ["backfill"]:
+        print("Uso: python variants.py backfill [--force]")
+        sys.exit(1)
+    print(f"Generatori disponibili: {available()}")
+    import bot
+    n = backfill(bot.catalog, bot.MEDIA_DIR, force="--force" in sys.argv)
+    print(f"Prodotti aggiornati: {n}")
@@ -3,110 +3,344 @@ document.addEventListener('DOMContentLoaded', () => {
 
   const griglia = document.querySelector('.prodotti');
   const filtroSelect = document.getElementById('filtro-tipologia');
-  let tuttiIProdotti = []; // Array per memorizzare tutti i prodotti caricati dal JSON
+  const ordinaSelect = document.getElementById('ordina');
 
-  // Funzione per mostrare/nascondere le card dei prodotti in base al filtro selezionato
-  function filtraProdotti() {
-    const tipologiaSelezionata = filtroSelect.value;
-    const tutteLeCard = document.querySelectorAll('.prodotto');
+  // Prodotti per pagina: il primo disegno costa quanto una pagina, non quanto il catalogo
+  const PRODOTTI_PER_PAGINA = 24;
 
-    tutteLeCard.forEach(card => {
-      // Se è selezionato "Tutti" OPPURE la tipologia della card corrisponde a quella selezionata, la mostriamo
-      if (tipologiaSelezionata === 'tutti' || card.dataset.tipologia === tipologiaSelezionata) {
-        card.style.display = 'block'; // 'block' è il valore di visualizzazione di default per un div
+  // Stato della lista corrente (filtro + ordinamento) e della paginazione a cursore
+  let prossimoCursore = null;
+  let caricamentoInCorso = false;
+  let generazione = 0; // cambia ad ogni nuovo filtro: le risposte vecchie vengono ignorate
+
+  // Elemento in fondo alla griglia: quando diventa visibile si carica la pagina successiva
+  const sentinella = document.createElement('div');
+  sentinella.className = 'sentinella';
+  sentinella.style.gridColumn = '1 / -1';
+
+  // Indirizzo del bot che espone /api e /media (vuoto = stesso dominio della pagina)
+  const API_BASE = window.VETRINA_API || '';
+
+  // Percorso "media/..." del catalogo -> URL servito dal bot; gli URL assoluti
+  // (http://, https://, //) restano com'erano (stessa regola di prerender.py)
+  function urlMedia(percorso) {
+    if (/^(https?:)?\/\//i.test(percorso)) {
+      return percorso;
+    }
+    return API_BASE ? `${API_BASE}/${percorso.replace(/^\/+/, '')}` : percorso;
+  }
+
+  // Catalogo pubblicato dal bot (manifest + snapshot immutabile): se configurato, filtro,
+  // ordinamento e pagine si calcolano qui e all'apertura bastano due richieste (lo snapshot
+  // resta nella cache del browser finché il catalogo non cambia)
+  const CATALOG_BASE = window.VETRINA_CATALOG || '';
+  let usaCatalogoStatico = Boolean(CATALOG_BASE);
+  let catalogoStatico = null; // Promise di {version, categorie, prodotti}
+  let ordinamentoStatico = { chiave: null, lista: [] };
+
+  async function caricaCatalogoStatico() {
+    const risposta = await fetch(`${CATALOG_BASE}/catalog-manifest.json`, { cache: 'no-cache' });
+    if (!risposta.ok) {
+      throw new Error(`Manifest non disponibile: ${risposta.statusText}`);
+    }
+    const manifest = await risposta.json();
+    const snapshot = await fetch(`${CATALOG_BASE}/${manifest.file}`);
+    if (!snapshot.ok) {
+      throw new Error(`Snapshot non disponibile: ${snapshot.statusText}`);
+    }
+    return snapshot.json();
+  }
+
+  // Stesse regole di /api/catalog: prezzi come "9,50" o "€ 12", prodotti senza prezzo in fondo
+  function prezzoNumerico(valore) {
+    const trovato = String(valore ?? '').match(/\d+(?:[.,]\d+)?/);
+    return trovato ? parseFloat(trovato[0].replace(',', '.')) : null;
+  }
+
+  function confronta(a, b, ordine) {
+    if (ordine === 'prezzo' || ordine === '-prezzo') {
+      const pa = prezzoNumerico(a.prodotto.prezzo);
+      const pb = prezzoNumerico(b.prodotto.prezzo);
+      if ((pa === null) !== (pb === null)) {
+        return pa === null ? 1 : -1;
+      }
+      const diff = ordine === 'prezzo' ? (pa ?? 0) - (pb ?? 0) : (pb ?? 0) - (pa ?? 0);
+      return diff || (ordine === 'prezzo' ? a.prodotto.id - b.prodotto.id : b.prodotto.id - a.prodotto.id);
+    }
+    if (ordine === 'nome' || ordine === '-nome') {
+      const na = (a.prodotto.nome || '').trim().toLowerCase();
+      const nb = (b.prodotto.nome || '').trim().toLowerCase();
+      const diff = na < nb ? -1 : (na > nb ? 1 : a.prodotto.id - b.prodotto.id);
+      return ordine === 'nome' ? diff : -diff;
+    }
+    return a.posizione - b.posizione;
+  }
+
+  // Una pagina dallo snapshot; il cursore è la posizione nella lista filtrata e ordinata
+  function paginaStatica(catalogo, cursore) {
+    const tipologia = filtroSelect.value && filtroSelect.value !== 'tutti' ? filtroSelect.value : null;
+    const ordine = ordinaSelect ? ordinaSelect.value : 'default';
+    const chiave = `${catalogo.version}|${tipologia}|${ordine}`;
+    if (ordinamentoStatico.chiave !== chiave) {
+      const lista = catalogo.prodotti
+        .map((prodotto, posizione) => ({ prodotto, posizione }))
+        .filter(x => !tipologia || (x.prodotto.tipologia ?? 'Senza categoria') === tipologia);
+      lista.sort((a, b) => confronta(a, b, ordine));
+      ordinamentoStatico = { chiave, lista };
+    }
+    const lista = ordinamentoStatico.lista;
+    const inizio = cursore || 0;
+    const fine = inizio + PRODOTTI_PER_PAGINA;
+    return {
+      version: catalogo.version,
+      categorie: catalogo.categorie,
+      total: lista.length,
+      items: lista.slice(inizio, fine).map(x => x.prodotto),
+      next: fine < lista.length ? fine : null,
+    };
+  }
+
+  // Una pagina del catalogo: dallo snapshot pubblicato se disponibile, altrimenti dal server
+  async function caricaPagina(cursore) {
+    if (usaCatalogoStatico) {
+      try {
+        if (!catalogoStatico) {
+          catalogoStatico = caricaCatalogoStatico();
+        }
+        return paginaStatica(await catalogoStatico, cursore);
+      } catch (error) {
+        console.warn('Catalogo pubblicato non disponibile, uso /api/catalog:', error);
+        usaCatalogoStatico = false;
+        catalogoStatico = null;
+        // lo snapshot si scarica alla prima pagina richiesta: la prima in assoluto oppure,
+        // dopo la prima pagina disegnata dal server, la seconda (cursore del server)
+        cursore = cursore === null ? null : (griglia.dataset.next || null);
+      }
+    }
+    const parametri = new URLSearchParams({ limit: PRODOTTI_PER_PAGINA, sort: ordinaSelect ? ordinaSelect.value : 'default' });
+    if (filtroSelect.value && filtroSelect.value !== 'tutti') {
+      parametri.set('tipologia', filtroSelect.value);
+    }
+    if (cursore) {
+      parametri.set('cursor', cursore);
+    }
+    const response = await fetch(`${API_BASE}/api/catalog?${parametri}`);
+    if (!response.ok) {
+      throw new Error(`Errore nel caricamento del catalogo: ${response.statusText}`);
+    }
+    return response.json();
+  }
+
+  // Larghezza occupata da una card (vedi le colonne della griglia in vetrina.html)
+  const SIZES_CARD = '(min-width: 1200px) 25vw, (min-width: 901px) 33vw, 50vw';
+
+  // I video partono solo quando la card è visibile e si fermano quando esce dallo schermo
+  const osservatoreVideo = 'IntersectionObserver' in window ? new IntersectionObserver(entries => {
+    entries.forEach(entry => {
+      if (entry.isIntersecting) {
+        entry.target.play().catch(() => {});
       } else {
-        // Altrimenti, la nascondiamo
-        card.style.display = 'none';
+        entry.target.pause();
       }
     });
+  }, { rootMargin: '100px' }) : null;
+
+  // Crea l'elemento media della card usando le varianti generate dal bot (miniature e poster)
+  function creaMedia(prodotto) {
+    const mediaUrl = urlMedia(prodotto.immagine);
+    const varianti = prodotto.varianti || {};
+    const fileExtension = mediaUrl.split('.').pop().toLowerCase();
+
+    if (fileExtension === 'mp4' || fileExtension === 'webm' || fileExtension === 'ogg' || fileExtension === 'mov' || fileExtension === 'm4v') {
+      // È un video: niente download finché non serve, il poster fa da anteprima
+      const videoElement = document.createElement('video');
+      videoElement.src = mediaUrl;
+      videoElement.controls = true; // Mostra i controlli di riproduzione
+      videoElement.muted = true; // Necessario per la riproduzione automatica
+      videoElement.loop = true;
+      videoElement.playsInline = true;
+      videoElement.preload = 'none';
+      if (varianti.poster) {
+        videoElement.poster = urlMedia(varianti.poster);
+      }
+      if (osservatoreVideo) {
+        osservatoreVideo.observe(videoElement);
+      }
+      return videoElement;
+    }
+
+    // Immagine: miniature WebP con ripiego JPEG, caricate solo quando si avvicinano allo schermo
+    const imgElement = document.createElement('img');
+    imgElement.alt = prodotto.nome;
+    imgElement.loading = 'lazy';
+    imgElement.decoding = 'async';
+    const srcset = varianti.srcset || [];
+    if (!srcset.length) {
+      imgElement.src = mediaUrl;
+      return imgElement;
+    }
+    if (varianti.width && varianti.height) {
+      imgElement.width = varianti.width;
+      imgElement.height = varianti.height;
+    }
+    imgElement.src = urlMedia(srcset[0].jpg);
+    imgElement.srcset = srcset.map(v => `${urlMedia(v.jpg)} ${v.w}w`).join(', ');
+    imgElement.sizes = SIZES_CARD;
+
+    const picture = document.createElement('picture');
+    const webp = document.createElement('source');
+    webp.type = 'image/webp';
+    webp.srcset = srcset.map(v => `${urlMedia(v.webp)} ${v.w}w`).join(', ');
+    webp.sizes = SIZES_CARD;
+    picture.appendChild(webp);
+    picture.appendChild(imgElement);
+    return picture;
   }
 
-  // Funzione principale che si avvia all'apertura della pagina
-  async function initVetrina() {
+  // Crea la card di un prodotto
+  function creaCard(prodotto) {
+    const prodottoDiv = document.createElement('div');
+    prodottoDiv.classList.add('prodotto');
+    prodottoDiv.dataset.tipologia = prodotto.tipologia;
+
+    // Crea il div per il media
+    const mediaDiv = document.createElement('div');
+    mediaDiv.classList.add('media');
+
+    // Logica per visualizzare IMIMAGINE o VIDEO
+    if (prodotto.immagine) {
+      mediaDiv.appendChild(creaMedia(prodotto));
+    } else {
+      // Se non c'è immagine, mostra un placeholder o lascia vuoto
+      mediaDiv.innerHTML = '<p style="color: #ccc;">Nessun media</p>';
+    }
+
+    prodottoDiv.appendChild(mediaDiv); // Aggiunge il media al div del prodotto
+
+    // Aggiunge gli altri dettagli del prodotto
+    const titoloDiv = document.createElement('div');
+    titoloDiv.classList.add('titolo');
+    titoloDiv.textContent = prodotto.nome;
+    prodottoDiv.appendChild(titoloDiv);
+
+    const prezzoDiv = document.createElement('div');
+    prezzoDiv.classList.add('prezzo');
+    prezzoDiv.textContent = `€${prodotto.prezzo}`;
+    prodottoDiv.appendChild(prezzoDiv);
+
+    return prodottoDiv;
+  }
+
+  // Popola il menu a tendina in un colpo solo (niente innerHTML += in un ciclo)
+  function popolaTipologie(tipologie) {
+    const selezionata = filtroSelect.value || 'tutti';
+    const frammento = document.createDocumentFragment();
+    const tutti = document.createElement('option');
+    tutti.value = 'tutti';
+    tutti.textContent = 'Tutti';
+    frammento.appendChild(tutti);
+    tipologie.forEach(tipologia => {
+      const option = document.createElement('option');
+      option.value = tipologia;
+      option.textContent = tipologia;
+      frammento.appendChild(option);
+    });
+    filtroSelect.replaceChildren(frammento);
+    filtroSelect.value = tipologie.includes(selezionata) ? selezionata : 'tutti';
+  }
+
+  // Carica e disegna la pagina successiva: le card entrano nel DOM con un solo inserimento
+  async function paginaSuccessiva() {
+    if (caricamentoInCorso || prossimoCursore === undefined) {
+      return;
+    }
+    caricamentoInCorso = true;
+    const mia = generazione;
     try {
-      // Carica i dati dal file 'products.json'
-      // Utilizziamo un timestamp per bypassare la cache del browser e avere i dati sempre aggiornati
-      const response = await fetch(`products.json?_t=${new Date().getTime()}`); 
-      // Controlla se il file è stato trovato e caricato correttamente
-      if (!response.ok) {
-        throw new Error(`Errore nel caricamento del file JSON: ${response.statusText}`);
+      const pagina = await caricaPagina(prossimoCursore);
+      if (mia !== generazione) {
+        return; // nel frattempo è cambiato il filtro
       }
-      tuttiIProdotti = await response.json();
-
-      // --- 1. Popola il menu a tendina con le tipologie ---
-      // Estrae tutte le tipologie uniche dai prodotti, usando Set per eliminare i duplicati
-      const tipologieUniche = [...new Set(tuttiIProdotti.map(p => p.tipologia))];
-      
-      // Aggiunge l'opzione "Tutti" come prima scelta
-      filtroSelect.innerHTML = '<option value="tutti">Tutti</option>';
-
-      // Per ogni tipologia unica, crea un'opzione nel menu
-      tipologieUniche.forEach(tipologia => {
-        const optionHTML = `<option value="${tipologia}">${tipologia}</option>`;
-        filtroSelect.innerHTML += optionHTML;
-      });
-
-      // --- 2. Crea e visualizza le card di tutti i prodotti ---
-      griglia.innerHTML = ''; // Svuota la griglia per sicurezza
-      tuttiIProdotti.forEach(prodotto => {
-        const prodottoDiv = document.createElement('div');
-        prodottoDiv.classList.add('prodotto');
-        prodottoDiv.dataset.tipologia = prodotto.tipologia; // Aggiunge l'attributo per il filtraggio
-
-        // Crea il div per il media
-        const mediaDiv = document.createElement('div');
-        mediaDiv.classList.add('media');
-
-        // Logica per visualizzare IMIMAGINE o VIDEO
-        if (prodotto.immagine) {
-            const mediaUrl = prodotto.immagine;
-            const fileExtension = mediaUrl.split('.').pop().toLowerCase();
-            
-            if (fileExtension === 'mp4' || fileExtension === 'webm' || fileExtension === 'ogg') {
-                // È un video
-                const videoElement = document.createElement('video');
-                videoElement.src = mediaUrl;
-                videoElement.controls = true; // Mostra i controlli di riproduzione
-                videoElement.muted = true; // Opzionale: muta all'inizio
-                videoElement.autoplay = true; // Opzionale: avvia automaticamente
-                videoElement.loop = true; // Opzionale: riproduci in loop
-                mediaDiv.appendChild(videoElement);
-            } else {
-                // Presumiamo sia un'immagine
-                const imgElement = document.createElement('img');
-                imgElement.src = mediaUrl;
-                imgElement.alt = prodotto.nome;
-                mediaDiv.appendChild(imgElement);
-            }
-        } else {
-            // Se non c'è immagine, mostra un placeholder o lascia vuoto
-            mediaDiv.innerHTML = '<p style="color: #ccc;">Nessun media</p>';
-        }
-
-        prodottoDiv.appendChild(mediaDiv); // Aggiunge il media al div del prodotto
+      if (prossimoCursore === null) {
+        popolaTipologie(pagina.categorie);
+      }
+      const frammento = document.createDocumentFragment();
+      pagina.items.forEach(prodotto => frammento.appendChild(creaCard(prodotto)));
+      griglia.insertBefore(frammento, sentinella);
+      // undefined = lista finita
+      prossimoCursore = pagina.next || undefined;
+      osservatoreLista.unobserve(sentinella);
+      if (prossimoCursore !== undefined) {
+        // ri-osservare fa ripartire il controllo: se la sentinella è ancora visibile si carica ancora
+        osservatoreLista.observe(sentinella);
+      }
+    } finally {
+      if (mia === generazione) {
+        caricamentoInCorso = false;
+      }
+    }
+  }
 
-        // Aggiunge gli altri dettagli del prodotto
-        const titoloDiv = document.createElement('div');
-        titoloDiv.classList.add('titolo');
-        titoloDiv.textContent = prodotto.nome;
-        prodottoDiv.appendChild(titoloDiv);
+  // Scorrimento infinito: la pagina successiva parte poco prima di arrivare in fondo
+  const osservatoreLista = new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting)) {
+      paginaSuccessiva().catch(mostraErrore);
+    }
+  }, { rootMargin: '600px' });
 
-        const prezzoDiv = document.createElement('div');
-        prezzoDiv.classList.add('prezzo');
-        prezzoDiv.textContent = `€${prodotto.prezzo}`;
-        prodottoDiv.appendChild(prezzoDiv);
+  function mostraErrore(error) {
+    // Se c'è un errore (es. API non raggiungibile), lo mostra nella console
+    console.error("Impossibile caricare la vetrina:", error);
+    griglia.innerHTML = `<p style="text-align: center; grid-column: 1 / -1; color: red;">Errore nel caricamento dei prodotti. Controlla la console per i dettagli.</p>`;
+  }
 
-        griglia.appendChild(prodottoDiv); // Aggiunge la card completa alla griglia
-      });
+  // Riparte dalla prima pagina (apertura, cambio filtro o ordinamento)
+  function ricaricaLista() {
+    generazione += 1;
+    caricamentoInCorso = false;
+    prossimoCursore = null;
+    griglia.replaceChildren(sentinella);
+    osservatoreLista.observe(sentinella);
+    paginaSuccessiva().catch(mostraErrore);
+  }
 
-      // --- 3. Collega la funzione 'filtraProdotti' all'evento 'change' del menu ---
-      // Ogni volta che l'utente cambia la selezione, la funzione verrà eseguita
-      filtroSelect.addEventListener('change', filtraProdotti);
+  // Prima pagina e tipologie già disegnate dal server (vetrina servita dal bot): si riusano,
+  // si aggancia lo scorrimento infinito e si prosegue dalla pagina successiva
+  function idrataPrerender() {
+    const dati = griglia.dataset;
+    if (!('prerender' in dati)) {
+      return false;
+    }
+    // il browser può aver ripristinato filtro o ordinamento (es. tornando indietro): lista da rifare
+    if ((filtroSelect.value || 'tutti') !== 'tutti' || (ordinaSelect && ordinaSelect.value !== 'default')) {
+      return false;
+    }
+    generazione += 1;
+    caricamentoInCorso = false;
+    if (dati.next) {
+      // il catalogo pubblicato pagina per posizione, /api/catalog con il cursore del server
+      prossimoCursore = usaCatalogoStatico ? Number(dati.offset) : dati.next;
+    } else {
+      prossimoCursore = undefined;
+    }
+    griglia.appendChild(sentinella);
+    if (osservatoreVideo) {
+      griglia.querySelectorAll('video').forEach(video => osservatoreVideo.observe(video));
+    }
+    if (prossimoCursore !== undefined) {
+      osservatoreLista.observe(sentinella);
+    }
+    return true;
+  }
 
-    } catch (error) {
-      // Se c'è un errore (es. file JSON non trovato o malformato), lo mostra nella console
-      console.error("Impossibile inizializzare la vetrina:", error);
-      griglia.innerHTML = `<p style="text-align: center; grid-column: 1 / -1; color: red;">Errore nel caricamento dei prodotti. Controlla la console per i dettagli.</p>`;
+  // Funzione principale che si avvia all'apertura della pagina
+  function initVetrina() {
+    filtroSelect.addEventListener('change', ricaricaLista);
+    if (ordinaSelect) {
+      ordinaSelect.addEventListener('change', ricaricaLista);
+    }
+    if (!idrataPrerender()) {
+      ricaricaLista();
     }
   }
 